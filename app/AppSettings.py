@@ -1,8 +1,8 @@
+import json
 import pickle
-from collections import deque
 from enum import unique, Enum
 
-from PyQt5.QtCore import QObject, pyqtSignal, QSettings
+from PyQt5.QtCore import QObject, pyqtSignal, QSettings, QTimer, QCoreApplication
 from PyQt5.QtGui import QFont
 
 import app
@@ -12,16 +12,59 @@ class Settings(QObject):
     """
     A class that can read and write application settings. The class can also fire events
     when a setting changes.
-    App specific settings are stored as a dictionary that is saved as a byte stream
+    Every setting is saved under its own key as JSON and checked against a schema of types when it is read.
+    Values are cached in memory, so reads never go to QSettings, and changed keys are written back together
+    shortly after the change
     """
     settings_change_event = pyqtSignal(object, object)
 
-    def __init__(self, app_name, default_settings):
+    _GROUP = "settings"
+    _VERSION_KEY = "schema_version"
+    _PERSIST_DELAY_MSECS = 500
+
+    def __init__(self, app_name, schema):
         super().__init__()
-        self._app_settings = QSettings("github.com/ag-sd", app_name)
-        self._config = self._app_settings.value("app_settings")
-        if self._config is None:
-            self._config = default_settings
+        self._app_name = app_name
+        self._schema = schema
+        self._app_settings = None
+        self._config = None
+        self._dirty = set()
+        self._persist_timer = None
+
+    def _load(self):
+        """
+        Reads the settings the first time they are needed rather than when the module is imported
+        :return:
+        """
+        if self._config is not None:
+            return
+        self._app_settings = QSettings("github.com/ag-sd", self._app_name)
+        self._migrate()
+        self._config = {}
+        for key, expected_type in self._schema.items():
+            stored = self._app_settings.value(f"{self._GROUP}/{key.value}")
+            if stored is None:
+                continue
+            try:
+                value = json.loads(stored)
+            except (TypeError, ValueError):
+                app.logger.warning(f"Ignoring unreadable setting {key.value}")
+                continue
+            if isinstance(value, expected_type):
+                self._config[key] = value
+            else:
+                app.logger.warning(f"Ignoring setting {key.value}, expected {expected_type} but got {type(value)}")
+
+    def _migrate(self):
+        """
+        Brings settings saved by an older version of the application up to the current schema version
+        :return:
+        """
+        version = self._app_settings.value(self._VERSION_KEY, 0, type=int)
+        for target in range(version + 1, SCHEMA_VERSION + 1):
+            app.logger.info(f"Migrating settings to version {target}")
+            _MIGRATIONS[target](self._app_settings, self._GROUP)
+            self._app_settings.setValue(self._VERSION_KEY, target)
 
     def apply_setting(self, key, value):
         """
@@ -31,14 +74,46 @@ class Settings(QObject):
         :return:
         """
         app.logger.info(f"{key} -> {value}")
+        self._load()
         self._config[key] = value
-        self._app_settings.setValue("app_settings", self._config)
+        self._dirty.add(key)
+        self._schedule_persist()
         self.settings_change_event.emit(key, value)
 
     def get_setting(self, key, default=None):
-        if self._config.__contains__(key):
-            return self._config[key]
-        return default
+        if self._config is None:
+            self._load()
+        return self._config.get(key, default)
+
+    def persist(self):
+        """
+        Writes the settings that changed since the last write
+        :return:
+        """
+        if not self._dirty:
+            return
+        for key in self._dirty:
+            self._app_settings.setValue(f"{self._GROUP}/{key.value}", json.dumps(self._config[key]))
+        self._dirty.clear()
+        self._app_settings.sync()
+
+    def _schedule_persist(self):
+        """
+        Changes made in quick succession are written together. Without an event loop they are written right away
+        :return:
+        """
+        application = QCoreApplication.instance()
+        if application is None:
+            self.persist()
+            return
+        if self._persist_timer is None:
+            self._persist_timer = QTimer(self)
+            self._persist_timer.setSingleShot(True)
+            self._persist_timer.setInterval(self._PERSIST_DELAY_MSECS)
+            self._persist_timer.timeout.connect(self.persist)
+            application.aboutToQuit.connect(self.persist)
+        if not self._persist_timer.isActive():
+            self._persist_timer.start()
 
 
 @unique
@@ -46,8 +121,25 @@ class SettingsKeys(Enum):
     recent_documents = "recent_documents"
     max_recent = "max_recent"
     toggle_attributes = "show_attributes"
+    namespace_uris = "show_namespace_uris"
     font = "font"
     syntax_highlighting = "syntax_highlighting."
+    parallel_parse_threshold = "parallel_parse_threshold"
+    parallel_parse_workers = "parallel_parse_workers"
+    log_level = "log_level"
+    trace_sample = "trace_sample"
+    expand_node_budget = "expand_node_budget"
+    expand_depth_budget = "expand_depth_budget"
+    memory_budget_mb = "memory_budget_mb"
+    tree_item_budget = "tree_item_budget"
+    table_memory_rows = "table_memory_rows"
+    large_value_length = "large_value_length"
+    collection_cached_documents = "collection_cached_documents"
+    remember_view_state = "remember_view_state"
+    view_states = "view_states"
+    last_schema = "last_schema"
+    single_instance = "single_instance"
+    html_profile = "html_profile"
 
 
 __DEFAULT_COLOR_THEME = {
@@ -59,12 +151,76 @@ __DEFAULT_COLOR_THEME = {
     "highlight": "#ffff00"
 }
 
+SCHEMA_VERSION = 1
+
+_SCHEMA = {
+    SettingsKeys.recent_documents: list,
+    SettingsKeys.max_recent: int,
+    SettingsKeys.toggle_attributes: bool,
+    SettingsKeys.namespace_uris: bool,
+    SettingsKeys.font: str,
+    SettingsKeys.syntax_highlighting: dict,
+    SettingsKeys.parallel_parse_threshold: int,
+    SettingsKeys.parallel_parse_workers: int,
+    SettingsKeys.log_level: str,
+    SettingsKeys.trace_sample: int,
+    SettingsKeys.expand_node_budget: int,
+    SettingsKeys.expand_depth_budget: int,
+    SettingsKeys.memory_budget_mb: int,
+    SettingsKeys.tree_item_budget: int,
+    SettingsKeys.table_memory_rows: int,
+    SettingsKeys.large_value_length: int,
+    SettingsKeys.collection_cached_documents: int,
+    SettingsKeys.remember_view_state: bool,
+    SettingsKeys.view_states: dict,
+    SettingsKeys.last_schema: str,
+    SettingsKeys.single_instance: bool,
+    SettingsKeys.html_profile: str,
+}
+
+
+def _migrate_pickled_settings(app_settings, group):
+    """
+    Version 1 splits the single pickled dictionary of settings into one JSON value per key
+    """
+    legacy = app_settings.value("app_settings")
+    if isinstance(legacy, dict):
+        for key, value in legacy.items():
+            if key not in _SCHEMA:
+                continue
+            if key == SettingsKeys.syntax_highlighting:
+                value = pickle.loads(value)
+            elif key == SettingsKeys.recent_documents:
+                value = list(value)
+            app_settings.setValue(f"{group}/{key.value}", json.dumps(value))
+    app_settings.remove("app_settings")
+
+
+_MIGRATIONS = {
+    1: _migrate_pickled_settings,
+}
+
 settings = Settings(
     app.__APP_NAME__,
-    {}
+    _SCHEMA
 )
 
 
+def apply_logging_settings():
+    app.configure_logging(settings.get_setting(SettingsKeys.log_level),
+                          settings.get_setting(SettingsKeys.trace_sample))
+
+
+def set_log_level(level):
+    settings.apply_setting(SettingsKeys.log_level, level)
+    app.configure_logging(level=level)
+
+
+def set_trace_sample(sample):
+    settings.apply_setting(SettingsKeys.trace_sample, sample)
+    app.configure_logging(trace_sample=sample)
+
+
 def show_attributes():
     return settings.get_setting(SettingsKeys.toggle_attributes, True)
 
@@ -73,6 +229,14 @@ def set_show_attributes(value):
     settings.apply_setting(SettingsKeys.toggle_attributes, value)
 
 
+def show_namespace_uris():
+    return settings.get_setting(SettingsKeys.namespace_uris, False)
+
+
+def set_show_namespace_uris(value):
+    settings.apply_setting(SettingsKeys.namespace_uris, value)
+
+
 def get_recent_files():
     return settings.get_setting(SettingsKeys.recent_documents)
 
@@ -90,33 +254,132 @@ def set_font(_font):
     settings.apply_setting(SettingsKeys.font, _font.toString())
 
 
+def parallel_parse_threshold():
+    from app import XMLLoader
+    return settings.get_setting(SettingsKeys.parallel_parse_threshold, XMLLoader.DEFAULT_PARALLEL_THRESHOLD)
+
+
+def parallel_parse_workers():
+    # None lets the loader use every core
+    return settings.get_setting(SettingsKeys.parallel_parse_workers, None)
+
+
+def expand_node_budget():
+    return settings.get_setting(SettingsKeys.expand_node_budget, 5000)
+
+
+def expand_depth_budget():
+    # A negative depth expands all the way down
+    return settings.get_setting(SettingsKeys.expand_depth_budget, -1)
+
+
+def memory_budget():
+    """
+    :return: the memory the application should stay under in bytes, or None if there is no budget
+    """
+    budget = settings.get_setting(SettingsKeys.memory_budget_mb, 2048)
+    return budget * 1024 * 1024 if budget > 0 else None
+
+
+def tree_item_budget():
+    """
+    :return: how many tree items are built before the children of collapsed nodes are released, or None if there
+    is no limit
+    """
+    budget = settings.get_setting(SettingsKeys.tree_item_budget, 500000)
+    return budget if budget > 0 else None
+
+
+def table_memory_rows():
+    """
+    :return: how many rows of a path table are kept in memory before the rest are spilled to disk
+    """
+    from app import XMLColumns
+    return settings.get_setting(SettingsKeys.table_memory_rows, XMLColumns.DEFAULT_MEMORY_ROWS)
+
+
+def collection_cached_documents():
+    """
+    :return: how many parsed files of a collection are kept in memory
+    """
+    from app import XMLCollection
+    return settings.get_setting(SettingsKeys.collection_cached_documents, XMLCollection.DEFAULT_CACHED_DOCUMENTS)
+
+
+def large_value_length():
+    """
+    :return: values longer than this many characters are shown shortened, the whole value is shown on request
+    """
+    return settings.get_setting(SettingsKeys.large_value_length, 4096)
+
+
+def remember_view_state():
+    return settings.get_setting(SettingsKeys.remember_view_state, True)
+
+
+def view_state(file):
+    """
+    :return: the saved view of a file, see XMLViewState.ViewState.to_json, or None
+    """
+    return settings.get_setting(SettingsKeys.view_states, {}).get(file)
+
+
+def save_view_state(file, state):
+    # The views of as many files as the recent files list are kept, the most recently saved last
+    max_recent_files = settings.get_setting(SettingsKeys.max_recent, 10)
+    states = {saved: value for saved, value in settings.get_setting(SettingsKeys.view_states, {}).items()
+              if saved != file}
+    states[file] = state
+    settings.apply_setting(SettingsKeys.view_states, dict(list(states.items())[-max_recent_files:]))
+
+
+def last_schema():
+    return settings.get_setting(SettingsKeys.last_schema, "")
+
+
+def set_last_schema(schema):
+    if schema != last_schema():
+        settings.apply_setting(SettingsKeys.last_schema, schema)
+
+
+def single_instance():
+    # Later launches hand their files to the running instance
+    return settings.get_setting(SettingsKeys.single_instance, True)
+
+
+def html_profile():
+    """
+    :return: how much of an HTML document is loaded, one of XMLLoader.HTML_PROFILES
+    """
+    from app import XMLLoader
+    profile = settings.get_setting(SettingsKeys.html_profile, XMLLoader.HTML_LEAN)
+    return profile if profile in XMLLoader.HTML_PROFILES else XMLLoader.HTML_LEAN
+
+
+def set_html_profile(profile):
+    settings.apply_setting(SettingsKeys.html_profile, profile)
+
+
 def color_theme():
-    pickled = settings.get_setting(SettingsKeys.syntax_highlighting)
-    if pickled:
-        return pickle.loads(pickled)
-    else:
-        return __DEFAULT_COLOR_THEME
+    """
+    The color theme is shared, callers that change it should change a copy and save it with set_color_theme
+    """
+    return settings.get_setting(SettingsKeys.syntax_highlighting, __DEFAULT_COLOR_THEME)
 
 
 def set_color_theme(theme):
-    settings.apply_setting(SettingsKeys.syntax_highlighting, pickle.dumps(theme))
+    settings.apply_setting(SettingsKeys.syntax_highlighting, theme)
 
 
 def add_to_recent(file):
-    recent_files = settings.get_setting(SettingsKeys.recent_documents, deque([]))
+    recent_files = settings.get_setting(SettingsKeys.recent_documents, [])
     max_recent_files = settings.get_setting(SettingsKeys.max_recent, 10)
     # Move the current file to the bottom
-    remove_from_recent(file)
-    recent_files.append(file)
-    while len(recent_files) > max_recent_files:
-        recent_files.popleft()
-    settings.apply_setting(SettingsKeys.recent_documents, recent_files)
+    recent_files = [recent for recent in recent_files if recent != file] + [file]
+    settings.apply_setting(SettingsKeys.recent_documents, recent_files[-max_recent_files:])
 
 
 def remove_from_recent(file):
-    recent_files = settings.get_setting(SettingsKeys.recent_documents, deque([]))
-    try:
-        recent_files.remove(file)
-    except ValueError:
-        pass
-
+    recent_files = settings.get_setting(SettingsKeys.recent_documents, [])
+    if file in recent_files:
+        settings.apply_setting(SettingsKeys.recent_documents, [recent for recent in recent_files if recent != file])
@@ -0,0 +1,185 @@
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+import app
+
+# How many spans are kept for the trace export. Older spans are dropped, aggregates are kept forever
+MAX_EVENTS = 20000
+# How many spans of regions that run many times a second, such as painting, are kept. They have their own buffer
+# so that scrolling does not push every other span out of the trace
+MAX_FREQUENT_EVENTS = 2000
+
+_lock = threading.Lock()
+_events = deque(maxlen=MAX_EVENTS)
+_frequent_events = deque(maxlen=MAX_FREQUENT_EVENTS)
+_stats = {}
+_counters = {}
+_epoch_ns = app.STARTED_NS
+
+enabled = True
+
+
+class Span:
+    """
+    Times a named region of code. Use as a context manager, the duration is available after the block exits
+    """
+    __slots__ = ("name", "args", "start", "duration", "frequent")
+
+    def __init__(self, name, args, frequent=False):
+        self.name = name
+        self.args = args
+        self.start = 0
+        self.duration = 0
+        self.frequent = frequent
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *_):
+        self.duration = time.perf_counter_ns() - self.start
+        if enabled:
+            _record(self)
+        return False
+
+    @property
+    def seconds(self):
+        return self.duration / 1e9
+
+
+def span(name, **args):
+    """
+    Creates a span for a named region of code
+    :param name: the name of the span, for example "parse" or "fetchMore"
+    :param args: extra details to show in the trace
+    :return: a Span context manager
+    """
+    return Span(name, args)
+
+
+def frequent_span(name, **args):
+    """
+    Creates a span for a region that runs many times a second, for example painting an item. It is aggregated like
+    any other span, but only the most recent MAX_FREQUENT_EVENTS of them are kept for the trace
+    :param name: the name of the span
+    :param args: extra details to show in the trace
+    :return: a Span context manager
+    """
+    return Span(name, args, frequent=True)
+
+
+def record(name, start, duration, **args):
+    """
+    Records a span that was timed elsewhere
+    :param name: the name of the span
+    :param start: the start of the span, from time.perf_counter_ns
+    :param duration: the duration in nanoseconds
+    :param args: extra details to show in the trace
+    :return: the recorded Span
+    """
+    _span = Span(name, args)
+    _span.start = start
+    _span.duration = duration
+    if enabled:
+        _record(_span)
+    return _span
+
+
+def count(name, value=1):
+    """
+    Increments a named counter
+    :param name: the counter name
+    :param value: how much to add
+    :return:
+    """
+    if enabled:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def counters():
+    return dict(_counters)
+
+
+def stats():
+    """
+    Aggregates of every span recorded since the last reset
+    :return: a dictionary of span name to a dictionary of calls, total, max and mean in seconds
+    """
+    with _lock:
+        return {name: {"calls": calls, "total": total / 1e9, "max": longest / 1e9, "mean": total / calls / 1e9}
+                for name, (calls, total, longest) in _stats.items()}
+
+
+def peak_rss():
+    """
+    The peak resident set size of this process
+    :return: the size in bytes, or None if it cannot be determined on this platform
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def current_rss():
+    """
+    The current resident set size of this process
+    :return: the size in bytes. Where the current size cannot be read, the peak size is returned instead
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return peak_rss()
+
+
+def reset():
+    with _lock:
+        _events.clear()
+        _frequent_events.clear()
+        _stats.clear()
+        _counters.clear()
+
+
+def export_chrome_trace(file):
+    """
+    Writes the recorded spans and the current counters in the Chrome trace event format. The file can be opened
+    in chrome://tracing or https://ui.perfetto.dev
+    :param file: the file to write
+    :return:
+    """
+    pid = os.getpid()
+    with _lock:
+        events = [{
+            "name": name,
+            "ph": "X",
+            "ts": (start - _epoch_ns) / 1000,
+            "dur": duration / 1000,
+            "pid": pid,
+            "tid": tid,
+            "args": args,
+        } for name, start, duration, tid, args in itertools.chain(_events, _frequent_events)]
+    now = (time.perf_counter_ns() - _epoch_ns) / 1000
+    events.append({"name": "counters", "ph": "C", "ts": now, "pid": pid, "args": counters()})
+    rss = peak_rss()
+    if rss is not None:
+        events.append({"name": "peak_rss", "ph": "C", "ts": now, "pid": pid, "args": {"bytes": rss}})
+
+    with open(file, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, default=str)
+
+
+def _record(_span):
+    with _lock:
+        events = _frequent_events if _span.frequent else _events
+        events.append((_span.name, _span.start, _span.duration, threading.get_ident(), _span.args))
+        calls, total, longest = _stats.get(_span.name, (0, 0, 0))
+        _stats[_span.name] = (calls + 1, total + _span.duration, max(longest, _span.duration))
@@ -1,19 +1,22 @@
+import html
 import os
 from datetime import datetime
 from enum import Enum
 from functools import partial
 
-from PyQt5.QtCore import pyqtSignal, QObject, QModelIndex
+from PyQt5.QtCore import pyqtSignal, QObject, QModelIndex, Qt
 from PyQt5.QtGui import QIcon, QPixmap, QColor
-from PyQt5.QtWidgets import QMenuBar, QAction, QMenu, QFileDialog, QFontDialog, QColorDialog, QMessageBox
+from PyQt5.QtWidgets import QMenuBar, QAction, QMenu, QFileDialog, QFontDialog, QColorDialog, QMessageBox, \
+    QInputDialog, QActionGroup
 
 import app
 from app import AppSettings
-from app.XMLDataViews import XMLViewModel
+from app.ValueViewer import ValueViewer
 
 
 class MenuAction(Enum):
     OPEN = "Open ..."
+    OPEN_FOLDER = "Open folder ..."
     RECENT = "Recent Files"
     EXIT = "Exit"
     SEARCH = "Search Window"
@@ -21,13 +24,24 @@ class MenuAction(Enum):
     COLLAPSE = "Collapse"
     RELOAD = "Reload file"
     ATTRIBUTES = "Show Attributes"
+    NAMESPACES = "Show Namespace URIs"
+    HTML_PROFILE = "Load HTML"
     COLOR = "Color Theme"
     FONT = "Change Font ..."
     HIDE = "Hide from view"
+    RESTORE = "Show hidden nodes"
+    FILTER = "Filter ..."
+    CLEAR_FILTER = "Clear filter"
     TOP = "Go to top"
     BOTTOM = "Go to bottom"
     ABOUT = "About"
     TABULATE = "Show as Table"
+    VIEW_VALUE = "View value ..."
+    TABULATE_PATH = "Tabulate path ..."
+    PERFORMANCE = "Performance"
+    STRUCTURE = "Structure"
+    SOURCE = "Source"
+    VALIDATION = "Validation"
 
 
 class XMLTreeViewContextMenu(QMenu):
@@ -37,10 +51,13 @@ class XMLTreeViewContextMenu(QMenu):
         super().__init__()
         self.tabulate = _create_action(self, MenuAction.TABULATE.value, self.raise_event,
                                        icon=QIcon.fromTheme("x-office-spreadsheet"), data=MenuAction.TABULATE)
+        self.view_value = _create_action(self, MenuAction.VIEW_VALUE.value, self.raise_event,
+                                         icon=QIcon.fromTheme("document-preview"), data=MenuAction.VIEW_VALUE)
         self.init_ui()
 
     def init_ui(self):
         self.addAction(self.tabulate)
+        self.addAction(self.view_value)
         self.addAction(_create_action(self, MenuAction.EXPAND.value, self.raise_event,
                                       icon=QIcon.fromTheme("list-add"), data=MenuAction.EXPAND))
         self.addAction(_create_action(self, MenuAction.COLLAPSE.value, self.raise_event,
@@ -48,6 +65,8 @@ class XMLTreeViewContextMenu(QMenu):
         self.addAction(_create_action(self, MenuAction.HIDE.value, self.raise_event,
                                       icon=QIcon.fromTheme("edit-delete"), data=MenuAction.HIDE,
                                       shortcut="Delete"))
+        self.addAction(_create_action(self, MenuAction.RESTORE.value, self.raise_event,
+                                      icon=QIcon.fromTheme("edit-undo"), data=MenuAction.RESTORE))
         self.addSeparator()
         self.addAction(_create_action(self, MenuAction.RELOAD.value, self.raise_event,
                                       icon=QIcon.fromTheme("view-refresh"), data=MenuAction.RELOAD))
@@ -58,6 +77,9 @@ class XMLTreeViewContextMenu(QMenu):
     def set_table_menu(self, is_table_menu):
         self.tabulate.setEnabled(is_table_menu)
 
+    def set_value_menu(self, has_large_values):
+        self.view_value.setEnabled(has_large_values)
+
 
 class MenuBar(QMenuBar):
     menu_event = pyqtSignal(MenuAction, object)
@@ -72,6 +94,9 @@ class MenuBar(QMenuBar):
         file_menu.addAction(_create_action(self, MenuAction.OPEN.value, self.raise_event,
                                            icon=QIcon.fromTheme("document-open"),
                                            shortcut="Ctrl+O", data=MenuAction.OPEN))
+        file_menu.addAction(_create_action(self, MenuAction.OPEN_FOLDER.value, self.raise_event,
+                                           icon=QIcon.fromTheme("folder-open"),
+                                           shortcut="Ctrl+Shift+O", data=MenuAction.OPEN_FOLDER))
 
         # file_menu.addMenu(self._create_recent_list())
         file_menu.addMenu(QMenu(MenuAction.RECENT.value, self))
@@ -95,17 +120,45 @@ class MenuBar(QMenuBar):
         view_menu.addAction(_create_action(self, MenuAction.HIDE.value, self.raise_event,
                                            icon=QIcon.fromTheme("edit-delete"), data=MenuAction.HIDE,
                                            shortcut="Delete"))
+        view_menu.addAction(_create_action(self, MenuAction.RESTORE.value, self.raise_event,
+                                           icon=QIcon.fromTheme("edit-undo"), data=MenuAction.RESTORE))
+        view_menu.addAction(_create_action(self, MenuAction.FILTER.value, self.raise_event,
+                                           icon=QIcon.fromTheme("view-filter"),
+                                           shortcut="Ctrl+L", data=MenuAction.FILTER))
+        view_menu.addAction(_create_action(self, MenuAction.CLEAR_FILTER.value, self.raise_event,
+                                           icon=QIcon.fromTheme("edit-clear"), data=MenuAction.CLEAR_FILTER))
         view_menu.addAction(_create_action(self, MenuAction.TOP.value, self.raise_event,
                                            icon=QIcon.fromTheme("go-top"),
                                            shortcut="Home", data=MenuAction.TOP))
         view_menu.addAction(_create_action(self, MenuAction.BOTTOM.value, self.raise_event,
                                            icon=QIcon.fromTheme("go-bottom"),
                                            shortcut="End", data=MenuAction.BOTTOM))
+        view_menu.addAction(_create_action(self, MenuAction.TABULATE_PATH.value, self.raise_event,
+                                           icon=QIcon.fromTheme("x-office-spreadsheet"),
+                                           shortcut="Ctrl+T", data=MenuAction.TABULATE_PATH))
+        view_menu.addAction(_create_action(self, MenuAction.STRUCTURE.value, self.raise_event,
+                                           icon=QIcon.fromTheme("view-list-tree"),
+                                           shortcut="Ctrl+Shift+S", data=MenuAction.STRUCTURE))
+        view_menu.addAction(_create_action(self, MenuAction.SOURCE.value, self.raise_event,
+                                           icon=QIcon.fromTheme("text-x-script"),
+                                           shortcut="Ctrl+U", data=MenuAction.SOURCE))
+        view_menu.addAction(_create_action(self, MenuAction.VALIDATION.value, self.raise_event,
+                                           icon=QIcon.fromTheme("dialog-ok-apply"),
+                                           shortcut="Ctrl+Shift+V", data=MenuAction.VALIDATION))
+        view_menu.addAction(_create_action(self, MenuAction.PERFORMANCE.value, self.raise_event,
+                                           icon=QIcon.fromTheme("utilities-system-monitor"),
+                                           data=MenuAction.PERFORMANCE))
         view_menu.addSeparator()
         view_menu.addMenu(QMenu(MenuAction.COLOR.value, self))
         view_menu.addAction(_create_action(self, MenuAction.ATTRIBUTES.value, self.raise_event,
                                            data=MenuAction.ATTRIBUTES,
                                            checked=AppSettings.show_attributes()))
+        view_menu.addAction(_create_action(self, MenuAction.NAMESPACES.value, self.raise_event,
+                                           data=MenuAction.NAMESPACES,
+                                           checked=AppSettings.show_namespace_uris()))
+        html_menu = QMenu(MenuAction.HTML_PROFILE.value, self)
+        html_menu.aboutToShow.connect(partial(self.update_html_profile_menu, html_menu))
+        view_menu.addMenu(html_menu)
         view_menu.addAction(_create_action(self, MenuAction.FONT.value, self.raise_event,
                                            icon=QIcon.fromTheme("preferences-desktop-font"),
                                            data=MenuAction.FONT))
@@ -149,6 +202,20 @@ class MenuBar(QMenuBar):
             else:
                 action.setIcon(QIcon(pixmap))
 
+    def update_html_profile_menu(self, html_menu):
+        # The loader is only imported once the menu is opened
+        from app import XMLLoader
+        if not html_menu.actions():
+            group = QActionGroup(html_menu)
+            for profile in XMLLoader.HTML_PROFILES:
+                action = _create_action(self, profile.title(), self.raise_event, data=MenuAction.HTML_PROFILE,
+                                        argument=profile, checked=False)
+                group.addAction(action)
+                html_menu.addAction(action)
+        profile = AppSettings.html_profile()
+        for action in html_menu.actions():
+            action.setChecked(action.text() == profile.title())
+
     @staticmethod
     def _find_action(text, actions):
         """
@@ -173,20 +240,30 @@ class MenuBar(QMenuBar):
 
 class MenuHandler(QObject):
     load_file_event = pyqtSignal(str)
+    load_files_event = pyqtSignal(list)
     search_event = pyqtSignal()
+    performance_event = pyqtSignal()
+    structure_event = pyqtSignal()
+    source_event = pyqtSignal()
+    validation_event = pyqtSignal()
     tabulate_event = pyqtSignal(QModelIndex, list)
+    tabulate_path_event = pyqtSignal(str)
 
     def __init__(self, mainapp, treeview):
         super(MenuHandler, self).__init__()
         self.mainapp = mainapp
         self.treeview = treeview
         self.menubar = MenuBar()
-        self.menucontext = XMLTreeViewContextMenu()
+        self.menucontext = None
         self.menubar.menu_event.connect(self.menu_event)
-        self.menucontext.menu_event.connect(self.menu_event)
 
-    def request_context_menu(self, point, table_menu):
+    def request_context_menu(self, point, table_menu, value_menu=False):
+        # The context menu is built the first time it is needed rather than at startup
+        if self.menucontext is None:
+            self.menucontext = XMLTreeViewContextMenu()
+            self.menucontext.menu_event.connect(self.menu_event)
         self.menucontext.set_table_menu(table_menu)
+        self.menucontext.set_value_menu(value_menu)
         self.menucontext.exec_(point)
 
     def menu_event(self, menu_action, argument):
@@ -195,11 +272,22 @@ class MenuHandler(QObject):
             #   Application Menu Actions    #
             #   #   #   #   #   #   #   #   #
             case MenuAction.OPEN:
-                file, _ = QFileDialog.getOpenFileUrl(parent=self.mainapp, caption="Select an XML File",
-                                                     filter="XML files (*.xml);;JSON files (*.json)")
-                if not file.isEmpty():
-                    self.load_file_event.emit(file.toLocalFile())
-                    
+                files, _ = QFileDialog.getOpenFileUrls(parent=self.mainapp, caption="Select XML Files",
+                                                       filter="XML files (*.xml *.xml.gz *.xml.xz *.xml.bz2);;"
+                                                              "JSON files (*.json *.json.gz *.json.xz *.json.bz2);;"
+                                                              "HTML files (*.htm *.html *.html.gz);;"
+                                                              "All files (*)")
+                # Several files are opened together as a collection
+                if len(files) == 1:
+                    self.load_file_event.emit(files[0].toLocalFile())
+                elif files:
+                    self.load_files_event.emit([file.toLocalFile() for file in files])
+
+            case MenuAction.OPEN_FOLDER:
+                directory = QFileDialog.getExistingDirectory(parent=self.mainapp, caption="Select a folder")
+                if directory:
+                    self.load_files_event.emit([directory])
+
             case MenuAction.RECENT:
                 file = argument
                 if os.path.exists(file):
@@ -214,13 +302,19 @@ class MenuHandler(QObject):
             case MenuAction.ATTRIBUTES:
                 AppSettings.set_show_attributes(not AppSettings.show_attributes())
 
+            case MenuAction.NAMESPACES:
+                AppSettings.set_show_namespace_uris(not AppSettings.show_namespace_uris())
+
+            case MenuAction.HTML_PROFILE:
+                AppSettings.set_html_profile(argument)
+
             case MenuAction.FONT:
                 _font, ok = QFontDialog.getFont(AppSettings.font(), parent=self.mainapp, caption="Select Font")
                 if ok:
                     AppSettings.set_font(_font)
 
             case MenuAction.COLOR:
-                theme = AppSettings.color_theme()
+                theme = dict(AppSettings.color_theme())
                 current = theme[argument]
                 _color = QColorDialog.getColor(initial=QColor(current), parent=self.mainapp,
                                                title=f"Select color for {argument.title()}",
@@ -239,6 +333,18 @@ class MenuHandler(QObject):
             case MenuAction.SEARCH:
                 self.search_event.emit()
 
+            case MenuAction.PERFORMANCE:
+                self.performance_event.emit()
+
+            case MenuAction.STRUCTURE:
+                self.structure_event.emit()
+
+            case MenuAction.SOURCE:
+                self.source_event.emit()
+
+            case MenuAction.VALIDATION:
+                self.validation_event.emit()
+
             case MenuAction.EXIT:
                 self.mainapp.close()
 
@@ -248,7 +354,7 @@ class MenuHandler(QObject):
             case MenuAction.EXPAND:
                 selected = self.treeview.selectedIndexes()
                 if len(selected):
-                    self.treeview.expandRecursively(selected[0], depth=-1)
+                    self.treeview.expand_budgeted(selected[0])
 
             case MenuAction.COLLAPSE:
                 selected = self.treeview.selectedIndexes()
@@ -265,18 +371,42 @@ class MenuHandler(QObject):
                 self.treeview.reload()
 
             case MenuAction.HIDE:
-                selected = self.treeview.selectedIndexes()
-                if len(selected):
-                    sorted_to_delete = XMLViewModel.get_models_sorted_by_ancestry(selected)
-                    for item in sorted_to_delete:
-                        self.treeview.model.removeRow(item.row(), item.parent())
+                self.treeview.hide_selected()
+
+            case MenuAction.RESTORE:
+                self.treeview.restore_hidden()
+
+            case MenuAction.FILTER:
+                expression, ok = QInputDialog.getText(self.mainapp, "Filter",
+                                                      "Show only nodes matching, for example order[@status='failed']")
+                if ok:
+                    self.treeview.set_filter(expression.strip())
+
+            case MenuAction.CLEAR_FILTER:
+                self.treeview.set_filter(None)
+
+            case MenuAction.TABULATE_PATH:
+                expression, ok = QInputDialog.getText(self.mainapp, "Tabulate path",
+                                                      "Show every element at a path as a row, for example //order/line")
+                if ok and expression.strip():
+                    self.tabulate_path_event.emit(expression.strip())
 
             case MenuAction.TABULATE:
                 selected = self.treeview.selectedIndexes()
                 if len(selected):
-                    item = self.treeview.treemodel.itemFromIndex(selected[0])
+                    item = self.treeview.get_item(selected[0])
                     self.tabulate_event.emit(selected[0], item.datalist)
 
+            case MenuAction.VIEW_VALUE:
+                selected = self.treeview.selectedIndexes()
+                if len(selected):
+                    item = self.treeview.get_item(selected[0])
+                    for name, value in item.large_values.items():
+                        title = item.name if name == "#text" else f"{item.name} {name}"
+                        viewer = ValueViewer(self.mainapp, html.unescape(title), value)
+                        viewer.setAttribute(Qt.WA_DeleteOnClose)
+                        viewer.show()
+
             case _:
                 app.logger.error(f"Unexpected menu action {menu_action}")
 
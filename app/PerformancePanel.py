@@ -0,0 +1,105 @@
+from PyQt5.QtCore import QTimer, Qt
+from PyQt5.QtWidgets import QDockWidget, QTableWidget, QTableWidgetItem, QVBoxLayout, QHBoxLayout, QGroupBox, \
+    QLabel, QPushButton, QFileDialog, QAbstractItemView
+
+import app
+from app import Instrumentation
+
+
+class PerformancePanel(QDockWidget):
+    """
+    Shows the timing spans, counters and peak memory recorded by the instrumentation layer.
+    The panel only refreshes itself while it is visible
+    """
+    _REFRESH_MSECS = 1000
+    _SPAN_COLUMNS = ["Span", "Calls", "Total (ms)", "Mean (ms)", "Max (ms)"]
+
+    def __init__(self, parent):
+        super(PerformancePanel, self).__init__("Performance", parent)
+        self.setObjectName("PerformancePanel")
+        self.spans = QTableWidget(0, len(self._SPAN_COLUMNS))
+        self.counters = QTableWidget(0, 2)
+        self.memory = QLabel()
+        self.timer = QTimer(self)
+        self.timer.setInterval(self._REFRESH_MSECS)
+        self.timer.timeout.connect(self.refresh)
+        self.visibilityChanged.connect(self.visibility_changed)
+        self._init_ui()
+
+    def _init_ui(self):
+        for table, headers in ((self.spans, self._SPAN_COLUMNS), (self.counters, ["Counter", "Value"])):
+            table.setHorizontalHeaderLabels(headers)
+            table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+            table.setAlternatingRowColors(True)
+            table.setShowGrid(False)
+            table.verticalHeader().hide()
+            table.horizontalHeader().setStretchLastSection(True)
+
+        reset = QPushButton("Reset")
+        reset.clicked.connect(self.reset)
+        export = QPushButton("Export trace ...")
+        export.clicked.connect(self.export)
+
+        buttons = QHBoxLayout()
+        buttons.addWidget(self.memory)
+        buttons.addStretch(1)
+        buttons.addWidget(reset)
+        buttons.addWidget(export)
+
+        tables = QHBoxLayout()
+        tables.addWidget(self.spans, 3)
+        tables.addWidget(self.counters, 1)
+
+        layout = QVBoxLayout()
+        layout.setContentsMargins(1, 1, 1, 1)
+        layout.addLayout(tables)
+        layout.addLayout(buttons)
+
+        container = QGroupBox()
+        container.setLayout(layout)
+        self.setWidget(container)
+
+    def visibility_changed(self, visible):
+        if visible:
+            self.refresh()
+            self.timer.start()
+        else:
+            self.timer.stop()
+
+    def refresh(self):
+        stats = Instrumentation.stats()
+        self.spans.setRowCount(len(stats))
+        for row, name in enumerate(sorted(stats, key=lambda n: stats[n]["total"], reverse=True)):
+            stat = stats[name]
+            self._set_row(self.spans, row, [name, stat["calls"], stat["total"] * 1000,
+                                            stat["mean"] * 1000, stat["max"] * 1000])
+
+        counters = Instrumentation.counters()
+        self.counters.setRowCount(len(counters))
+        for row, name in enumerate(sorted(counters)):
+            self._set_row(self.counters, row, [name, counters[name]])
+
+        rss = Instrumentation.peak_rss()
+        self.memory.setText("Peak memory: unknown" if rss is None else f"Peak memory: {rss / (1024 * 1024):.1f} MB")
+
+    def reset(self):
+        Instrumentation.reset()
+        self.refresh()
+
+    def export(self):
+        file, _ = QFileDialog.getSaveFileName(parent=self, caption="Export Chrome trace",
+                                              filter="Trace files (*.json)")
+        if file:
+            Instrumentation.export_chrome_trace(file)
+            app.logger.info(f"Exported trace to {file}")
+
+    @staticmethod
+    def _set_row(table, row, values):
+        for column, value in enumerate(values):
+            if isinstance(value, float):
+                item = QTableWidgetItem(f"{value:.3f}")
+            else:
+                item = QTableWidgetItem(str(value))
+            if column > 0:
+                item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+            table.setItem(row, column, item)
@@ -0,0 +1,120 @@
+"""
+Lets a second launch hand its files to the instance that is already running, which opens them with its parsers,
+caches and worker pools already warm. The instances talk over a local socket named after the user, the files are
+sent as a JSON list on a single line
+"""
+import getpass
+import json
+import os
+import re
+
+from PyQt5.QtCore import QObject, pyqtSignal
+from PyQt5.QtNetwork import QLocalServer, QLocalSocket
+
+import app
+from app import AppSettings
+
+# Starts a new instance even when one is running
+NEW_INSTANCE_ARGUMENT = "--new-instance"
+# How long a second launch waits for the running instance
+_TIMEOUT_MSECS = 1000
+
+
+def server_name():
+    try:
+        user = getpass.getuser()
+    except (KeyError, OSError):
+        user = str(os.getuid()) if hasattr(os, "getuid") else "user"
+    return re.sub(r"[^\w.-]", "_", f"{app.__APP_NAME__}-{user}")
+
+
+def enabled(arguments):
+    """
+    :param arguments: the command line arguments
+    :return: whether later launches hand their files to the running instance
+    """
+    return AppSettings.single_instance() and NEW_INSTANCE_ARGUMENT not in arguments
+
+
+def files_from_arguments(arguments):
+    """
+    :param arguments: the command line arguments, without the program
+    :return: the absolute paths of the files, options are left out
+    """
+    return [os.path.abspath(argument) for argument in arguments if not argument.startswith("-")]
+
+
+def forward(files):
+    """
+    Sends the files to the running instance
+    :param files: the absolute paths of the files to open, the running instance is brought to the front if empty
+    :return: True if an instance is running and has the files, False if this process should start the application
+    """
+    socket = QLocalSocket()
+    socket.connectToServer(server_name())
+    if not socket.waitForConnected(_TIMEOUT_MSECS):
+        return False
+    socket.write(json.dumps(files).encode("utf-8") + b"\n")
+    sent = socket.waitForBytesWritten(_TIMEOUT_MSECS)
+    socket.disconnectFromServer()
+    if socket.state() != QLocalSocket.UnconnectedState:
+        socket.waitForDisconnected(_TIMEOUT_MSECS)
+    return sent
+
+
+class InstanceServer(QObject):
+    """
+    Listens for later launches of the application and passes on the files they were given
+    """
+    files_received_event = pyqtSignal(list)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.server = QLocalServer(self)
+        self.server.newConnection.connect(self.connection_event)
+        # What each connection has sent so far
+        self._received = {}
+
+    def listen(self):
+        """
+        :return: True if this instance now receives the files of later launches
+        """
+        name = server_name()
+        if not self.server.listen(name):
+            # A socket left behind by an instance that did not shut down, unless another instance just started
+            probe = QLocalSocket()
+            probe.connectToServer(name)
+            if probe.waitForConnected(_TIMEOUT_MSECS):
+                probe.disconnectFromServer()
+                app.logger.info("Another instance is already listening")
+                return False
+            QLocalServer.removeServer(name)
+            if not self.server.listen(name):
+                app.logger.warning(f"Unable to listen for other launches: {self.server.errorString()}")
+                return False
+        app.logger.debug(f"Listening for other launches on {self.server.fullServerName()}")
+        return True
+
+    def close(self):
+        self.server.close()
+
+    def connection_event(self):
+        while self.server.hasPendingConnections():
+            connection = self.server.nextPendingConnection()
+            self._received[connection] = b""
+            connection.readyRead.connect(lambda c=connection: self.read_event(c))
+            connection.disconnected.connect(lambda c=connection: self.disconnected_event(c))
+
+    def read_event(self, connection):
+        self._received[connection] = self._received.get(connection, b"") + bytes(connection.readAll())
+
+    def disconnected_event(self, connection):
+        data = self._received.pop(connection, b"") + bytes(connection.readAll())
+        connection.deleteLater()
+        try:
+            files = json.loads(data.decode("utf-8").strip() or "[]")
+        except ValueError:
+            app.logger.warning("Ignoring an unreadable message from another launch")
+            return
+        if isinstance(files, list) and all(isinstance(file, str) for file in files):
+            self.files_received_event.emit(files)
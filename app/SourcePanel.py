@@ -0,0 +1,204 @@
+import os
+from functools import partial
+
+from PyQt5.QtCore import QRect
+from PyQt5.QtGui import QPainter, QFontDatabase, QColor, QPalette
+from PyQt5.QtWidgets import QDockWidget, QAbstractScrollArea, QVBoxLayout, QGroupBox, QLabel
+
+import app
+from app import AppSettings, Instrumentation
+from app.XMLSourceMap import SourceMap, ROW_LENGTH
+from app.XMLWorkers import Worker
+
+
+class SourceView(QAbstractScrollArea):
+    """
+    Paints the rows of a SourceMap. Only the rows in view are read from the file, so the size of the file and
+    the length of its lines make no difference to scrolling
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.source_map = None
+        # The bytes of the selected node
+        self.selection = None
+        self.setFont(QFontDatabase.systemFont(QFontDatabase.FixedFont))
+        self.viewport().setBackgroundRole(QPalette.Base)
+        self.viewport().setAutoFillBackground(True)
+
+    def set_map(self, source_map):
+        self.source_map = source_map
+        self.selection = None
+        self.verticalScrollBar().setValue(0)
+        self.horizontalScrollBar().setValue(0)
+        self.refresh()
+
+    def refresh(self):
+        # Called as the scan finds more rows
+        rows = self.source_map.rows if self.source_map is not None else 0
+        visible = self.visible_rows()
+        self.verticalScrollBar().setRange(0, max(rows - visible, 0))
+        self.verticalScrollBar().setPageStep(visible)
+        self.horizontalScrollBar().setRange(0, max(ROW_LENGTH * self.fontMetrics().averageCharWidth() -
+                                                   self.viewport().width(), 0))
+        self.horizontalScrollBar().setPageStep(self.viewport().width())
+        self.viewport().update()
+
+    def visible_rows(self):
+        return max(self.viewport().height() // self.fontMetrics().height(), 1)
+
+    def show_range(self, start, end):
+        """
+        Highlights the bytes and scrolls them into view
+        """
+        self.selection = (start, end)
+        row = self.source_map.row_of(start)
+        first = self.verticalScrollBar().value()
+        if not first <= row < first + self.visible_rows():
+            self.verticalScrollBar().setValue(max(row - self.visible_rows() // 3, 0))
+        self.viewport().update()
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.refresh()
+
+    def scrollContentsBy(self, dx, dy):
+        self.viewport().update()
+
+    def paintEvent(self, event):
+        if self.source_map is None:
+            return
+        with Instrumentation.frequent_span("source_paint"):
+            self._paint()
+
+    def _paint(self):
+        painter = QPainter(self.viewport())
+        metrics = self.fontMetrics()
+        height = metrics.height()
+        left = -self.horizontalScrollBar().value()
+        highlight = QColor(AppSettings.color_theme()["highlight"])
+        rows = self.source_map.read_rows(self.verticalScrollBar().value(), self.visible_rows() + 1)
+        for number, (offset, data) in enumerate(rows):
+            top = number * height
+            text = _decode(data)
+            if self.selection is not None:
+                start, end = self.selection
+                if start < offset + len(data) and end > offset:
+                    x1 = metrics.horizontalAdvance(_decode(data[:max(start - offset, 0)]))
+                    x2 = metrics.horizontalAdvance(_decode(data[:min(end - offset, len(data))]))
+                    painter.fillRect(QRect(left + x1, top, max(x2 - x1, 1), height), highlight)
+            painter.drawText(left, top + metrics.ascent(), text)
+        painter.end()
+
+
+def _decode(data):
+    return data.decode("utf-8", errors="replace").rstrip("\r\n").expandtabs(4)
+
+
+class SourcePanel(QDockWidget):
+    """
+    Shows the file as it is on disk and highlights the source of the node selected in the tree. The rows and
+    elements of the file are found in one background scan, the pane can be scrolled while the scan runs
+    """
+
+    def __init__(self, parent):
+        super(SourcePanel, self).__init__("Source", parent)
+        self.setObjectName("SourcePanel")
+        self.source_map = None
+        self.worker = None
+        # The node to show once the scan has found it
+        self.pending_path = None
+        self.view = SourceView()
+        self.status = QLabel()
+        self._init_ui()
+
+    def _init_ui(self):
+        layout = QVBoxLayout()
+        layout.setContentsMargins(1, 1, 1, 1)
+        layout.addWidget(self.view)
+        layout.addWidget(self.status)
+
+        container = QGroupBox()
+        container.setLayout(layout)
+        self.setWidget(container)
+
+    def set_file(self, file):
+        """
+        Shows the file, unless it is already shown
+        :param file: the file to show
+        :return:
+        """
+        if not file or not os.path.isfile(file):
+            # A collection has no single source to show
+            self.close_file()
+            self.view.set_map(None)
+            self.status.setText("")
+            return
+        if self.source_map is not None and self.source_map.file == file:
+            return
+        self.close_file()
+        self.source_map = SourceMap(file)
+        self.view.set_map(self.source_map)
+        self.status.setText("Reading ...")
+
+        source_map = self.source_map
+
+        def _scan(worker):
+            with Instrumentation.span("source_scan", file=file):
+                return source_map.scan(worker.is_cancelled, worker.report)
+
+        self.worker = Worker(_scan)
+        self.worker.signals.progress.connect(partial(self.scan_progress_event, source_map))
+        self.worker.signals.finished.connect(self.scan_finished_event)
+        self.worker.signals.failed.connect(self.scan_failed_event)
+        self.worker.start()
+
+    def close_file(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            self.worker = None
+        if self.source_map is not None:
+            self.source_map.close()
+            self.source_map = None
+        self.pending_path = None
+
+    def show_path(self, path):
+        """
+        Highlights the source of the node at a path of the loaded document
+        :param path: the keys and list positions of the node
+        :return:
+        """
+        if self.source_map is None:
+            return
+        if not self.source_map.complete:
+            self.pending_path = path
+            return
+        if self.source_map.elements is None:
+            return
+        found = self.source_map.element_range(path)
+        if found is not None:
+            self.view.show_range(*found)
+
+    def scan_progress_event(self, source_map, fraction):
+        if source_map is not self.source_map:
+            return
+        self.view.refresh()
+        self.status.setText(f"Reading ... {fraction:.0%}")
+
+    def scan_finished_event(self, source_map):
+        if source_map is None or source_map is not self.source_map:
+            return
+        self.worker = None
+        self.view.refresh()
+        message = f"{source_map.size:,} bytes, {source_map.rows:,} row(s)"
+        if source_map.elements is None:
+            message += ", the tree selection is only followed in XML files"
+        self.status.setText(message)
+        if self.pending_path is not None:
+            path, self.pending_path = self.pending_path, None
+            self.show_path(path)
+
+    def scan_failed_event(self, message):
+        self.worker = None
+        self.status.setText(message)
+        app.logger.warning(f"Unable to read the source: {message}")
@@ -0,0 +1,180 @@
+import os
+
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex, pyqtSignal
+from PyQt5.QtWidgets import QDockWidget, QTableView, QVBoxLayout, QHBoxLayout, QGroupBox, QLabel, QPushButton, \
+    QAbstractItemView
+
+import app
+from app import Instrumentation, XMLStructure
+from app.XMLWorkers import Worker
+
+
+class StructureModel(QAbstractTableModel):
+    """
+    One row per path of the document. Cells are formatted when they are painted, so the table stays fast for
+    documents with many distinct paths
+    """
+    COLUMNS = ["Path", "Count", "Per parent", "Attributes", "Types", "Samples"]
+
+    def __init__(self, summaries=None):
+        super().__init__()
+        self.summaries = summaries or []
+
+    def set_summaries(self, summaries):
+        self.beginResetModel()
+        self.summaries = summaries
+        self.endResetModel()
+
+    def rowCount(self, parent: QModelIndex = None) -> int:
+        return 0 if parent is not None and parent.isValid() else len(self.summaries)
+
+    def columnCount(self, parent: QModelIndex = None) -> int:
+        return len(self.COLUMNS)
+
+    def data(self, index: QModelIndex, role: int = None):
+        if not index.isValid():
+            return None
+        summary = self.summaries[index.row()]
+        if role == Qt.DisplayRole:
+            return self._cell(summary, index.column())
+        if role == Qt.ToolTipRole:
+            return summary.path
+        if role == Qt.TextAlignmentRole and index.column() in (1, 2):
+            return Qt.AlignRight | Qt.AlignVCenter
+        return None
+
+    def headerData(self, section, orientation, role=None):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.COLUMNS[section]
+        return None
+
+    @staticmethod
+    def _cell(summary, column):
+        match column:
+            case 0:
+                return summary.path
+            case 1:
+                return str(summary.count)
+            case 2:
+                if summary.min_per_parent == summary.max_per_parent:
+                    return str(summary.min_per_parent)
+                return f"{summary.min_per_parent} .. {summary.max_per_parent}"
+            case 3:
+                return ", ".join(f"@{name}" if count == summary.count else f"@{name}?"
+                                 for name, count in summary.attributes.items())
+            case 4:
+                return ", ".join(f"{name} ({count})" for name, count in summary.types.items())
+            case 5:
+                return " | ".join(summary.samples)
+        return None
+
+
+class StructurePanel(QDockWidget):
+    """
+    Summarises the structure of the loaded file: every distinct path with how often it occurs, its attributes,
+    the types of its values and a few samples. The file is read in one streaming pass in the background.
+    Double clicking a path shows its nodes in the tree
+    """
+    show_path_event = pyqtSignal(str)
+    tabulate_path_event = pyqtSignal(str)
+
+    def __init__(self, parent):
+        super(StructurePanel, self).__init__("Structure", parent)
+        self.setObjectName("StructurePanel")
+        self.file = None
+        self.worker = None
+        self.model = StructureModel()
+        self.table = QTableView()
+        self.status = QLabel()
+        self._init_ui()
+
+    def _init_ui(self):
+        self.table.setModel(self.model)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.table.setAlternatingRowColors(True)
+        self.table.setShowGrid(False)
+        self.table.setWordWrap(False)
+        self.table.verticalHeader().hide()
+        self.table.verticalHeader().setDefaultSectionSize(self.table.fontMetrics().height() + 3)
+        self.table.horizontalHeader().setStretchLastSection(True)
+        self.table.doubleClicked.connect(self.path_double_click)
+
+        show = QPushButton("Show in tree")
+        show.clicked.connect(self.show_selected)
+        tabulate = QPushButton("Show as Table")
+        tabulate.clicked.connect(self.tabulate_selected)
+
+        buttons = QHBoxLayout()
+        buttons.addWidget(self.status)
+        buttons.addStretch(1)
+        buttons.addWidget(show)
+        buttons.addWidget(tabulate)
+
+        layout = QVBoxLayout()
+        layout.setContentsMargins(1, 1, 1, 1)
+        layout.addWidget(self.table)
+        layout.addLayout(buttons)
+
+        container = QGroupBox()
+        container.setLayout(layout)
+        self.setWidget(container)
+
+    def summarize(self, file):
+        """
+        Summarises the file in the background, unless it has already been summarised
+        :param file: the file to summarise
+        :return:
+        """
+        if file == self.file or not file or not os.path.isfile(file):
+            return
+        if self.worker is not None:
+            self.worker.cancel()
+        self.file = file
+        self.model.set_summaries([])
+        self.status.setText("Reading structure ...")
+
+        def _summarize(worker):
+            with Instrumentation.span("structure_summary", file=file):
+                return XMLStructure.summarize(file, worker.is_cancelled, worker.report)
+
+        self.worker = Worker(_summarize)
+        self.worker.signals.progress.connect(self.progress_event)
+        self.worker.signals.finished.connect(self.summary_ready_event)
+        self.worker.signals.failed.connect(self.summary_failed_event)
+        self.worker.start()
+
+    def progress_event(self, fraction):
+        self.status.setText(f"Reading structure ... {fraction:.0%}")
+
+    def summary_ready_event(self, summaries):
+        self.worker = None
+        if summaries is None:
+            return
+        self.model.set_summaries(summaries)
+        self.table.resizeColumnToContents(0)
+        self.status.setText(f"{len(summaries)} path(s)")
+
+    def summary_failed_event(self, message):
+        self.worker = None
+        self.file = None
+        self.status.setText(message)
+        app.logger.warning(f"Unable to summarise the structure: {message}")
+
+    def selected_path(self):
+        selected = self.table.selectionModel().selectedRows()
+        return self.model.summaries[selected[0].row()].path if selected else None
+
+    def path_double_click(self, index):
+        self.show_path_event.emit(self.model.summaries[index.row()].path)
+
+    def show_selected(self):
+        path = self.selected_path()
+        if path is not None:
+            self.show_path_event.emit(path)
+
+    def tabulate_selected(self):
+        path = self.selected_path()
+        if path is not None:
+            self.tabulate_path_event.emit(path)
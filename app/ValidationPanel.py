@@ -0,0 +1,209 @@
+import os
+from functools import partial
+
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex, pyqtSignal
+from PyQt5.QtWidgets import QDockWidget, QTableView, QVBoxLayout, QHBoxLayout, QGroupBox, QLabel, QPushButton, \
+    QAbstractItemView, QLineEdit, QFileDialog
+
+import app
+from app import AppSettings, Instrumentation
+from app.XMLWorkers import Worker
+
+
+class IssueModel(QAbstractTableModel):
+    """
+    One row per problem found in the document. Rows are added as the worker process sends them
+    """
+    COLUMNS = ["Line", "Column", "Level", "Message"]
+
+    def __init__(self):
+        super().__init__()
+        self.issues = []
+
+    def clear(self):
+        self.beginResetModel()
+        self.issues = []
+        self.endResetModel()
+
+    def append(self, issues):
+        self.beginInsertRows(QModelIndex(), len(self.issues), len(self.issues) + len(issues) - 1)
+        self.issues.extend(issues)
+        self.endInsertRows()
+
+    def rowCount(self, parent: QModelIndex = None) -> int:
+        return 0 if parent is not None and parent.isValid() else len(self.issues)
+
+    def columnCount(self, parent: QModelIndex = None) -> int:
+        return len(self.COLUMNS)
+
+    def data(self, index: QModelIndex, role: int = None):
+        if not index.isValid():
+            return None
+        issue = self.issues[index.row()]
+        if role == Qt.DisplayRole:
+            match index.column():
+                case 0:
+                    return str(issue.line)
+                case 1:
+                    return str(issue.column)
+                case 2:
+                    return issue.level
+                case 3:
+                    return issue.message
+        if role == Qt.ToolTipRole:
+            return "/".join(str(key) for key in issue.path) if issue.path else "Not found in the tree"
+        if role == Qt.TextAlignmentRole and index.column() in (0, 1):
+            return Qt.AlignRight | Qt.AlignVCenter
+        return None
+
+    def headerData(self, section, orientation, role=None):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.COLUMNS[section]
+        return None
+
+
+class ValidationPanel(QDockWidget):
+    """
+    Validates the loaded file against an XSD, DTD or RelaxNG schema in a worker process. Problems are listed as
+    they are found and double clicking one shows its node in the tree. Without a schema, the DTD declared by the
+    document is used
+    """
+    show_node_event = pyqtSignal(tuple)
+
+    def __init__(self, parent):
+        super(ValidationPanel, self).__init__("Validation", parent)
+        self.setObjectName("ValidationPanel")
+        self.file = None
+        self.worker = None
+        self.model = IssueModel()
+        self.table = QTableView()
+        self.schema = QLineEdit()
+        self.status = QLabel()
+        self._init_ui()
+
+    def _init_ui(self):
+        self.table.setModel(self.model)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.table.setAlternatingRowColors(True)
+        self.table.setShowGrid(False)
+        self.table.setWordWrap(False)
+        self.table.verticalHeader().hide()
+        self.table.verticalHeader().setDefaultSectionSize(self.table.fontMetrics().height() + 3)
+        self.table.horizontalHeader().setStretchLastSection(True)
+        self.table.doubleClicked.connect(self.issue_double_click)
+
+        self.schema.setPlaceholderText("The DTD declared by the document")
+        self.schema.setText(AppSettings.last_schema())
+        self.schema.returnPressed.connect(self.validate)
+        choose = QPushButton("Schema ...")
+        choose.clicked.connect(self.choose_schema)
+        validate = QPushButton("Validate")
+        validate.clicked.connect(self.validate)
+
+        schema = QHBoxLayout()
+        schema.addWidget(self.schema, 1)
+        schema.addWidget(choose)
+        schema.addWidget(validate)
+
+        layout = QVBoxLayout()
+        layout.setContentsMargins(1, 1, 1, 1)
+        layout.addLayout(schema)
+        layout.addWidget(self.table)
+        layout.addWidget(self.status)
+
+        container = QGroupBox()
+        container.setLayout(layout)
+        self.setWidget(container)
+
+    def set_file(self, file):
+        """
+        Forgets the problems of the previous file and validates the file if a schema was chosen
+        :param file: the file to validate
+        :return:
+        """
+        if file == self.file:
+            return
+        self.cancel()
+        self.file = file if file and os.path.isfile(file) else None
+        self.model.clear()
+        self.status.setText("")
+        if self.file is not None and self.schema.text():
+            self.validate()
+
+    def choose_schema(self):
+        schema, _ = QFileDialog.getOpenFileName(parent=self, caption="Select a schema",
+                                                directory=os.path.dirname(self.schema.text()),
+                                                filter="Schemas (*.xsd *.dtd *.rng);;All files (*)")
+        if schema:
+            self.schema.setText(schema)
+            self.validate()
+
+    def validate(self):
+        if self.file is None:
+            self.status.setText("Open an XML file to validate it")
+            return
+        # The worker process is only started the first time a file is validated
+        from app import XMLValidation
+
+        self.cancel()
+        self.model.clear()
+        schema = self.schema.text().strip() or None
+        if schema is not None:
+            AppSettings.set_last_schema(schema)
+        validation = XMLValidation.start(self.file, schema)
+        file = self.file
+
+        def _validate(worker):
+            with Instrumentation.span("validation", file=file):
+                return validation.wait(worker.report, worker.is_cancelled)
+
+        self.worker = Worker(_validate)
+        self.worker.signals.progress.connect(partial(self.issues_found_event, self.worker))
+        self.worker.signals.finished.connect(self.validation_finished_event)
+        self.worker.signals.failed.connect(partial(self.validation_failed_event, self.worker))
+        self.worker.start()
+        self.status.setText(f"Validating {os.path.basename(self.file)} ...")
+
+    def cancel(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            self.worker = None
+
+    def close_validation(self):
+        self.cancel()
+        from app import XMLValidation
+        XMLValidation.shutdown()
+
+    def issues_found_event(self, worker, issues):
+        if worker is not self.worker:
+            return
+        self.model.append(issues)
+        self.status.setText(f"Validating ... {self.model.rowCount()} problem(s) so far")
+
+    def validation_finished_event(self, count):
+        self.worker = None
+        if count is None:
+            return
+        if count == 0:
+            self.status.setText(f"{os.path.basename(self.file)} is valid")
+        elif count > self.model.rowCount():
+            self.status.setText(f"{count} problem(s), the first {self.model.rowCount()} are listed")
+        else:
+            self.status.setText(f"{count} problem(s)")
+        self.table.resizeColumnsToContents()
+
+    def validation_failed_event(self, worker, message):
+        if worker is not self.worker:
+            return
+        self.worker = None
+        self.status.setText(message)
+        app.logger.warning(f"Unable to validate: {message}")
+
+    def issue_double_click(self, index):
+        issue = self.model.issues[index.row()]
+        if issue.path:
+            self.show_node_event.emit(tuple(issue.path))
+        else:
+            self.status.setText(f"The problem on line {issue.line} could not be found in the tree")
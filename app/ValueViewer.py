@@ -0,0 +1,72 @@
+from PyQt5.QtGui import QFontDatabase
+from PyQt5.QtWidgets import QDialog, QPlainTextEdit, QVBoxLayout, QHBoxLayout, QLabel, QPushButton, QFileDialog, \
+    QApplication
+
+import app
+from app import Instrumentation
+
+# Lines longer than this are shown in pieces, laying out a single line of several megabytes takes seconds
+VIEWER_LINE_LENGTH = 1024
+
+
+class ValueViewer(QDialog):
+    """
+    Shows the whole of a value that is too large for the tree. The value is only copied into the viewer when it
+    is opened, copying and saving use the value as it is in the document
+    """
+
+    def __init__(self, parent, name, value):
+        super(ValueViewer, self).__init__(parent)
+        self.value = value
+        self.text = QPlainTextEdit()
+        self._init_ui(name)
+
+    def _init_ui(self, name):
+        self.setWindowTitle(name or "Value")
+        self.text.setReadOnly(True)
+        self.text.setLineWrapMode(QPlainTextEdit.NoWrap)
+        self.text.setFont(QFontDatabase.systemFont(QFontDatabase.FixedFont))
+        with Instrumentation.span("value_viewer", length=len(self.value)):
+            self.text.setPlainText(_break_long_lines(self.value))
+
+        copy = QPushButton("Copy")
+        copy.clicked.connect(self.copy)
+        save = QPushButton("Save as ...")
+        save.clicked.connect(self.save)
+        close = QPushButton("Close")
+        close.clicked.connect(self.close)
+
+        buttons = QHBoxLayout()
+        buttons.addWidget(QLabel(f"{len(self.value):,} characters"))
+        buttons.addStretch(1)
+        buttons.addWidget(copy)
+        buttons.addWidget(save)
+        buttons.addWidget(close)
+
+        layout = QVBoxLayout()
+        layout.addWidget(self.text)
+        layout.addLayout(buttons)
+        self.setLayout(layout)
+        self.resize(800, 600)
+
+    def copy(self):
+        QApplication.clipboard().setText(self.value)
+
+    def save(self):
+        file, _ = QFileDialog.getSaveFileName(parent=self, caption="Save value", filter="All files (*)")
+        if file:
+            with open(file, "w", encoding="utf-8") as f:
+                f.write(self.value)
+            app.logger.info(f"Value saved to {file}")
+
+
+def _break_long_lines(value):
+    if len(value) <= VIEWER_LINE_LENGTH:
+        return value
+    pieces = []
+    for line in value.split("\n"):
+        if len(line) <= VIEWER_LINE_LENGTH:
+            pieces.append(line)
+        else:
+            pieces.extend(line[i:i + VIEWER_LINE_LENGTH] for i in range(0, len(line), VIEWER_LINE_LENGTH))
+    return "\n".join(pieces)
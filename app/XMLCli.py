@@ -0,0 +1,157 @@
+"""
+Headless command line interface to the loading and query layers. Nothing in here imports Qt.
+
+    python -m app.XMLCli query --xpath "//book[@id='bk101']/title" catalog.xml
+    python -m app.XMLCli query --text "midnight" *.xml
+    python -m app.XMLCli export --path catalog/book --format csv catalog.xml
+    python -m app.XMLCli validate feeds/*.xml
+    python -m app.XMLCli validate --schema feed.xsd feeds/*.xml
+
+Results of query and validate are streamed to stdout as JSON lines, one line per match or file.
+"""
+import argparse
+import json
+import math
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import app
+from app import XMLLoader, XMLQuery, XMLValidation
+
+_parallel_threshold = XMLLoader.DEFAULT_PARALLEL_THRESHOLD
+
+
+def query_file(file, xpath=None, text=None, case_sensitive=False):
+    """
+    Runs a query against one file
+    :return: a list of result dictionaries
+    """
+    if xpath is not None:
+        matches = XMLQuery.xpath(file, xpath)
+    else:
+        matches = XMLQuery.find_text(_load(file), text, case_sensitive)
+    return [{"file": file, "path": path, "value": value} for path, value in matches]
+
+
+def validate_file(file, schema=None):
+    """
+    Checks that a file can be loaded, or that it is valid against a schema
+    :return: a list with a single result dictionary
+    """
+    try:
+        if schema is None:
+            _load(file)
+            return [{"file": file, "valid": True}]
+        issues = []
+        count = XMLValidation.validate(file, schema, issues.extend)
+        return [{"file": file, "valid": count == 0, "problems": count,
+                 "issues": [{"line": issue.line, "message": issue.message} for issue in issues]}]
+    except Exception as e:
+        return [{"file": file, "valid": False, "error": str(e)}]
+
+
+def export_file(file, path="", output_format="json", stream=None):
+    """
+    Writes the subtree at the path as JSON, or as a table in CSV format
+    """
+    stream = stream or sys.stdout
+    value = XMLQuery.resolve(_load(file), path)
+    if output_format == "csv":
+        XMLQuery.write_csv(value, stream)
+    else:
+        json.dump(value, stream, indent=2)
+        stream.write("\n")
+
+
+def run_many(task, files, jobs):
+    """
+    Runs the task for every file and yields the results as they become available, in the order of the files.
+    A single file is processed in this process so that the loader can parse it in parallel
+    """
+    if len(files) == 1 or jobs == 1:
+        for file in files:
+            yield from _safe(task, file)
+        return
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker) as executor:
+        for results in executor.map(partial(_safe, task), files, chunksize=4):
+            yield from results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="xml-tree", description=f"{app.__APP_NAME__} command line")
+    parser.add_argument("--jobs", type=int, default=None, help="number of worker processes, defaults to all cores")
+    parser.add_argument("--log-level", default="WARNING")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    query = commands.add_parser("query", help="run an XPath or free-text query")
+    criteria = query.add_mutually_exclusive_group(required=True)
+    criteria.add_argument("--xpath", help="an XPath expression, for XML and HTML files")
+    criteria.add_argument("--text", help="free text to find in node names and values")
+    query.add_argument("--case-sensitive", action="store_true")
+    query.add_argument("files", nargs="+")
+
+    export = commands.add_parser("export", help="export a subtree as JSON or a list as CSV")
+    export.add_argument("--path", default="", help="path to the subtree, for example catalog/book")
+    export.add_argument("--format", choices=["json", "csv"], default="json")
+    export.add_argument("file")
+
+    validate = commands.add_parser("validate", help="check that files can be loaded, or are valid against a schema")
+    validate.add_argument("--schema", help="an XSD, DTD or RelaxNG (.rng) schema")
+    validate.add_argument("files", nargs="+")
+
+    args = parser.parse_args(argv)
+    app.configure_logging(level=args.log_level)
+
+    match args.command:
+        case "query":
+            task = partial(query_file, xpath=args.xpath, text=args.text, case_sensitive=args.case_sensitive)
+            return _stream(run_many(task, args.files, args.jobs))
+        case "validate":
+            failures = 0
+            for result in run_many(partial(validate_file, schema=args.schema), args.files, args.jobs):
+                failures += not result.get("valid", False)
+                _print(result)
+            return 1 if failures else 0
+        case "export":
+            try:
+                export_file(args.file, args.path, args.format)
+            except (XMLQuery.QueryError, OSError) as e:
+                print(str(e), file=sys.stderr)
+                return 1
+            return 0
+
+
+def _init_worker():
+    # Files are already spread across processes, each one is parsed on a single core
+    global _parallel_threshold
+    _parallel_threshold = math.inf
+
+
+def _load(file):
+    return XMLLoader.load(file, parallel_threshold=_parallel_threshold)
+
+
+def _safe(task, file):
+    try:
+        return task(file)
+    except Exception as e:
+        return [{"file": file, "error": str(e)}]
+
+
+def _stream(results):
+    errors = 0
+    for result in results:
+        errors += "error" in result
+        _print(result)
+    return 1 if errors else 0
+
+
+def _print(result):
+    sys.stdout.write(json.dumps(result, default=str))
+    sys.stdout.write("\n")
+    sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,212 @@
+"""
+A directory, or several files, opened as one document. Files are listed as they are found and each file is only
+parsed when it is needed. Parsed files are kept in a least recently used cache so that collections larger than
+memory can be browsed
+"""
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import app
+from app import Instrumentation, XMLLoader, XMLQuery, XMLSource
+
+# Parsed files kept in memory
+DEFAULT_CACHED_DOCUMENTS = 256
+# Threads that parse the files after the one being looked at
+PREFETCH_WORKERS = 4
+# Files parsed ahead of the one being looked at
+PREFETCH_COUNT = 8
+# Files reported to the listener at a time
+_BATCH_SIZE = 500
+
+_TYPES = (".XML", ".JSON", ".HTM", ".HTML")
+
+
+def is_supported(file):
+    return XMLSource.file_type(file) in _TYPES
+
+
+class Collection:
+    """
+    The files of a collection and a cache of their parsed documents. Each file is known by its path relative to
+    the common directory of the collection
+    """
+
+    def __init__(self, paths, cached_documents=DEFAULT_CACHED_DOCUMENTS, workers=PREFETCH_WORKERS,
+                 html_profile=XMLLoader.HTML_FULL):
+        self.paths = [os.path.abspath(path) for path in paths]
+        if len(self.paths) == 1 and os.path.isdir(self.paths[0]):
+            self.base = self.paths[0]
+        elif len(self.paths) == 1:
+            self.base = os.path.dirname(self.paths[0])
+        else:
+            self.base = os.path.commonpath(self.paths)
+            if not os.path.isdir(self.base):
+                self.base = os.path.dirname(self.base)
+        self.name = os.path.basename(self.base) or self.base
+        self.cached_documents = cached_documents
+        self.html_profile = html_profile
+        # Names are shared by every file of the collection
+        self.names = XMLLoader.NameTable()
+        self.files = []
+        self._positions = {}
+        self._documents = OrderedDict()
+        self._prefetching = OrderedDict()
+        self._lock = threading.Lock()
+        self._workers = workers
+        self._executor = None
+
+    def key(self, file):
+        return os.path.relpath(file, self.base)
+
+    def list_files(self, cancelled=None, report=None):
+        """
+        Finds the supported files of the collection. Directories are read one at a time in name order and the
+        files are reported as they are found
+        :param cancelled: a function that returns True when the listing should stop
+        :param report: a function that is called with lists of (key, file) tuples
+        :return: the number of files, or None if cancelled
+        """
+        self.files = []
+        self._positions = {}
+        batch = []
+        for file in _walk(self.paths):
+            self._positions[file] = len(self.files)
+            self.files.append(file)
+            batch.append((self.key(file), file))
+            if len(batch) >= _BATCH_SIZE:
+                if cancelled is not None and cancelled():
+                    return None
+                if report is not None:
+                    report(batch)
+                batch = []
+        if batch and report is not None:
+            report(batch)
+        return len(self.files)
+
+    def document(self, file):
+        """
+        The parsed document of a file, from the cache if it is there
+        :param file: the file
+        :return: a tuple of the document and the files that were dropped from the cache to make room for it
+        """
+        with self._lock:
+            document = self._documents.get(file)
+            if document is not None:
+                self._documents.move_to_end(file)
+                Instrumentation.count("collection_cache_hits")
+                return document, []
+            future = self._prefetching.pop(file, None)
+        document = future.result() if future is not None else self._parse(file)
+        evicted = []
+        with self._lock:
+            self._documents[file] = document
+            while len(self._documents) > self.cached_documents:
+                evicted.append(self._documents.popitem(last=False)[0])
+        return document, evicted
+
+    def prefetch_after(self, file, count=PREFETCH_COUNT):
+        """
+        Starts parsing the files that follow a file in the background
+        """
+        position = self._positions.get(file)
+        if position is None:
+            return
+        for following in self.files[position + 1:position + 1 + count]:
+            self.prefetch(following)
+
+    def prefetch(self, file):
+        with self._lock:
+            if file in self._documents or file in self._prefetching:
+                return
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="collection")
+            self._prefetching[file] = self._executor.submit(self._parse, file)
+            # Files that were prefetched but never looked at are not kept
+            while len(self._prefetching) > self._workers + PREFETCH_COUNT:
+                _, stale = self._prefetching.popitem(last=False)
+                stale.cancel()
+
+    def documents(self, cancelled=None):
+        """
+        Every document of the collection in order. Files that are not cached are parsed but not added to the
+        cache, and files that cannot be parsed are skipped
+        :param cancelled: a function that returns True when the iteration should stop
+        :return: yields (key, document) tuples
+        """
+        for file in list(self.files):
+            if cancelled is not None and cancelled():
+                return
+            with self._lock:
+                document = self._documents.get(file)
+            if document is None:
+                try:
+                    document = self._parse(file)
+                except Exception as e:
+                    app.logger.warning(f"Skipping {file}: {str(e)}")
+                    continue
+            yield self.key(file), document
+
+    def filter_paths(self, predicate, prefix=(), cancelled=None):
+        """
+        Finds the nodes of every document that pass the predicate, see XMLQuery.filter_paths
+        :param predicate: a Predicate
+        :param prefix: the path of the collection itself
+        :param cancelled: a function that returns True when the search should stop
+        :return: a tuple of the paths of the matches and the paths of the matches and their ancestors, or None if
+        cancelled. Paths start with the prefix and the key of the file
+        """
+        matches = set()
+        visible = set()
+        for key, document in self.documents(cancelled):
+            result = XMLQuery.filter_paths(document, predicate, cancelled)
+            if result is None:
+                return None
+            if result[0]:
+                base = prefix + (key,)
+                matches.update(base + path for path in result[0])
+                visible.update(base + path for path in result[1])
+                visible.add(base)
+        if cancelled is not None and cancelled():
+            return None
+        if visible:
+            visible.update(prefix[:length] for length in range(1, len(prefix) + 1))
+        return matches, visible
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+            self._prefetching.clear()
+            self._documents.clear()
+
+    def _parse(self, file):
+        Instrumentation.count("collection_parses")
+        return XMLLoader.load(file, names=self.names, html_profile=self.html_profile)
+
+
+def _walk(paths):
+    for path in paths:
+        if not os.path.isdir(path):
+            if is_supported(path):
+                yield path
+            continue
+        directories = [path]
+        while directories:
+            directory = directories.pop()
+            try:
+                with os.scandir(directory) as entries:
+                    entries = sorted(entries, key=lambda entry: entry.name)
+            except OSError as e:
+                app.logger.warning(f"Unable to read {directory}: {str(e)}")
+                continue
+            subdirectories = []
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirectories.append(entry.path)
+                elif is_supported(entry.name):
+                    yield entry.path
+            # Depth first, in name order
+            directories.extend(reversed(subdirectories))
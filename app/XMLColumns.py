@@ -0,0 +1,270 @@
+import json
+import os
+import pickle
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from lxml import etree
+
+from app import Instrumentation, XMLSource
+from app.XMLLoader import NameTable, element_value
+from app.XMLQuery import QueryError, PATH_SEPARATOR, TEXT_NODE, walk_nodes, tag_path, text_of
+
+# Columns discovered after this many are dropped, long lists would otherwise add a column per element
+MAX_COLUMNS = 1000
+# Rows are stored and spilled in pages of this many rows
+PAGE_ROWS = 4096
+# Rows kept in memory before pages are spilled to disk
+DEFAULT_MEMORY_ROWS = 100000
+# Spilled columns of a page kept decoded in memory
+CACHED_CHUNKS = 256
+# Strings up to this length are interned, repeated values such as codes and statuses are then stored once
+_INTERN_LENGTH = 32
+# How many elements are read between checks for cancellation
+_CHECK_INTERVAL = 4096
+# The least time between two progress reports
+_REPORT_SECONDS = 0.1
+
+
+class PathPattern:
+    """
+    Selects elements by the names on their path
+        /catalog/book       books directly below the catalog root
+        //order/line        lines directly below an order, anywhere in the document
+        order/line          the same as //order/line
+    * matches any name
+    """
+
+    def __init__(self, expression):
+        expression = expression.strip()
+        self.anywhere = not expression.startswith(PATH_SEPARATOR) or expression.startswith(PATH_SEPARATOR * 2)
+        self.names = tuple(expression.lstrip(PATH_SEPARATOR).split(PATH_SEPARATOR))
+        if not all(self.names) or any(c in expression for c in "[]@()"):
+            raise QueryError(f"{expression} is not a path, use names separated by / for example //order/line")
+
+    def matches(self, names):
+        if len(names) < len(self.names) or (not self.anywhere and len(names) != len(self.names)):
+            return False
+        for expected, name in zip(self.names, names[len(names) - len(self.names):]):
+            if expected != "*" and expected != name:
+                return False
+        return True
+
+
+class ColumnStore:
+    """
+    Rows stored column by column in pages of PAGE_ROWS rows. Nested values are flattened into dotted column
+    names, for example customer.@id or line.0.sku.
+    Once there are more than memory_rows rows, completed pages are written to a temporary spill file one column
+    at a time and read back through a small LRU cache, so only the visible columns of the pages around the rows
+    being looked at are held in memory.
+    Rows can be appended on one thread while another reads the rows and columns that were already counted
+    """
+
+    def __init__(self, max_columns=MAX_COLUMNS, memory_rows=DEFAULT_MEMORY_ROWS, cached_chunks=CACHED_CHUNKS):
+        self.max_columns = max_columns
+        self.memory_rows = memory_rows
+        self.names = []
+        self.rows = 0
+        self.dropped_columns = 0
+        self._known = set()
+        self._closed = False
+        # Completed pages, each one a dictionary of column name to cells, or a _SpilledPage
+        self._pages = []
+        self._current = {}
+        self._spill = None
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._cached_chunks = cached_chunks
+
+    @property
+    def spilled(self):
+        return self._spill is not None
+
+    def append(self, value):
+        offset = self.rows % PAGE_ROWS
+        for name, cell in flatten(value).items():
+            column = self._current.get(name)
+            if column is None:
+                if name not in self._known:
+                    if len(self.names) >= self.max_columns:
+                        self.dropped_columns += 1
+                        continue
+                    self._known.add(name)
+                    self.names.append(name)
+                column = self._current[name] = []
+            if len(column) < offset:
+                column.extend([None] * (offset - len(column)))
+            if isinstance(cell, str) and len(cell) <= _INTERN_LENGTH:
+                cell = sys.intern(cell)
+            column.append(cell)
+        self.rows += 1
+        if self.rows % PAGE_ROWS == 0:
+            self._complete_page()
+
+    def value(self, row, column):
+        number, offset = divmod(row, PAGE_ROWS)
+        cells = self._cells(number, self.names[column])
+        return cells[offset] if cells is not None and offset < len(cells) else None
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            if self._spill is not None:
+                self._spill.close()
+                self._spill = None
+            self._pages.clear()
+            self._cache.clear()
+            self._current = {}
+
+    def _complete_page(self):
+        page = self._current
+        if self._closed:
+            self._current = {}
+            return
+        if self._spill is None and self.rows > self.memory_rows:
+            with self._lock:
+                self._spill = tempfile.TemporaryFile(prefix="xml-tree-", suffix=".columns")
+                self._pages = [self._write(spilled) for spilled in self._pages]
+        if self._spill is not None:
+            with self._lock:
+                page = self._write(page)
+        # The page is published before the next one is started so that readers always find the rows
+        self._pages.append(page)
+        self._current = {}
+
+    def _write(self, page):
+        spilled = _SpilledPage()
+        self._spill.seek(0, os.SEEK_END)
+        for name, cells in page.items():
+            data = pickle.dumps(cells, protocol=pickle.HIGHEST_PROTOCOL)
+            spilled[name] = (self._spill.tell(), len(data))
+            self._spill.write(data)
+        Instrumentation.count("table_pages_spilled")
+        return spilled
+
+    def _cells(self, number, name):
+        if number >= len(self._pages):
+            return self._current.get(name)
+        page = self._pages[number]
+        if not isinstance(page, _SpilledPage):
+            return page.get(name)
+        location = page.get(name)
+        if location is None:
+            return None
+        key = (number, name)
+        with self._lock:
+            cells = self._cache.get(key)
+            if cells is not None:
+                self._cache.move_to_end(key)
+                return cells
+            if self._spill is None:
+                return None
+            self._spill.seek(location[0])
+            cells = pickle.loads(self._spill.read(location[1]))
+            Instrumentation.count("table_chunks_read")
+            self._cache[key] = cells
+            if len(self._cache) > self._cached_chunks:
+                self._cache.popitem(last=False)
+        return cells
+
+
+class _SpilledPage(dict):
+    # Column name to the offset and length of its cells in the spill file
+    pass
+
+
+def flatten(value, prefix="", row=None):
+    """
+    Flattens a value of a loaded document into a single row
+    :param value: the value to flatten
+    :param prefix: the column name of the value
+    :param row: the row to add to
+    :return: a dictionary of dotted column names to values
+    """
+    row = {} if row is None else row
+    if isinstance(value, dict):
+        for key, child in value.items():
+            if key == TEXT_NODE:
+                flatten(text_of(child) if isinstance(child, list) else child, prefix, row)
+            else:
+                flatten(child, f"{prefix}.{key}" if prefix else key, row)
+    elif isinstance(value, list):
+        for index, child in enumerate(value):
+            flatten(child, f"{prefix}.{index}" if prefix else str(index), row)
+    else:
+        row[prefix or TEXT_NODE] = value
+    return row
+
+
+def extract(file, expression, store, cancelled=None, progress=None):
+    """
+    Streams every element that matches the path into the store. Only the element being read and its
+    ancestors are kept in memory
+    :param file: the file to read
+    :param expression: a PathPattern expression
+    :param store: the ColumnStore to fill
+    :param cancelled: a function that returns True when the extraction should stop
+    :param progress: a function that is called with the number of rows from time to time
+    :return: the store, or None if cancelled
+    """
+    pattern = PathPattern(expression)
+    ext = XMLSource.file_type(file)
+    if ext == ".JSON":
+        rows = _extract_document(file, pattern, store, cancelled)
+    else:
+        rows = _extract_xml(file, ext.startswith(".HTM"), pattern, store, cancelled, progress)
+    if rows is None:
+        return None
+    if progress is not None:
+        progress(store.rows)
+    return store
+
+
+def _extract_xml(file, html, pattern, store, cancelled, progress):
+    table = NameTable()
+    names = []
+    matched = []
+    open_matches = 0
+    reported = time.perf_counter()
+    with XMLSource.open_source(file) as source:
+        events = etree.iterparse(source, events=("start", "end"), html=html, huge_tree=True, remove_comments=True,
+                                 remove_pis=True)
+        for visited, (event, element) in enumerate(events):
+            if event == "start":
+                names.append(table.element_name(element))
+                matched.append(pattern.matches(names))
+                open_matches += matched[-1]
+                continue
+
+            names.pop()
+            if matched.pop():
+                open_matches -= 1
+                store.append(element_value(element, table))
+            # Elements inside a match are needed until the match is complete
+            if open_matches == 0:
+                element.clear()
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+
+            if visited % _CHECK_INTERVAL == 0:
+                if cancelled is not None and cancelled():
+                    return None
+                if progress is not None and time.perf_counter() - reported > _REPORT_SECONDS:
+                    progress(store.rows)
+                    reported = time.perf_counter()
+    return store.rows
+
+
+def _extract_document(file, pattern, store, cancelled):
+    with XMLSource.open_source(file) as source:
+        document = json.load(source)
+    for visited, (path, name, value) in enumerate(walk_nodes(document)):
+        if cancelled is not None and visited % _CHECK_INTERVAL == 0 and cancelled():
+            return None
+        if pattern.matches(tag_path(path)):
+            store.append(value)
+    return store.rows
@@ -1,17 +1,45 @@
 import html
+import json
 from enum import Enum
+from functools import cache
 
 from PyQt5.QtCore import QRectF, QSizeF, QVariant, Qt
-from PyQt5.QtGui import QTextDocument, QStandardItem, QIcon
+from PyQt5.QtGui import QTextDocument, QStandardItem, QIcon, QFont
 from PyQt5.QtWidgets import QStyledItemDelegate, QStyle, QStyleOptionViewItem
 
-from app import AppSettings
+from app import AppSettings, Instrumentation
+
+# How many characters of a large value are shown
+PREVIEW_LENGTH = 120
+
+
+@cache
+def _theme_icon(name):
+    # Resolved on first use, looking up theme icons at import time slows down startup
+    return QIcon.fromTheme(name)
+
+
+def preview(value, length=None):
+    """
+    Shortens a value that is too long to be shown in full
+    :param value: the text to shorten
+    :param length: values longer than this are shortened, by default the large value length of the settings
+    :return: the value if it is short enough, otherwise the start of the value and its length
+    """
+    length = AppSettings.large_value_length() if length is None else length
+    if len(value) <= length:
+        return value
+    Instrumentation.count("large_values")
+    start = " ".join(value[:PREVIEW_LENGTH].split())
+    return f"{start} ... ({len(value):,} characters)"
 
 
 class ItemType(Enum):
     NODE = 1,
     DICT = 2,
-    LIST = 3
+    LIST = 3,
+    COMMENT = 4,
+    INSTRUCTION = 5
 
 
 class XMLItemDelegate(QStyledItemDelegate):
@@ -20,9 +48,13 @@ class XMLItemDelegate(QStyledItemDelegate):
     def __init__(self, parent=None):
         super().__init__(parent)
         self.parent = parent
-        self.font = AppSettings.font()
+        self.font = AppSettings.font() or QFont()
 
     def paint(self, painter, option, index):
+        with Instrumentation.frequent_span("paint"):
+            self._paint(painter, option, index)
+
+    def _paint(self, painter, option, index):
         options = QStyleOptionViewItem()
         options.__init__(option)
         self.initStyleOption(options, index)
@@ -56,6 +88,7 @@ class XMLItemDelegate(QStyledItemDelegate):
         options.__init__(option)
         self.initStyleOption(options, index)
 
+        Instrumentation.count("documents_rendered")
         doc = QTextDocument()
         doc.setDefaultFont(self.font)
         doc.setHtml(options.text)
@@ -66,6 +99,7 @@ class XMLItemDelegate(QStyledItemDelegate):
     def _get_document(self, index):
         htm = index.model().data(index, Qt.UserRole)
         if htm and not isinstance(htm, QVariant):
+            Instrumentation.count("documents_rendered")
             doc = QTextDocument()
             doc.setDefaultFont(self.font)
             doc.setHtml(htm)
@@ -73,16 +107,21 @@ class XMLItemDelegate(QStyledItemDelegate):
 
 
 class XMLDataItem(QStandardItem):
-    __ROOT_ICON = QIcon.fromTheme("folder")
-    __NODE_ICON = QIcon.fromTheme("text-x-generic")
-    __LIST_ICON = QIcon.fromTheme("x-office-spreadsheet")
+    __ROOT_ICON = "folder"
+    __NODE_ICON = "text-x-generic"
+    __LIST_ICON = "x-office-spreadsheet"
 
     __TEXT_NODE = "#text"
+    # Comments and processing instructions are named by the loader with these keys
+    __KINDS = {"#comment": ItemType.COMMENT, "#pi": ItemType.INSTRUCTION}
 
-    def __init__(self, name, data, parent_sub_index=None, column_name=None):
+    def __init__(self, name, data, parent_sub_index=None, column_name=None, key=None):
         super().__init__()
+        Instrumentation.count("items_created")
         self.colors = AppSettings.color_theme()
         self.name = self._clean_text(name)
+        # Identifies this item among its siblings: the dictionary key, or the position in a list
+        self.key = name if key is None else key
         self.parent_sub_index = parent_sub_index
         self.column_name = column_name
         self.attributes = {}
@@ -94,13 +133,17 @@ class XMLDataItem(QStandardItem):
         self.htmltext = None
         # The plain text name to display
         self.plaintext = None
+        # Values too long to display, by #text or attribute name. These are the strings of the loaded document,
+        # they are not copied and are only shown in full on request
+        self.large_values = {}
 
         if isinstance(data, dict):
             self.attributes, self.datadict = self._extract_attrs(data)
             # there can be only attributes in the dict
             if len(self.datadict) == 1 and self.__TEXT_NODE in self.datadict:
-                self.datatext = self.datadict[self.__TEXT_NODE]
-                self.datadict.pop(self.__TEXT_NODE)
+                text = self.datadict.pop(self.__TEXT_NODE)
+                self.datatext = self._clean_text(self._shorten(self.__TEXT_NODE, text)) if isinstance(text, str) \
+                    else text
                 self.nodetype = ItemType.NODE
             else:
                 self.nodetype = ItemType.DICT
@@ -108,15 +151,32 @@ class XMLDataItem(QStandardItem):
             self.datalist = data
             self.nodetype = ItemType.LIST
         elif isinstance(data, str):
-            self.datatext = self._clean_text(data)
-            self.nodetype = ItemType.NODE
+            self.datatext = self._clean_text(self._shorten(self.__TEXT_NODE, data))
+            # The kind is in the key as the loader wrote it, the name may have been changed for display. Items of
+            # a list are keyed by position and named after the list
+            self.nodetype = self.__KINDS.get(self.key if isinstance(self.key, str) else name, ItemType.NODE)
         elif data is None:
             self.datatext = ""
             self.nodetype = ItemType.NODE
         else:
-            print(f"{str(data)} has an unexpected type ")
+            # Numbers and booleans from JSON documents, shown the way JSON writes them
+            self.datatext = self._clean_text(json.dumps(data) if isinstance(data, (bool, int, float)) else str(data))
+            self.nodetype = ItemType.NODE
         self._create_display_texts()
 
+    def path(self):
+        """
+        The keys from the top of the document to this item. Unlike an index, the path does not change when the
+        model is reloaded
+        :return: a tuple of keys
+        """
+        path = []
+        item = self
+        while item is not None:
+            path.append(item.key)
+            item = item.parent()
+        return tuple(reversed(path))
+
     def can_tabulate(self):
         return self.nodetype == ItemType.LIST
 
@@ -146,7 +206,7 @@ class XMLDataItem(QStandardItem):
                     # It's a root
                     self.plaintext = self.name
                     self.htmltext = f"<p><span style='color:{self.colors['node']};'>{self.name}</span></p>"
-                    self.setIcon(self.__ROOT_ICON)
+                    self.setIcon(_theme_icon(self.__ROOT_ICON))
 
             case ItemType.LIST:
                 # It's a list
@@ -157,7 +217,15 @@ class XMLDataItem(QStandardItem):
                                 f"      <em>...list with {len(self.datalist)} item(s)</em>" \
                                 f"  </span>" \
                                 f"</p>"
-                self.setIcon(self.__LIST_ICON)
+                self.setIcon(_theme_icon(self.__LIST_ICON))
+
+            case ItemType.COMMENT | ItemType.INSTRUCTION:
+                # The text is already escaped, only the markers need escaping for the HTML
+                start, end = ("<!-- ", " -->") if self.nodetype == ItemType.COMMENT else ("<?", "?>")
+                self.plaintext = f"{start}{self.datatext}{end}"
+                self.htmltext = f"<p><span style='color:{self.colors['comment']};'>" \
+                                f"<em>{html.escape(start)}{self.datatext}{html.escape(end)}</em>" \
+                                f"</span></p>"
 
             case _:
                 if self.name == "":
@@ -173,7 +241,7 @@ class XMLDataItem(QStandardItem):
                                     f" = " \
                                     f"<span style='color:{self.colors['value']};'>{self.datatext}</span>" \
                                     f"</p>"
-                    self.setIcon(self.__NODE_ICON)
+                    self.setIcon(_theme_icon(self.__NODE_ICON))
 
         self.setText(self.plaintext)
 
@@ -193,12 +261,27 @@ class XMLDataItem(QStandardItem):
         _html = "[ "
 
         for key in self.attributes:
-            _text = _text + f"{self._clean_text(key)}=\"{self._clean_text(self.attributes[key])}\""
+            value = self._shorten(f"@{key}", self.attributes[key])
+            _text = _text + f"{self._clean_text(key)}=\"{self._clean_text(value)}\""
             _html = _html + f"<i>{key} = " \
                             f"<span style='color:{self.colors['attribute']};'>" \
-                            f"\"{self.attributes[key]}\"</span></i> "
+                            f"\"{html.escape(str(value))}\"</span></i> "
         return _text + " ]", _html + " ]"
 
+    def _shorten(self, name, value):
+        """
+        Keeps a reference to a value too long to display
+        :param name: #text, or the attribute name with an @
+        :param value: the value
+        :return: the value to display
+        """
+        if not isinstance(value, str):
+            return value
+        shortened = preview(value)
+        if shortened is not value:
+            self.large_values[name] = value
+        return shortened
+
     @staticmethod
     def _clean_text(text):
         """
@@ -214,19 +297,34 @@ class XMLDataItem(QStandardItem):
     @staticmethod
     def _extract_attrs(datadict):
         """
-        Extracts the attributes from the datadict and returns a dictionary of attributes and the updated datadict
+        Splits the datadict into a dictionary of attributes and a dictionary of children. The datadict is left as
+        it is, the loaded document is shared with the filters and has to stay intact
         :param datadict:
         :return:
         """
 
         attributes = {}
-        # Collect attributes
+        children = {}
         for key in datadict:
             if key.startswith("@"):
                 attributes[key[1:]] = datadict[key]
+            else:
+                children[key] = datadict[key]
+
+        return attributes, children
+
 
-        # Remove attributes from data dict
-        for key in attributes:
-            datadict.pop(f"@{key}")
+class XMLFileItem(XMLDataItem):
+    """
+    A file of a collection. Its document is parsed when the item is expanded and its children are removed again
+    when the document is dropped from the cache of the collection
+    """
+    __FILE_ICON = "text-xml"
 
-        return attributes, datadict
\ No newline at end of file
+    def __init__(self, key, file):
+        super().__init__(key, {}, key=key)
+        self.file = file
+        # Set when the file could not be parsed, the item is then not expanded again
+        self.failed = False
+        self.setIcon(_theme_icon(self.__FILE_ICON))
+        self.setToolTip(file)
@@ -1,32 +1,103 @@
-import datetime
-import json
+import logging
 import os
 import sys
+import time
 from builtins import super
+from collections import deque
+from functools import partial
 from collections import OrderedDict
 
-import xmltodict
 from PyQt5 import QtCore
-from PyQt5.QtCore import Qt, pyqtSignal, QItemSelectionModel, QModelIndex, QAbstractTableModel, QVariant
+from PyQt5.QtCore import Qt, pyqtSignal, QItemSelectionModel, QModelIndex, QAbstractTableModel, QVariant, \
+    QPersistentModelIndex, QSortFilterProxyModel, QObject, QTimer, QPoint
 from PyQt5.QtGui import QStandardItemModel
 from PyQt5.QtWidgets import QTreeView, QAbstractItemView, \
-    QApplication, QDockWidget, QHBoxLayout, QGroupBox, QTableView
-from lxml import etree
-from ordered_set import OrderedSet
+    QApplication, QDockWidget, QHBoxLayout, QGroupBox, QTableView, QProgressDialog, QHeaderView
 
 import app
-from app import AppSettings
-from app.XMLCommon import XMLDataItem, ItemType, XMLItemDelegate
+from app import AppSettings, Instrumentation, XMLQuery, XMLViewState
+from app.XMLCommon import XMLDataItem, XMLFileItem, ItemType, XMLItemDelegate, preview
+from app.XMLWorkers import Worker
+
+
+# Collapsed nodes that are remembered so their children can be released
+MAX_COLLAPSED = 10000
+# Cells of a table whose items are kept
+MAX_CACHED_CELLS = 20000
+
+
+class _BuiltRows:
+    """
+    The number of rows built below each fetched path, as a trie of paths. The rows below a node are dropped by
+    visiting that node's part of the trie only, rather than every path that was fetched
+    """
+    __slots__ = ("rows", "children")
+
+    def __init__(self):
+        self.rows = 0
+        self.children = {}
+
+    def add(self, path, rows):
+        node = self
+        for key in path:
+            child = node.children.get(key)
+            if child is None:
+                child = node.children[key] = _BuiltRows()
+            node = child
+        node.rows += rows
+
+    def find(self, path):
+        node = self
+        for key in path:
+            node = node.children.get(key)
+            if node is None:
+                return None
+        return node
+
+    def remove(self, path):
+        """
+        Drops a path and every path below it
+        :param path: the path, not empty
+        :return: the number of rows that were counted below it
+        """
+        parent = self.find(path[:-1])
+        node = parent.children.pop(path[-1], None) if parent is not None else None
+        rows = 0
+        stack = [node] if node is not None else []
+        while stack:
+            node = stack.pop()
+            rows += node.rows
+            stack.extend(node.children.values())
+        return rows
 
 
 class XMLViewModel(QStandardItemModel):
     load_event = pyqtSignal(str)
 
-    def __init__(self, xml_file=None):
+    def __init__(self, xml_file=None, collection=None):
         super().__init__()
         self.data_file = xml_file
-
-        if xml_file:
+        # The whole parsed document, filters are evaluated against it rather than the items built so far
+        self.document = None
+        # The names and namespaces of the document
+        self.names = None
+        # Paths of the items hidden by the user, these stay hidden when the file is reloaded
+        self.hidden = set()
+        # Set in place of the file when a directory or several files are open, see XMLCollection
+        self.collection = collection
+        self.listing_worker = None
+        self._file_items = {}
+        # The number of rows built below each fetched path, and in total
+        self._fetched = _BuiltRows()
+        self.built_items = 0
+        # The paths of collapsed nodes, least recently collapsed first. Their children are released when the tree
+        # grows past its budget
+        self.collapsed = OrderedDict()
+        # The size the tree is released down to once the memory budget has been exceeded, see release_collapsed
+        self.memory_target = None
+        self._release_pending = False
+
+        if xml_file or collection is not None:
             self.reload()
 
     def set_xml_file(self, xml_file):
@@ -38,16 +109,26 @@ class XMLViewModel(QStandardItemModel):
         :return: returns nothing.
         """
 
-        def parse(file, parser):
-            xml = etree.parse(file, parser=parser).getroot()
-            return xmltodict.parse(etree.tostring(xml))
-
         def build_tree(tree, datadict):
             tree.clear()
             items = []
             for key in datadict:
-                items.append(XMLDataItem(key, datadict[key]))
+                if (key,) not in self.hidden:
+                    items.append(XMLDataItem(self.display_name(key), datadict[key], key=key))
             tree.invisibleRootItem().appendRows(items)
+            self._built((), len(items))
+
+        self._fetched = _BuiltRows()
+        self.built_items = 0
+        self.collapsed.clear()
+        self.memory_target = None
+
+        if self.collection is not None:
+            self._build_collection()
+            return
+
+        # The parsers are only imported once the first file is opened
+        from app import XMLLoader
 
         # Basic defences if file does not exist
         if not self.data_file:
@@ -58,32 +139,23 @@ class XMLViewModel(QStandardItemModel):
             return
 
         try:
-            start_time = datetime.datetime.now()
             app.logger.debug("Starting load")
-            _, ext = os.path.splitext(self.data_file)
-
-            # check the file type
-            if ext.upper().startswith(".HTM"):
-                app.logger.debug("This is an HTML file")
-                data_dict = parse(self.data_file, etree.HTMLParser())
-            elif ext.upper() == ".JSON":
-                app.logger.debug("This is a JSON file")
-                with open(self.data_file, "r") as f:
-                    data_dict = json.load(f)
-            elif ext.upper() == ".XML":
-                app.logger.debug("This is an XML file")
-                data_dict = parse(self.data_file, etree.XMLParser())
-            else:
-                app.logger.debug("This is an Unsupported file. It cannot be loaded")
-                raise Exception("This is an unsupported file. Only HTML, XML and JSON files permitted")
+            names = XMLLoader.NameTable()
+            with Instrumentation.span("parse", file=self.data_file) as parse_span:
+                data_dict = XMLLoader.load(self.data_file,
+                                           parallel_threshold=AppSettings.parallel_parse_threshold(),
+                                           workers=AppSettings.parallel_parse_workers(),
+                                           names=names,
+                                           html_profile=AppSettings.html_profile())
+            self.names = names
 
-            parse_end_time = datetime.datetime.now() - start_time
             app.logger.debug("Parsed XML, building tree")
             # Attempt to build the tree
-            build_tree(self, data_dict)
-            total_time = datetime.datetime.now() - start_time
-            log = f"File Loaded in {total_time.total_seconds()} seconds. " \
-                  f"(Took {parse_end_time.total_seconds()} seconds to parse)"
+            with Instrumentation.span("build_tree") as build_span:
+                build_tree(self, data_dict)
+            self.document = data_dict
+            log = f"File Loaded in {parse_span.seconds + build_span.seconds} seconds. " \
+                  f"(Took {parse_span.seconds} seconds to parse)"
             # Return with metrics
             self.load_event.emit(log)
 
@@ -92,6 +164,99 @@ class XMLViewModel(QStandardItemModel):
             app.logger.exception(message)
             self.load_event.emit(message)
 
+    def _build_collection(self):
+        """
+        Adds a root for the collection and lists its files in the background, a row is added for each file as it
+        is found
+        :return:
+        """
+        self.clear()
+        self._file_items = {}
+        self.names = self.collection.names
+        self.invisibleRootItem().appendRow(XMLDataItem(self.collection.name, {}, key=self.collection.name))
+        self._built((), 1)
+        if self.listing_worker is not None:
+            self.listing_worker.cancel()
+
+        collection = self.collection
+        worker = Worker(lambda _worker: collection.list_files(_worker.is_cancelled, _worker.report))
+        worker.signals.progress.connect(partial(self.files_listed_event, worker))
+        worker.signals.finished.connect(partial(self.listing_finished_event, worker))
+        worker.signals.failed.connect(self.load_event)
+        self.listing_worker = worker
+        worker.start()
+        self.load_event.emit(f"Listing {collection.name} ...")
+
+    def files_listed_event(self, worker, files):
+        if worker is not self.listing_worker:
+            return
+        root = self.item(0)
+        rows = []
+        for key, file in files:
+            if (root.key, key) not in self.hidden:
+                rows.append(XMLFileItem(key, file))
+                self._file_items[file] = rows[-1]
+        root.appendRows(rows)
+        self._built((root.key,), len(rows))
+
+    def listing_finished_event(self, worker, count):
+        if worker is not self.listing_worker:
+            return
+        self.listing_worker = None
+        self.load_event.emit(f"{count} file(s) in {self.collection.name}")
+
+    def _fetch_file(self, item):
+        """
+        Adds the document of a file of the collection under its item and starts parsing the files after it
+        :param item: an XMLFileItem
+        :return:
+        """
+        try:
+            with Instrumentation.span("collection_fetch", file=item.file):
+                document, evicted = self.collection.document(item.file)
+        except Exception as e:
+            item.failed = True
+            message = f"Unable to load {item.file}: {str(e)}"
+            app.logger.warning(message)
+            self.load_event.emit(message)
+            return
+        path = item.path()
+        rows = [XMLDataItem(self.display_name(key), document[key], key=key) for key in document
+                if path + (key,) not in self.hidden]
+        item.insertRows(0, rows)
+        self._built(path, len(rows))
+        for file in evicted:
+            # The document is no longer cached, its items are built again if the file is expanded
+            released = self._file_items.get(file)
+            if released is not None and released.rowCount():
+                self._forget(released.path())
+                released.removeRows(0, released.rowCount())
+        self.collection.prefetch_after(item.file)
+
+    def close(self):
+        """
+        Stops the background work of this model and releases its items and document. Views, panels and workers
+        may still hold a reference to the model for a while, so nothing large is left for them to keep alive
+        :return:
+        """
+        if self.listing_worker is not None:
+            self.listing_worker.cancel()
+            self.listing_worker = None
+        if self.collection is not None:
+            self.collection.close()
+        self.clear()
+        self.document = None
+        self._file_items = {}
+        self._fetched = _BuiltRows()
+        self.built_items = 0
+        self.collapsed.clear()
+        self.memory_target = None
+
+    def display_name(self, name):
+        if self.names is None:
+            return name
+        return self.names.display(name, AppSettings.show_namespace_uris())
+
     def canFetchMore(self, index: QModelIndex):
         """
         Returns true if the item referenced by the index has children, but hasn't been built
@@ -99,6 +264,8 @@ class XMLViewModel(QStandardItemModel):
         :return: If item already has children or does not have children at all, return false
         """
         item = self.itemFromIndex(index)
+        if isinstance(item, XMLFileItem):
+            return not item.hasChildren() and not item.failed
         if item is not None:
             # If it already has children or does not have children at all, return false
             return not (item.hasChildren() or (len(item.datadict) == 0 and len(item.datalist) == 0))
@@ -112,20 +279,28 @@ class XMLViewModel(QStandardItemModel):
         :return: returns nothing. Inserts all child-nodes under the parent
         """
         item = self.itemFromIndex(parent)
-        if item is not None:
-            rows = []
-            if item.nodetype == ItemType.DICT:
-                for child in item.datadict:
-                    rows.append(XMLDataItem(child, item.datadict[child]))
-            elif item.nodetype == ItemType.LIST:
-                for index, element in enumerate(item.datalist):
-                    rows.append(XMLDataItem(item.name, element))
-            else:
-                app.logger.warn("This case shouldnt occur! Test expansion functions!!")
-            app.logger.debug(f"Adding {len(rows)} child(ren) to {item.text()}")
-            self.beginInsertRows(parent, 0, len(rows))
-            item.insertRows(0, rows)
-            self.endInsertRows()
+        if isinstance(item, XMLFileItem):
+            self._fetch_file(item)
+        elif item is not None:
+            with Instrumentation.span("fetchMore") as fetch_span:
+                rows = []
+                path = item.path() if self.hidden else None
+                if item.nodetype == ItemType.DICT:
+                    for child in item.datadict:
+                        if path is None or path + (child,) not in self.hidden:
+                            rows.append(XMLDataItem(self.display_name(child), item.datadict[child], key=child))
+                elif item.nodetype == ItemType.LIST:
+                    for index, element in enumerate(item.datalist):
+                        if path is None or path + (index,) not in self.hidden:
+                            rows.append(XMLDataItem(item.name, element, key=index))
+                else:
+                    app.logger.warn("This case shouldnt occur! Test expansion functions!!")
+                if app.logger.isEnabledFor(logging.DEBUG):
+                    app.logger.debug("Adding %d child(ren) to %s", len(rows), item.text())
+                # The item notifies the model and any proxies of the inserted rows
+                item.insertRows(0, rows)
+                self._built(path if path is not None else item.path(), len(rows))
+            fetch_span.args["rows"] = len(rows)
         else:
             super().fetchMore(parent)
 
@@ -136,6 +311,8 @@ class XMLViewModel(QStandardItemModel):
         :return: True if the parent has children or can have children
         """
         item = self.itemFromIndex(parent)
+        if isinstance(item, XMLFileItem):
+            return item.hasChildren() or not item.failed
         if item is not None:
             return item.hasChildren() or len(item.datadict) > 0 or len(item.datalist) > 0
         else:
@@ -152,50 +329,228 @@ class XMLViewModel(QStandardItemModel):
             if item.hasChildren():
                 return item.rowCount()
             else:
-                app.logger.debug(f"Visit node for the first time")
+                app.trace("Visit node for the first time")
                 return 0
         else:
             return super().rowCount(parent)
 
+    def hide_indexes(self, indexes):
+        """
+        Removes many rows at once and remembers their paths so that they stay hidden when the file is reloaded.
+        Rows are grouped by parent and each run of contiguous rows is removed with a single call, from the bottom
+        up so that the rows still to be removed keep their numbers
+        :param indexes: the indexes to hide
+        :return: the number of rows removed
+        """
+        selected = {QPersistentModelIndex(index) for index in indexes if index.isValid()}
+        rows_by_parent = {}
+        for index in selected:
+            # Descendants of a selected item are removed along with it
+            ancestor = index.parent()
+            while ancestor.isValid() and QPersistentModelIndex(ancestor) not in selected:
+                ancestor = ancestor.parent()
+            if ancestor.isValid():
+                continue
+            path = self.itemFromIndex(QModelIndex(index)).path()
+            self.hidden.add(path)
+            self._forget(path)
+            parent = self._fetched.find(path[:-1])
+            if parent is not None and parent.rows:
+                parent.rows -= 1
+                self.built_items -= 1
+            rows_by_parent.setdefault(QPersistentModelIndex(index.parent()), set()).add(index.row())
+
+        removed = 0
+        for parent, rows in rows_by_parent.items():
+            for first, count in self._row_ranges(rows):
+                self.removeRows(first, count, QModelIndex(parent))
+                removed += count
+        return removed
+
+    def child_of(self, item, key):
+        """
+        :param item: a built item, or the invisible root
+        :param key: the key of the child
+        :return: the child item with the key, or None if it has not been built or does not exist
+        """
+        rows = item.rowCount()
+        # List elements are usually at the row of their position, unless some were hidden
+        if isinstance(key, int) and key < rows:
+            child = item.child(key)
+            if child is not None and child.key == key:
+                return child
+        for row in range(rows):
+            child = item.child(row)
+            if child.key == key:
+                return child
+        return None
+
+    def index_of(self, path):
+        """
+        The index of the item at a path, building the items on the way
+        :param path: the keys from the top of the document
+        :return: the index, which is invalid if there is no item at the path
+        """
+        item = self.invisibleRootItem()
+        for key in path:
+            if item is not self.invisibleRootItem() and self.canFetchMore(item.index()):
+                self.fetchMore(item.index())
+            item = self.child_of(item, key)
+            if item is None:
+                return QModelIndex()
+        return item.index()
+
+    def _built(self, path, rows):
+        self._fetched.add(path, rows)
+        self.built_items += rows
+        if self.collapsed:
+            self._schedule_release()
+
+    def _forget(self, path):
+        """
+        Stops counting the rows built below a path, before they are removed
+        :param path: the path of the item whose descendants are removed
+        :return: the number of rows
+        """
+        rows = self._fetched.remove(path)
+        self.built_items -= rows
+        return rows
+
+    def node_collapsed(self, index):
+        item = self.itemFromIndex(index)
+        if item is not None and item.rowCount():
+            path = item.path()
+            self.collapsed[path] = QPersistentModelIndex(index)
+            self.collapsed.move_to_end(path)
+            # Every persistent index is updated when rows are added or removed, the oldest are let go
+            while len(self.collapsed) > MAX_COLLAPSED:
+                self.collapsed.popitem(last=False)
+            self._schedule_release()
+
+    def node_expanded(self, index):
+        item = self.itemFromIndex(index)
+        if item is not None and self.collapsed:
+            self.collapsed.pop(item.path(), None)
+
+    def _schedule_release(self):
+        # Rows are never removed while the view is in the middle of expanding or fetching
+        if not self._release_pending:
+            self._release_pending = True
+            QTimer.singleShot(0, self.release_collapsed)
+
+    def release_collapsed(self):
+        """
+        Releases the children of the least recently collapsed nodes while the tree is over its budgets. They are
+        built again from the document if the node is expanded again. The first time the process is over its memory
+        budget, the tree is given a target of half its size at that moment and is kept to it from then on. Memory
+        freed by Python is not always returned to the system, so the resident size stays over the budget and
+        halving the tree on every release would discard nearly all of it
+        :return: the number of rows released
+        """
+        self._release_pending = False
+        item_budget = AppSettings.tree_item_budget()
+        memory_budget = AppSettings.memory_budget()
+        if self.memory_target is None and memory_budget is not None and \
+                Instrumentation.current_rss() > memory_budget:
+            self.memory_target = self.built_items // 2
+            app.logger.debug(f"Over the memory budget, the tree is kept to {self.memory_target} item(s)")
+        targets = [target for target in (self.memory_target, item_budget) if target is not None]
+        if not targets or self.built_items <= min(targets):
+            return 0
+        target = min(targets)
+
+        released = 0
+        while self.collapsed and self.built_items > target:
+            path, index = self.collapsed.popitem(last=False)
+            # Nodes below a node that was already released are gone with it
+            item = self.itemFromIndex(QModelIndex(index)) if index.isValid() else None
+            if item is None or not item.rowCount():
+                continue
+            released += self._forget(path)
+            item.removeRows(0, item.rowCount())
+        if released:
+            Instrumentation.count("tree_items_released", released)
+            app.logger.debug(f"Released {released} item(s) of collapsed nodes, {self.built_items} left")
+        return released
+
+    def restore_hidden(self):
+        """
+        Forgets every hidden path, the next reload shows them again
+        :return:
+        """
+        self.hidden.clear()
+
     @staticmethod
-    def get_models_sorted_by_ancestry(model_indices):
+    def _row_ranges(rows):
+        """
+        Merges row numbers into runs of contiguous rows
+        :param rows: the row numbers
+        :return: (first row, count) tuples, the last run first
+        """
+        ranges = []
+        for row in sorted(rows, reverse=True):
+            if ranges and ranges[-1][0] == row + 1:
+                ranges[-1] = (row, ranges[-1][1] + 1)
+            else:
+                ranges.append((row, 1))
+        return ranges
+
+
+class XMLFilterProxyModel(QSortFilterProxyModel):
+    """
+    Shows only the branches of an XMLViewModel that lead to a match, and everything below a match.
+    The paths are worked out ahead of time against the whole document, so children are still fetched lazily
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.matches = set()
+        self.visible = set()
+
+    def set_paths(self, matches, visible):
         """
-        Sorts the indices so that they can be deleted sequentially without changing the reference to anoter index
-        in the lust. Sorts from child with least ancestors to the most
-        :param model_indices:
+        :param matches: the paths of the matching nodes
+        :param visible: the paths of the matching nodes and all of their ancestors
         :return:
         """
-        ancestries = []
-        max_len = 0
-        # For each selection
-        for item in model_indices:
-            ancestry = []
-            tmp = item
-            # Create its path
-            while tmp.parent().row() >= 0:
-                ancestry.insert(0, tmp.row())
-                tmp = tmp.parent()
-            # And pad it with zeros
-            if len(ancestry) > max_len:
-                max_len = len(ancestry)
-            ancestries.append((item, ancestry))
-        # And pad it with zeros
-        for i in range(0, len(ancestries)):
-            ancestries[i] = (ancestries[i][0], ancestries[i][1] + [0] * (max_len - len(ancestries[i][1])))
-        # Sort these in reverse order
-        for i in range(max_len - 1, -1, -1):
-            ancestries.sort(key=lambda x: x[1][i], reverse=True)
-
-        return [element[0] for element in ancestries]
+        self.matches = matches
+        self.visible = visible
+        self.invalidateFilter()
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        item = self.sourceModel().itemFromIndex(self.sourceModel().index(source_row, 0, source_parent))
+        if item is None:
+            return False
+        path = item.path()
+        if path in self.visible:
+            return True
+        return any(path[:length] in self.matches for length in range(len(path) - 1, 0, -1))
+
+
+def set_view_model(view, model):
+    """
+    Shows a model in a view. Qt gives the view and each of its headers a new selection model every time the model
+    is set and leaves the old ones to the view, so they are deleted here
+    :param view: a QAbstractItemView
+    :param model: the model to show
+    :return:
+    """
+    view.setModel(model)
+    current = view.selectionModel()
+    for selection in view.findChildren(QItemSelectionModel):
+        if selection is not current:
+            selection.deleteLater()
 
 
 class XMLTableViewModel(QAbstractTableModel):
 
     def __init__(self, tabledata):
         super().__init__()
-        self._tabledata = tabledata
-        self._cols = self._get_columns(tabledata)
-        self._cache = {}
+        with Instrumentation.span("table_build", rows=len(tabledata)):
+            self._tabledata = tabledata
+            self._cols = self._get_columns(tabledata)
+            # Items by row and column, least recently used first. Rows never move, so the positions stay valid
+            self._cache = OrderedDict()
 
     def rowCount(self, parent: QModelIndex = None) -> int:
         return len(self._tabledata)
@@ -213,16 +568,32 @@ class XMLTableViewModel(QAbstractTableModel):
         if not index.isValid():
             return QVariant()
 
-        p_index = QtCore.QPersistentModelIndex(index)
-        item = self._cache.get(p_index)
-        if item is None:
+        cell = (index.row(), index.column())
+        item = self._cache.get(cell)
+        if item is not None:
+            self._cache.move_to_end(cell)
+            Instrumentation.count("table_cache_hits")
+        else:
             row = self._tabledata[index.row()]
             col = self._cols[index.column()]
             if col in row:
                 item = XMLDataItem("", row[col], parent_sub_index=index.row(), column_name=col)
-                self._cache[p_index] = item
+                self._cache[cell] = item
+                if len(self._cache) > MAX_CACHED_CELLS:
+                    self._cache.popitem(last=False)
         return item
 
+    def close(self):
+        """
+        Drops the cached items and the rows, which belong to the document of the tree
+        :return:
+        """
+        self.beginResetModel()
+        self._cache.clear()
+        self._tabledata = []
+        self._cols = []
+        self.endResetModel()
+
     def headerData(self, p_int, orientation, role=None):
         if role == Qt.DisplayRole:
             if orientation == Qt.Horizontal:
@@ -232,21 +603,70 @@ class XMLTableViewModel(QAbstractTableModel):
 
     @staticmethod
     def _get_columns(tabledata):
-        cols = OrderedSet()
+        cols = {}
         for item in tabledata:
-            cols.update(item.keys())
+            cols.update(dict.fromkeys(item.keys()))
         return list(cols)
 
 
+class ColumnTableModel(QAbstractTableModel):
+    """
+    A table over a ColumnStore that is still being filled. Rows and columns appear when refresh is called
+    """
+
+    def __init__(self, store):
+        super().__init__()
+        self.store = store
+        self._rows = 0
+        self._columns = 0
+
+    def refresh(self):
+        columns = len(self.store.names)
+        if columns > self._columns:
+            self.beginInsertColumns(QModelIndex(), self._columns, columns - 1)
+            self._columns = columns
+            self.endInsertColumns()
+        rows = self.store.rows
+        if rows > self._rows:
+            self.beginInsertRows(QModelIndex(), self._rows, rows - 1)
+            self._rows = rows
+            self.endInsertRows()
+
+    def rowCount(self, parent: QModelIndex = None) -> int:
+        return 0 if parent is not None and parent.isValid() else self._rows
+
+    def columnCount(self, parent: QModelIndex = None) -> int:
+        return 0 if parent is not None and parent.isValid() else self._columns
+
+    def data(self, index: QModelIndex, role: int = None):
+        if role != Qt.DisplayRole or not index.isValid():
+            return QVariant()
+        value = self.store.value(index.row(), index.column())
+        return "" if value is None else preview(str(value))
+
+    def item(self, index: QModelIndex):
+        # Rows streamed from the file are not linked to nodes of the tree
+        return None
+
+    def headerData(self, p_int, orientation, role=None):
+        if role == Qt.DisplayRole:
+            if orientation == Qt.Horizontal:
+                return self.store.names[p_int]
+            elif orientation == Qt.Vertical:
+                return p_int
+
+
 class XMLTableView(QTableView):
 
     item_doubleclicked = pyqtSignal(QModelIndex, int, str)
+    status_event = pyqtSignal(str)
 
     def __init__(self, parent, parent_index=None, tabledata=None):
         super().__init__(parent)
         self.tabledata = None
         self.parent_index = None
         self.datamodel = None
+        self.extract_worker = None
         if tabledata is not None and parent_index is not None:
             self.set_data(parent_index, tabledata)
         self.setAlternatingRowColors(True)
@@ -254,6 +674,8 @@ class XMLTableView(QTableView):
         self.setSelectionBehavior(QAbstractItemView.SelectRows)
         self.setSelectionMode(QAbstractItemView.ExtendedSelection)
         self.verticalHeader().setDefaultSectionSize(self.verticalHeader().fontMetrics().height() + 3)
+        # Fixed heights let the view place any row without measuring the rows above it
+        self.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
         self.verticalHeader().hide()
         self.horizontalHeader().setHighlightSections(False)
         self.horizontalHeader().setSectionsMovable(True)
@@ -264,10 +686,92 @@ class XMLTableView(QTableView):
         self.doubleClicked.connect(self.item_double_click)
 
     def set_data(self, parent_index, tabledata):
+        self.cancel_extract()
+        self.close_store()
         self.tabledata = tabledata
         self.parent_index = parent_index
-        self.datamodel = XMLTableViewModel(tabledata)
-        self.setModel(self.datamodel)
+        self._set_model(XMLTableViewModel(tabledata))
+
+    def clear_data(self):
+        """
+        Empties the table, for example when the document its rows came from is closed
+        :return:
+        """
+        self.cancel_extract()
+        self.close_store()
+        self.tabledata = None
+        self.parent_index = None
+        self._set_model(None)
+
+    def _set_model(self, model):
+        # The old table keeps its rows until it is closed
+        previous = self.datamodel
+        self.datamodel = model
+        set_view_model(self, model)
+        if isinstance(previous, XMLTableViewModel):
+            previous.close()
+
+    def tabulate_path(self, file, expression):
+        """
+        Tabulates every element of the file that matches the path. The file is streamed in the background and
+        the table grows while it is read
+        :param file: the file to read
+        :param expression: a path, see XMLColumns.PathPattern
+        :return:
+        """
+        # Streams the file with lxml, which is only imported once a path is tabulated
+        from app import XMLColumns
+
+        self.cancel_extract()
+        try:
+            XMLColumns.PathPattern(expression)
+        except XMLQuery.QueryError as e:
+            self.status_event.emit(str(e))
+            return
+        self.close_store()
+        store = XMLColumns.ColumnStore(memory_rows=AppSettings.table_memory_rows())
+        self.tabledata = None
+        self.parent_index = QModelIndex()
+        self._set_model(ColumnTableModel(store))
+
+        def _extract(worker):
+            with Instrumentation.span("tabulate_path", file=file, path=expression):
+                return XMLColumns.extract(file, expression, store, worker.is_cancelled, worker.report)
+
+        self.extract_worker = Worker(_extract)
+        self.extract_worker.signals.progress.connect(partial(self.extract_progress_event, self.datamodel))
+        self.extract_worker.signals.finished.connect(partial(self.extract_finished_event, self.datamodel,
+                                                             expression))
+        self.extract_worker.signals.failed.connect(self.status_event)
+        self.extract_worker.start()
+        self.status_event.emit(f"Reading {expression} ...")
+
+    def cancel_extract(self):
+        if self.extract_worker is not None:
+            self.extract_worker.cancel()
+            self.extract_worker = None
+
+    def close_store(self):
+        # Removes the spill file of the previous path table
+        if isinstance(self.datamodel, ColumnTableModel):
+            self.datamodel.store.close()
+
+    def extract_progress_event(self, model, rows):
+        if model is self.datamodel:
+            model.refresh()
+            self.status_event.emit(f"Reading ... {rows} row(s)")
+
+    def extract_finished_event(self, model, expression, store):
+        if model is not self.datamodel:
+            return
+        self.extract_worker = None
+        model.refresh()
+        message = f"{expression}: {store.rows} row(s), {len(store.names)} column(s)"
+        if store.spilled:
+            message += ", paged from disk"
+        if store.dropped_columns:
+            message += f", {store.dropped_columns} value(s) in columns past the first {store.max_columns} dropped"
+        self.status_event.emit(message)
 
     def item_double_click(self, index):
         item = index.model().item(index)
@@ -288,6 +792,7 @@ class PropertyPanel(QDockWidget):
         super(PropertyPanel, self).__init__(parent)
         self.table = XMLTableView(parent)
         self.table.item_doubleclicked.connect(self.model_dbl_click_event)
+        self.table.status_event.connect(self.setWindowTitle)
         self._init_ui()
 
     def _init_ui(self):
@@ -303,16 +808,175 @@ class PropertyPanel(QDockWidget):
         self.item_doubleclicked.emit(parent_index, parent_sub_index, coumn_name)
 
     def tabulate(self, parent_index, data):
+        self.setWindowTitle("")
         self.table.set_data(parent_index, data)
 
+    def tabulate_path(self, file, expression):
+        self.table.tabulate_path(file, expression)
+
+    def clear(self):
+        self.setWindowTitle("")
+        self.table.clear_data()
+
+
+class ExpandJob(QObject):
+    """
+    Expands a branch breadth first, a few milliseconds at a time, so that the event loop keeps running.
+    The job stops when it has expanded max_nodes nodes, reached max_depth, used up the memory budget
+    or was cancelled
+    """
+    progress_event = pyqtSignal(int)
+    finished_event = pyqtSignal(str)
+
+    _SLICE_SECONDS = 0.03
+
+    def __init__(self, view, index, max_nodes, max_depth=-1, memory_budget=None):
+        super().__init__(view)
+        self.view = view
+        # The indexes of the queue belong to this model, the view may be given a filter or a new model meanwhile
+        self.model = view.model()
+        self.max_nodes = max_nodes
+        self.max_depth = max_depth
+        self.memory_budget = memory_budget
+        self.expanded = 0
+        self.cancelled = False
+        # Each entry is a parent, the next row to visit, the last row and the depth of the rows
+        self.queue = deque([[QPersistentModelIndex(index.parent()), index.row(), index.row() + 1, 0]])
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self._step)
+
+    def start(self):
+        self.timer.start(0)
+
+    def cancel(self):
+        self.cancelled = True
+
+    def _step(self):
+        model = self.model
+        if self.view.model() is not model:
+            return self._finish(f"Expand stopped after {self.expanded} node(s), the tree was changed")
+        deadline = time.perf_counter() + self._SLICE_SECONDS
+        while self.queue and time.perf_counter() < deadline:
+            if self.cancelled:
+                return self._finish(f"Expand cancelled after {self.expanded} node(s)")
+            if self.expanded >= self.max_nodes:
+                return self._finish(f"Expand stopped at the budget of {self.max_nodes} node(s)")
+
+            entry = self.queue[0]
+            parent, row, last, depth = entry
+            # The parent was removed from the model, or all of its rows have been visited
+            if (not parent.isValid() and depth > 0) or row >= last:
+                self.queue.popleft()
+                continue
+            entry[1] += 1
+
+            index = model.index(row, 0, QModelIndex(parent))
+            if model.canFetchMore(index):
+                model.fetchMore(index)
+            if not model.hasChildren(index):
+                continue
+            self.view.expand(index)
+            self.expanded += 1
+            if self.max_depth < 0 or depth + 1 < self.max_depth:
+                self.queue.append([QPersistentModelIndex(index), 0, model.rowCount(index), depth + 1])
+
+        if self.memory_budget is not None and Instrumentation.current_rss() > self.memory_budget:
+            return self._finish(f"Expand stopped after {self.expanded} node(s), the memory budget was reached")
+        self.progress_event.emit(self.expanded)
+        if not self.queue:
+            self._finish(f"Expanded {self.expanded} node(s)")
+
+    def _finish(self, message):
+        self.timer.stop()
+        self.queue.clear()
+        self.finished_event.emit(message)
+
+
+class RestoreJob(QObject):
+    """
+    Expands the nodes of a ViewState a slice at a time from the event loop, then selects and scrolls to the
+    nodes that were selected. Only the recorded paths are fetched
+    """
+    finished_event = pyqtSignal(str)
+
+    _SLICE_SECONDS = 0.03
+
+    def __init__(self, view, state):
+        super().__init__(view)
+        self.view = view
+        self.state = state
+        self.expanded = 0
+        # Each entry is the parent, or None for the top of the tree, and the trie of its expanded children
+        self.queue = deque([(None, state.expanded)])
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self._step)
+
+    def start(self):
+        self.timer.start(0)
+
+    def cancel(self):
+        self.timer.stop()
+        self.queue.clear()
+
+    def _step(self):
+        model = self.view.treemodel
+        deadline = time.perf_counter() + self._SLICE_SECONDS
+        while self.queue and time.perf_counter() < deadline:
+            parent, trie = self.queue.popleft()
+            if parent is None:
+                parent_item = model.invisibleRootItem()
+            elif parent.isValid():
+                parent_item = model.itemFromIndex(QModelIndex(parent))
+            else:
+                # The parent was removed from the model
+                continue
+            for key, children in trie.items():
+                item = model.child_of(parent_item, key)
+                if item is None:
+                    continue
+                index = item.index()
+                if model.canFetchMore(index):
+                    model.fetchMore(index)
+                self.view.expand(self.view.view_index(index))
+                self.expanded += 1
+                if children:
+                    self.queue.append((QPersistentModelIndex(index), children))
+        if not self.queue:
+            self._finish()
+
+    def _finish(self):
+        self.timer.stop()
+        model = self.view.treemodel
+        selection = self.view.selectionModel()
+        for path in self.state.selected:
+            index = self.view.view_index(model.index_of(path))
+            if index.isValid():
+                selection.select(index, QItemSelectionModel.Select | QItemSelectionModel.Rows)
+        if self.state.current is not None:
+            index = self.view.view_index(model.index_of(self.state.current))
+            if index.isValid():
+                selection.setCurrentIndex(index, QItemSelectionModel.NoUpdate)
+        if self.state.top is not None:
+            index = self.view.view_index(model.index_of(self.state.top))
+            if index.isValid():
+                self.view.scrollTo(index, QAbstractItemView.PositionAtTop)
+        self.finished_event.emit(f"Restored {self.expanded} expanded node(s)")
+
 
 class XMLTreeView(QTreeView):
     path_changed_event = pyqtSignal(str)
     xml_load_event = pyqtSignal(str)
+    file_changed_event = pyqtSignal(str)
+    node_selected_event = pyqtSignal(object)
 
     def __init__(self):
         super().__init__()
         self.treemodel = XMLViewModel()
+        # Only set while a filter is applied, otherwise the view shows the tree model directly
+        self.filtermodel = None
+        self.filter_worker = None
+        self.expand_job = None
+        self.restore_job = None
         self.current_search = []
         self.init_ui()
 
@@ -330,11 +994,46 @@ class XMLTreeView(QTreeView):
         _font = AppSettings.font()
         if _font is not None:
             self.setFont(_font)
+        self.collapsed.connect(lambda index: self.treemodel.node_collapsed(self.source_index(index)))
+        self.expanded.connect(lambda index: self.treemodel.node_expanded(self.source_index(index)))
 
     def get_item(self, index):
-        return self.treemodel.itemFromIndex(index)
+        return self.treemodel.itemFromIndex(self.source_index(index))
+
+    def source_index(self, index):
+        """
+        Maps an index of this view to an index of the tree model
+        """
+        if self.filtermodel is not None and index.model() is self.filtermodel:
+            return self.filtermodel.mapToSource(index)
+        return index
+
+    def view_index(self, source_index):
+        """
+        Maps an index of the tree model to an index of this view
+        """
+        if self.filtermodel is not None:
+            return self.filtermodel.mapFromSource(source_index)
+        return source_index
+
+    def select_path(self, path):
+        """
+        Selects the node at a path of the document, building and expanding only the nodes on the way to it
+        :param path: the keys from the top of the document
+        :return: True if the node was found
+        """
+        index = self.view_index(self.treemodel.index_of(path))
+        if not index.isValid():
+            return False
+        # Scrolling to the node expands its ancestors
+        self.scrollTo(index, QAbstractItemView.PositionAtCenter)
+        self.selectionModel().setCurrentIndex(index, QItemSelectionModel.ClearAndSelect | QItemSelectionModel.Rows)
+        return True
 
     def show_node(self, index, sub_item_index=None, sub_item_field=None):
+        # Tables built from a path of the whole document have no single parent node
+        if not index.isValid():
+            return
         self.scrollTo(index)
         item = self.get_item(index)
         # Build children if possible
@@ -344,27 +1043,234 @@ class XMLTreeView(QTreeView):
         if self.model().hasChildren(index) and sub_item_index is not None:
             child = item.child(sub_item_index)
             if child is not None:
-                self.selectionModel().select(child.index(), QItemSelectionModel.Select)
-                self.scrollTo(child.index())
-
-
-
-
+                child_index = self.view_index(child.index())
+                self.selectionModel().select(child_index, QItemSelectionModel.Select)
+                self.scrollTo(child_index)
 
     def set_file(self, file):
-        if os.path.exists(file) and os.path.isfile(file):
+        if os.path.isdir(file):
+            self.set_files([file])
+        elif os.path.exists(file) and os.path.isfile(file):
             app.logger.debug(f"Attempting to load {file}")
-            self.treemodel = XMLViewModel(file)
-            self.treemodel.load_event.connect(self.model_xml_load_event)
-            self.setModel(self.treemodel)
-            self.current_search.clear()
+            # Opening the same file again keeps the view as it was, otherwise the view is restored as it was left
+            if file == self.treemodel.data_file:
+                state = self.capture_state()
+            else:
+                self.save_state()
+                state = self.saved_state(file)
+            self._set_model(XMLViewModel(file))
+            self.restore_state(state)
+            self.file_changed_event.emit(file)
         else:
             app.logger.debug(f"{file} is not a valid path")
 
+    def set_files(self, files):
+        """
+        Opens a directory, or several files, as a collection
+        :param files: the paths of the files and directories
+        :return:
+        """
+        files = [file for file in files if os.path.exists(file)]
+        if len(files) == 1 and os.path.isfile(files[0]):
+            self.set_file(files[0])
+        elif files:
+            app.logger.debug(f"Attempting to open a collection of {len(files)} path(s)")
+            from app import XMLCollection
+            collection = XMLCollection.Collection(files, AppSettings.collection_cached_documents(),
+                                                  html_profile=AppSettings.html_profile())
+            self.save_state()
+            self._set_model(XMLViewModel(collection=collection))
+            # Panels that read a single file have nothing to show
+            self.file_changed_event.emit("")
+
+    def close_file(self):
+        """
+        Saves the view of the open file and shows an empty tree
+        :return:
+        """
+        self.save_state()
+        self._set_model(XMLViewModel())
+
+    def _set_model(self, model):
+        self.clear_filter()
+        if self.filter_worker is not None:
+            self.filter_worker.cancel()
+            self.filter_worker = None
+        self._cancel_restore()
+        if self.expand_job is not None:
+            self.expand_job.cancel()
+        self.current_search.clear()
+        previous = self.treemodel
+        self.treemodel = model
+        self.treemodel.load_event.connect(self.model_xml_load_event)
+        set_view_model(self, self.treemodel)
+        previous.close()
+
     def reload(self):
+        state = self.capture_state()
         self.treemodel.beginResetModel()
         self.treemodel.reload()
         self.treemodel.endResetModel()
+        self.restore_state(state)
+
+    def capture_state(self):
+        """
+        Records the expanded nodes, selection and scroll position by path. Only the expanded nodes that can be
+        seen are visited
+        :return: a ViewState
+        """
+        with Instrumentation.span("capture_state") as capture_span:
+            state = XMLViewState.ViewState()
+            items = [(self.treemodel.invisibleRootItem(), ())]
+            while items:
+                item, path = items.pop()
+                for row in range(item.rowCount()):
+                    child = item.child(row)
+                    if child.rowCount() and self.isExpanded(self.view_index(child.index())):
+                        child_path = path + (child.key,)
+                        state.add_expanded(child_path)
+                        items.append((child, child_path))
+            for index in self.selectionModel().selectedRows()[:XMLViewState.MAX_SELECTED]:
+                state.selected.append(self.get_item(index).path())
+            current = self.get_item(self.currentIndex())
+            state.current = current.path() if current is not None else None
+            top = self.get_item(self.indexAt(QPoint(0, 0)))
+            state.top = top.path() if top is not None else None
+        capture_span.args["expanded"] = state.expanded_count()
+        return state
+
+    def restore_state(self, state):
+        """
+        Expands and selects the nodes of a state in the background
+        :param state: a ViewState, or None
+        :return:
+        """
+        self._cancel_restore()
+        if state is None or state.is_empty():
+            return
+        job = RestoreJob(self, state)
+        job.finished_event.connect(partial(self.restore_finished_event, job))
+        self.restore_job = job
+        job.start()
+
+    def _cancel_restore(self):
+        if self.restore_job is not None:
+            self.restore_job.cancel()
+            self.restore_job.deleteLater()
+            self.restore_job = None
+
+    def restore_finished_event(self, job, message):
+        job.deleteLater()
+        if self.restore_job is job:
+            self.restore_job = None
+        self.xml_load_event.emit(message)
+
+    def save_state(self):
+        """
+        Saves the view of the open file with the settings, if views are remembered
+        :return:
+        """
+        file = self.treemodel.data_file
+        if file and AppSettings.remember_view_state():
+            AppSettings.save_view_state(file, self.capture_state().to_json())
+
+    @staticmethod
+    def saved_state(file):
+        if not AppSettings.remember_view_state():
+            return None
+        saved = AppSettings.view_state(file)
+        return XMLViewState.ViewState.from_json(saved) if saved is not None else None
+
+    def hide_selected(self):
+        selected = self.selectedIndexes()
+        if len(selected):
+            self.setUpdatesEnabled(False)
+            removed = self.treemodel.hide_indexes([self.source_index(index) for index in selected])
+            self.setUpdatesEnabled(True)
+            self.xml_load_event.emit(f"{removed} node(s) hidden")
+
+    def restore_hidden(self):
+        self.treemodel.restore_hidden()
+        self.reload()
+
+    def expand_budgeted(self, index):
+        """
+        Expands everything below the index within the budgets in the settings. Progress is shown and the
+        expansion can be cancelled
+        :param index: the index to expand
+        :return:
+        """
+        if self.expand_job is not None:
+            self.expand_job.cancel()
+        job = ExpandJob(self, index, AppSettings.expand_node_budget(), AppSettings.expand_depth_budget(),
+                        AppSettings.memory_budget())
+        progress = QProgressDialog("Expanding ...", "Cancel", 0, job.max_nodes, self)
+        progress.setWindowModality(Qt.NonModal)
+        progress.setMinimumDuration(500)
+        progress.canceled.connect(job.cancel)
+        job.progress_event.connect(progress.setValue)
+        job.finished_event.connect(partial(self.expand_finished_event, job, progress))
+        self.expand_job = job
+        job.start()
+
+    def expand_finished_event(self, job, progress, message):
+        progress.close()
+        progress.deleteLater()
+        job.deleteLater()
+        if self.expand_job is job:
+            self.expand_job = None
+        self.xml_load_event.emit(message)
+
+    def set_filter(self, expression):
+        """
+        Shows only the branches with nodes that match the expression. The document is searched in the background
+        :param expression: a filter expression, see XMLQuery.Predicate. An empty expression clears the filter
+        :return:
+        """
+        if self.filter_worker is not None:
+            self.filter_worker.cancel()
+            self.filter_worker = None
+        if not expression:
+            self.clear_filter()
+            return
+        collection = self.treemodel.collection
+        if self.treemodel.document is None and collection is None:
+            return
+        try:
+            predicate = XMLQuery.Predicate(expression)
+        except XMLQuery.QueryError as e:
+            self.xml_load_event.emit(str(e))
+            return
+
+        if collection is not None:
+            # Every file is searched, files that are not cached are parsed for the search only
+            prefix = (collection.name,)
+            self.filter_worker = Worker(lambda worker: collection.filter_paths(predicate, prefix,
+                                                                               worker.is_cancelled))
+        else:
+            document = self.treemodel.document
+            self.filter_worker = Worker(lambda worker: XMLQuery.filter_paths(document, predicate,
+                                                                             worker.is_cancelled))
+        self.filter_worker.signals.finished.connect(partial(self.filter_ready_event, expression))
+        self.filter_worker.signals.failed.connect(self.model_xml_load_event)
+        self.filter_worker.start()
+        self.xml_load_event.emit(f"Filtering on {expression}")
+
+    def filter_ready_event(self, expression, result):
+        self.filter_worker = None
+        matches, visible = result
+        if self.filtermodel is None:
+            self.filtermodel = XMLFilterProxyModel(self)
+            self.filtermodel.setSourceModel(self.treemodel)
+            set_view_model(self, self.filtermodel)
+        self.filtermodel.set_paths(matches, visible)
+        self.xml_load_event.emit(f"{len(matches)} node(s) match {expression}")
+
+    def clear_filter(self):
+        if self.filtermodel is not None:
+            set_view_model(self, self.treemodel)
+            self.filtermodel.deleteLater()
+            self.filtermodel = None
 
     def dragEnterEvent(self, event):
         if event.mimeData().hasUrls():
@@ -381,19 +1287,18 @@ class XMLTreeView(QTreeView):
 
     def dropEvent(self, event):
         if event.mimeData().hasUrls:
-            file = event.mimeData().urls()[0].toLocalFile()
-            self.set_file(file)
+            # Several files, or a directory, are opened as a collection
+            self.set_files([url.toLocalFile() for url in event.mimeData().urls() if url.isLocalFile()])
         else:
             event.ignore()
 
-    def currentChanged(self, current, _):
-        app.logger.error("unimplemented!")
-        pass
-
-    #     item = self.model.itemFromIndex(current)
-    #     if item is not None:
-    #         self.model.get_xpath(item.node)
-    #         self.path_changed_event.emit(self.model.get_xpath(item.node))
+    def currentChanged(self, current, previous):
+        super().currentChanged(current, previous)
+        item = self.get_item(current) if current.isValid() else None
+        if item is not None:
+            path = item.path()
+            self.node_selected_event.emit(path)
+            self.path_changed_event.emit(XMLQuery.PATH_SEPARATOR.join(str(key) for key in path))
 
     def model_xml_load_event(self, message):
         self.xml_load_event.emit(message)
@@ -408,10 +1313,11 @@ class XMLTreeView(QTreeView):
 
         app.logger.debug(f"Search for {criteria}")
         self.selectionModel().clear()
-        self.current_search = self.treemodel.findItems(criteria.text, criteria.options)
+        with Instrumentation.span("search", text=criteria.text):
+            self.current_search = self.treemodel.findItems(criteria.text, criteria.options)
         if len(self.current_search):
             match_number = criteria.match_count % len(self.current_search)
-            match_index = self.current_search[match_number].index()
+            match_index = self.view_index(self.current_search[match_number].index())
             for row in self.current_search:
                 row.highlight = criteria.highlight
                 row.emitDataChanged()
@@ -0,0 +1,436 @@
+import json
+import mmap
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+from lxml import etree
+
+import app
+from app import XMLSource
+
+# Documents smaller than this are always parsed on a single core, the pool overhead is not worth it
+DEFAULT_PARALLEL_THRESHOLD = 32 * 1024 * 1024
+# Each worker gets a few chunks so that a slow chunk does not hold up the whole load
+_CHUNKS_PER_WORKER = 4
+# How much of the file to inspect when looking for the prolog and root element
+_PROLOG_WINDOW = 64 * 1024
+
+_PROLOG_TOKENS = re.compile(rb"\s*(<\?.*?\?>|<!--.*?-->)", re.DOTALL)
+_START_TAG = re.compile(rb"<([^\s/>!?]+)(?:[^>\"']|\"[^\"]*\"|'[^']*')*?(/?)>", re.DOTALL)
+_CHILD_TAG = re.compile(rb"<([^\s/>!?]+)")
+_UNSAFE_MARKERS = (b"<!DOCTYPE", b"<!ENTITY")
+_UNSAFE_BOMS = (b"\xff\xfe", b"\xfe\xff")
+
+TEXT_NODE = "#text"
+COMMENT_NODE = "#comment"
+INSTRUCTION_NODE = "#pi"
+
+# How much of an HTML document is loaded. Full loads everything. Lean leaves out comments, blank text and the
+# bodies of scripts and styles. Outline keeps only the elements that give the page its structure, without text
+HTML_FULL = "full"
+HTML_LEAN = "lean"
+HTML_OUTLINE = "outline"
+HTML_PROFILES = (HTML_FULL, HTML_LEAN, HTML_OUTLINE)
+# Stands in for the body of a script or style that was not loaded
+SKIPPED_BODY = "({} characters not loaded)"
+_SKIPPED_BODIES = ("script", "style")
+# Left out of an outline with everything below them
+_OUTLINE_DROPPED = ("script", "style", "noscript", "template", "meta", "link", "base", "br", "wbr", "hr", "img",
+                    "svg", "math", "picture", "source", "track", "iframe", "object", "embed", "canvas", "audio",
+                    "video", "input", "select", "textarea", "button", "option")
+# Text level elements, they are left out of an outline but the elements inside them are kept
+_OUTLINE_FLATTENED = ("a", "abbr", "b", "bdi", "bdo", "cite", "code", "data", "dfn", "em", "font", "i", "kbd",
+                      "label", "mark", "q", "rp", "rt", "ruby", "s", "samp", "small", "span", "strong", "sub",
+                      "sup", "time", "u", "var")
+
+_executor = None
+_executor_workers = 0
+
+
+class NameTable:
+    """
+    The qualified names of a document. Every distinct element and attribute name is stored once and shared by
+    every node that uses it, so documents that repeat long namespaced names millions of times hold each name once.
+    Names are kept with their prefix, for example soap:Envelope, and the URI of each prefix is remembered so that
+    the names can also be shown with their namespace URI
+    """
+
+    def __init__(self):
+        # The URI of every namespace prefix, the default namespace has the prefix ""
+        self.namespaces = {}
+        self._names = {}
+        self._elements = {}
+        self._attributes = {}
+
+    def intern(self, name):
+        return self._names.setdefault(name, name)
+
+    def element_name(self, element):
+        tag = element.tag
+        key = (tag, element.prefix) if tag[0] == "{" else tag
+        name = self._elements.get(key)
+        if name is None:
+            name = self._elements[key] = self.intern(self._qualify(tag, element.prefix))
+        return name
+
+    def attribute_name(self, element, key):
+        name = self._attributes.get(key)
+        if name is None:
+            prefix = None
+            if key[0] == "{":
+                uri = key[1:key.index("}")]
+                prefix = next((p for p, u in element.nsmap.items() if u == uri and p), None)
+            name = self.intern(f"@{self._qualify(key, prefix)}")
+            # Attribute prefixes do not depend on the scope in practice, the first one is kept
+            self._attributes[key] = name
+        return name
+
+    def display(self, name, uris=False):
+        """
+        The name to show for a node
+        :param name: the name as it is in the document
+        :param uris: show the namespace URI in place of the prefix
+        :return: the name, with {URI}local in place of prefix:local when uris is set
+        """
+        # Text, comments and processing instructions are not in any namespace
+        if not uris or not self.namespaces or name.startswith("#"):
+            return name
+        prefix, _, local = name.rpartition(":")
+        uri = self.namespaces.get(prefix)
+        return f"{{{uri}}}{local}" if uri is not None else name
+
+    def _qualify(self, tag, prefix):
+        if tag[0] != "{":
+            return tag
+        uri, local = tag[1:].split("}", 1)
+        self.namespaces.setdefault(prefix or "", uri)
+        return f"{prefix}:{local}" if prefix else local
+
+
+class UnsplittableDocument(Exception):
+    """
+    Raised when a document cannot be safely split at top level element boundaries
+    """
+    pass
+
+
+def load(file, parallel_threshold=DEFAULT_PARALLEL_THRESHOLD, workers=None, names=None, html_profile=HTML_FULL):
+    """
+    Loads a supported file into a dictionary. The file type is decided by its extension, files compressed with
+    gzip, xz or bzip2 are decompressed while they are read
+    :param file: the file to load
+    :param parallel_threshold: XML files larger than this many bytes are parsed in parallel
+    :param workers: the number of worker processes to use for parallel parsing, defaults to the cpu count
+    :param names: a NameTable to fill with the names of the document
+    :param html_profile: how much of an HTML document to load, one of HTML_PROFILES
+    :return: the document as a dictionary
+    """
+    ext = XMLSource.file_type(file)
+    names = NameTable() if names is None else names
+
+    if ext.startswith(".HTM"):
+        app.logger.debug(f"This is an HTML file, loading the {html_profile} profile")
+        return parse_html(file, html_profile, names)
+    elif ext == ".JSON":
+        app.logger.debug("This is a JSON file")
+        with XMLSource.open_source(file) as source:
+            return json.load(source)
+    elif ext == ".XML":
+        app.logger.debug("This is an XML file")
+        # Compressed files cannot be split without decompressing them first
+        if XMLSource.compression(file) is None and os.path.getsize(file) >= parallel_threshold \
+                and (workers or os.cpu_count() or 1) > 1:
+            try:
+                return parse_parallel(file, workers, names)
+            except UnsplittableDocument as e:
+                app.logger.debug(f"Falling back to single threaded parse. {str(e)}")
+        return parse(file, etree.XMLParser(), names)
+    else:
+        app.logger.debug("This is an Unsupported file. It cannot be loaded")
+        raise Exception("This is an unsupported file. Only HTML, XML and JSON files permitted, optionally compressed "
+                        "with gzip, xz or bzip2")
+
+
+def parse(file, parser, names=None):
+    """
+    Parses the file on the current thread
+    :param file: the file to parse
+    :param parser: the lxml parser to use
+    :param names: a NameTable to fill with the names of the document
+    :return: the document as a dictionary
+    """
+    if XMLSource.compression(file) is None:
+        return to_dict(etree.parse(file, parser=parser).getroot(), names)
+    with XMLSource.open_source(file) as source:
+        return to_dict(etree.parse(source, parser=parser).getroot(), names)
+
+
+def parse_html(file, profile=HTML_FULL, names=None):
+    """
+    Parses an HTML file on the current thread. Scraped pages are mostly inline scripts, styles and blank text, the
+    lean and outline profiles leave these out of the tree before it is converted
+    :param file: the file to parse
+    :param profile: one of HTML_PROFILES
+    :param names: a NameTable to fill with the names of the document
+    :return: the document as a dictionary
+    """
+    if profile not in HTML_PROFILES:
+        raise ValueError(f"Unknown HTML profile {profile}, expected one of {', '.join(HTML_PROFILES)}")
+    if profile == HTML_FULL:
+        return parse(file, etree.HTMLParser(), names)
+
+    # Comments and processing instructions are never added to the tree, blank text is already left out by to_dict
+    parser = etree.HTMLParser(remove_comments=True, remove_pis=True)
+    if XMLSource.compression(file) is None:
+        root = etree.parse(file, parser=parser).getroot()
+    else:
+        with XMLSource.open_source(file) as source:
+            root = etree.parse(source, parser=parser).getroot()
+    if root is None:
+        return {}
+    if profile == HTML_OUTLINE:
+        # Whole subtrees are dropped and text level elements unwrapped inside libxml2, before anything is converted
+        etree.strip_elements(root, *_OUTLINE_DROPPED, with_tail=False)
+        etree.strip_tags(root, *_OUTLINE_FLATTENED)
+        for element in root.iter():
+            element.text = None
+            element.tail = None
+        return to_dict(root, names)
+    return to_dict(root, names, _SKIPPED_BODIES)
+
+
+def to_dict(element, names=None, skipped=None):
+    """
+    Converts an element and everything below it into a dictionary with the element name as its only key
+    """
+    names = NameTable() if names is None else names
+    return {names.element_name(element): element_value(element, names, skipped)}
+
+
+def element_value(element, names, skipped=None):
+    """
+    Converts an element into a dictionary. Attributes are @ keys, children are keyed by name and repeated children
+    become a list. Comments and processing instructions are #comment and #pi keys. Text is the value itself, or a
+    #text key when the element also has attributes or children. Text interrupted by children is kept as a list
+    of the runs of text.
+    Namespace declarations are not attributes, they are collected in the name table
+    :param element: the lxml element
+    :param names: the NameTable the names are interned in
+    :param skipped: the names of elements whose text is not loaded, only its length is given in its place
+    :return: a dictionary, a string, or None for an empty element
+    """
+    value = {}
+    if element.attrib:
+        for key, attribute in element.attrib.items():
+            value[names.attribute_name(element, key)] = attribute
+    repeated = None
+    text = element.text
+    runs = None
+    for child in element:
+        tail = child.tail
+        if tail and not tail.isspace():
+            if runs is None:
+                runs = [text.strip()] if text and not text.isspace() else []
+            runs.append(tail.strip())
+        tag = child.tag
+        if isinstance(tag, str):
+            name = names.element_name(child)
+            if skipped is not None and name in skipped:
+                child_value = _skipped_value(child, names)
+            else:
+                child_value = element_value(child, names, skipped)
+        elif tag is etree.Comment:
+            name = COMMENT_NODE
+            child_value = child.text.strip() if child.text else ""
+        elif tag is etree.ProcessingInstruction:
+            name = INSTRUCTION_NODE
+            child_value = f"{child.target} {child.text}" if child.text else child.target
+        else:
+            continue
+        if name not in value:
+            value[name] = child_value
+        elif repeated is not None and name in repeated:
+            value[name].append(child_value)
+        else:
+            value[name] = [value[name], child_value]
+            repeated = repeated or set()
+            repeated.add(name)
+    if runs is not None:
+        text = runs[0] if len(runs) == 1 else runs
+    else:
+        text = text.strip() if text else None
+    if not value:
+        return text or None
+    if text:
+        value[TEXT_NODE] = text
+    return value
+
+
+def _skipped_value(element, names):
+    value = {names.attribute_name(element, key): attribute for key, attribute in element.attrib.items()}
+    text = SKIPPED_BODY.format(len(element.text)) if element.text else None
+    if not value:
+        return text
+    if text:
+        value[TEXT_NODE] = text
+    return value
+
+
+def parse_parallel(file, workers=None, names=None):
+    """
+    Splits the document at the boundaries of the children of the root element and parses each chunk in a
+    separate process. The results are merged back in document order.
+    :param file: the XML file to parse
+    :param workers: the number of worker processes to use, defaults to the cpu count
+    :param names: a NameTable to fill with the namespaces of the document
+    :return: the document as a dictionary
+    :raises UnsplittableDocument: if the document cannot be safely split
+    """
+    workers = workers or os.cpu_count() or 1
+    names = NameTable() if names is None else names
+    prolog, root_start, root_end, chunks = split_document(file, workers * _CHUNKS_PER_WORKER)
+    app.logger.debug(f"Parsing {len(chunks)} chunk(s) with {workers} worker(s)")
+    jobs = [(file, prolog, root_start, root_end, start, end) for start, end in chunks]
+    results = list(_get_executor(workers).map(_parse_chunk, jobs))
+    for _, namespaces in results:
+        for prefix, uri in namespaces.items():
+            names.namespaces.setdefault(prefix, uri)
+    return _merge([result for result, _ in results])
+
+
+def split_document(file, max_chunks):
+    """
+    Scans the file for the boundaries of the top level elements and divides the body of the root element into
+    contiguous chunks of roughly equal size.
+    :param file: the XML file to scan
+    :param max_chunks: the maximum number of chunks to return
+    :return: a tuple of the prolog, the root start tag, the root end tag and a list of (start, end) offsets
+    :raises UnsplittableDocument: if the document cannot be safely split
+    """
+    with open(file, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        head = mm[:_PROLOG_WINDOW]
+        if head.startswith(_UNSAFE_BOMS):
+            raise UnsplittableDocument("UTF-16 documents cannot be scanned bytewise")
+        for marker in _UNSAFE_MARKERS:
+            if mm.find(marker, 0, _PROLOG_WINDOW) >= 0:
+                raise UnsplittableDocument("Documents with a DTD or entity declarations must be parsed in full")
+
+        # Skip over the XML declaration, comments and processing instructions before the root
+        position = 3 if head.startswith(b"\xef\xbb\xbf") else 0
+        while match := _PROLOG_TOKENS.match(head, position):
+            position = match.end()
+        prolog = head[:position]
+
+        root = _START_TAG.search(head, position)
+        if root is None or root.group(2):
+            raise UnsplittableDocument("Unable to find the root element")
+        root_name = root.group(1)
+        body_start = root.end()
+        body_end = mm.rfind(b"</" + root_name)
+        if body_end < body_start:
+            raise UnsplittableDocument("Unable to find the end of the root element")
+        root_end = mm[body_end:mm.find(b">", body_end) + 1]
+
+        # Split only at the tag of the first child, records in these documents are homogeneous
+        first_child = _CHILD_TAG.search(mm, body_start, body_end)
+        if first_child is None:
+            raise UnsplittableDocument("The root element has no children")
+        marker = b"<" + first_child.group(1)
+
+        boundaries = [body_start]
+        step = (body_end - body_start) // max_chunks
+        if step == 0:
+            raise UnsplittableDocument("The document is too small to split")
+        for target in range(body_start + step, body_end, step):
+            candidate = max(target, boundaries[-1] + 1)
+            while 0 <= (candidate := mm.find(marker, candidate, body_end)):
+                if mm[candidate + len(marker):candidate + len(marker) + 1] in (b" ", b"\t", b"\r", b"\n", b">", b"/"):
+                    break
+                candidate += len(marker)
+            if candidate < 0:
+                break
+            if candidate > boundaries[-1]:
+                boundaries.append(candidate)
+        boundaries.append(body_end)
+
+    if len(boundaries) < 3:
+        raise UnsplittableDocument("The document has too few top level elements to split")
+    return prolog, root.group(0), root_end, list(zip(boundaries, boundaries[1:]))
+
+
+def shutdown():
+    """
+    Stops the worker pool if it was started
+    :return:
+    """
+    global _executor, _executor_workers
+    if _executor is not None:
+        _executor.shutdown(cancel_futures=True)
+        _executor = None
+        _executor_workers = 0
+
+
+def _get_executor(workers):
+    global _executor, _executor_workers
+    if _executor is None or _executor_workers != workers:
+        shutdown()
+        _executor = ProcessPoolExecutor(max_workers=workers)
+        _executor_workers = workers
+    return _executor
+
+
+def _parse_chunk(job):
+    """
+    Parses one chunk of the document. The chunk is wrapped in the root element so that namespace declarations and
+    the encoding in the prolog still apply
+    :param job: a tuple of the file, prolog, root start tag, root end tag, start and end offsets
+    :return: the chunk as a dictionary and the namespaces it uses
+    """
+    file, prolog, root_start, root_end, start, end = job
+    with open(file, "rb") as f:
+        f.seek(start)
+        body = f.read(end - start)
+    try:
+        xml = etree.fromstring(prolog + root_start + body + root_end, parser=etree.XMLParser())
+    except etree.XMLSyntaxError as e:
+        # A split landed somewhere other than a top level boundary, or the document is malformed.
+        # Either way the single threaded parser is the authority on what happens next
+        raise UnsplittableDocument(f"Chunk at {start}-{end} could not be parsed: {str(e)}")
+    names = NameTable()
+    return to_dict(xml, names), names.namespaces
+
+
+def _merge(results):
+    """
+    Merges the chunk results in document order. Repeated elements are combined into a list in the same way
+    they are for a single document. Attributes of the root are taken from the first chunk only
+    :param results: the parsed chunks in document order
+    :return: the merged document
+    """
+    root_name = next(iter(results[0]))
+    merged = None
+    for result in results:
+        body = result[root_name]
+        if body is None:
+            continue
+        if not isinstance(body, dict):
+            # Only text in this chunk
+            body = {TEXT_NODE: body}
+        if merged is None:
+            merged = body
+            continue
+        for key, value in body.items():
+            if key.startswith("@"):
+                continue
+            elif key not in merged:
+                merged[key] = value
+            elif key == TEXT_NODE:
+                merged[key] = [run for runs in (merged[key], value)
+                               for run in (runs if isinstance(runs, list) else [runs])]
+            else:
+                existing = merged[key]
+                if not isinstance(existing, list):
+                    merged[key] = existing = [existing]
+                existing.extend(value if isinstance(value, list) else [value])
+    return {root_name: merged}
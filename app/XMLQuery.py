@@ -0,0 +1,295 @@
+import csv
+import json
+import re
+
+from app import XMLSource
+
+PATH_SEPARATOR = "/"
+TEXT_NODE = "#text"
+# How many nodes are visited between checks for cancellation
+_CANCEL_CHECK_INTERVAL = 4096
+
+_STEP = re.compile(r"^\s*(?P<tag>[^\s\[\]]+)\s*(?:\[\s*(?P<condition>.+?)\s*\])?\s*$")
+_SUBJECT = r"(?P<subject>@[^\s=!,()]+|text\(\))"
+_VALUE = r"(?P<quote>['\"])(?P<value>.*)(?P=quote)"
+_CONDITIONS = (
+    (re.compile(rf"^{_SUBJECT}$"), "exists"),
+    (re.compile(rf"^{_SUBJECT}\s*(?P<op>!?=)\s*{_VALUE}$"), None),
+    (re.compile(rf"^contains\(\s*{_SUBJECT}\s*,\s*{_VALUE}\s*\)$"), "contains"),
+)
+
+
+class QueryError(Exception):
+    pass
+
+
+def resolve(document, path):
+    """
+    Finds the value at a path in a loaded document. The path is a list of keys separated by "/", list elements are
+    addressed by their position. For example "catalog/book/0/title"
+    :param document: the loaded document
+    :param path: the path to resolve, an empty path returns the document
+    :return: the value at the path
+    :raises QueryError: if the path does not exist in the document
+    """
+    value = document
+    for part in filter(None, path.split(PATH_SEPARATOR)):
+        if isinstance(value, dict) and part in value:
+            value = value[part]
+        elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        else:
+            raise QueryError(f"{path} was not found in the document")
+    return value
+
+
+def walk(value, path=""):
+    """
+    Walks a loaded document depth first
+    :param value: the document or a part of it
+    :param path: the path of the value
+    :return: yields a (path, key, value) tuple for every node
+    """
+    if isinstance(value, dict):
+        for key, child in value.items():
+            child_path = f"{path}{PATH_SEPARATOR}{key}" if path else key
+            yield child_path, key, child
+            yield from walk(child, child_path)
+    elif isinstance(value, list):
+        for index, child in enumerate(value):
+            child_path = f"{path}{PATH_SEPARATOR}{index}"
+            yield from walk(child, child_path)
+            if not isinstance(child, (dict, list)):
+                yield child_path, str(index), child
+
+
+def find_text(document, text, case_sensitive=False):
+    """
+    Finds every node whose name or text value contains the text
+    :param document: the loaded document
+    :param text: the text to look for
+    :param case_sensitive: whether the match is case sensitive
+    :return: yields a (path, value) tuple for every match
+    """
+    text = text if case_sensitive else text.lower()
+    for path, key, value in walk(document):
+        leaf = None if isinstance(value, (dict, list)) else ("" if value is None else str(value))
+        candidates = (key, leaf) if leaf is not None else (key,)
+        for candidate in candidates:
+            if text in (candidate if case_sensitive else candidate.lower()):
+                yield path, value
+                break
+
+
+def xpath(file, expression):
+    """
+    Evaluates an XPath expression against an XML or HTML file
+    :param file: the file to query
+    :param expression: the XPath expression
+    :return: yields a (path, value) tuple for every result. Elements are converted in the same way the viewer
+    loads them, other results are returned as they are
+    :raises QueryError: if the file type does not support XPath or the expression is invalid
+    """
+    # The parsers are only imported when a query needs them, the viewer imports this module at startup
+    from lxml import etree
+    from app.XMLLoader import to_dict
+
+    ext = XMLSource.file_type(file)
+    if ext.startswith(".HTM"):
+        parser = etree.HTMLParser()
+    elif ext == ".XML":
+        parser = etree.XMLParser()
+    else:
+        raise QueryError(f"XPath queries are only supported for XML and HTML files, not {ext}")
+
+    with XMLSource.open_source(file) as source:
+        tree = etree.parse(source, parser=parser)
+    try:
+        results = tree.xpath(expression)
+    except etree.XPathError as e:
+        raise QueryError(f"Invalid XPath {expression}: {str(e)}")
+
+    if not isinstance(results, list):
+        yield expression, results
+        return
+    for result in results:
+        if isinstance(result, etree._Element):
+            yield tree.getpath(result), to_dict(result)
+        else:
+            parent = getattr(result, "getparent", lambda: None)()
+            yield (tree.getpath(parent) if parent is not None else expression), str(result)
+
+
+class Predicate:
+    """
+    A test for a single node, written like a simple XPath step
+        order                           every node named order, * matches any name
+        order[@status]                  ... that has a status attribute
+        order[@status='failed']         ... whose status attribute is failed, != is also supported
+        order[text()='x']               ... whose text is x
+        order[contains(@id, '7')]       ... whose id attribute contains 7, text() can be used instead of an attribute
+        /catalog/book/order             ... only the orders at this path, conditions apply to the last name
+    """
+
+    def __init__(self, expression):
+        self.ancestors = None
+        head, bracket, condition = expression.partition("[")
+        if head.strip().startswith(PATH_SEPARATOR):
+            names = [name.strip() for name in head.strip().split(PATH_SEPARATOR)[1:]]
+            if not all(names):
+                raise QueryError(f"Unable to understand the path {head}")
+            self.ancestors = tuple(names[:-1])
+            expression = names[-1] + bracket + condition
+        step = _STEP.match(expression)
+        if step is None:
+            raise QueryError(f"Unable to understand the filter {expression}")
+        self.tag = step.group("tag")
+        self.subject = None
+        self.op = None
+        self.value = None
+        condition = step.group("condition")
+        if condition is None:
+            return
+        for pattern, op in _CONDITIONS:
+            match = pattern.match(condition)
+            if match is not None:
+                self.subject = match.group("subject")
+                self.op = op or match.group("op")
+                self.value = match.groupdict().get("value")
+                return
+        raise QueryError(f"Unable to understand the condition {condition}")
+
+    def matches(self, name, value, path=None):
+        """
+        Tests a node of a loaded document
+        :param name: the name of the node
+        :param value: the value of the node
+        :param path: the path of the node as given by walk_nodes, needed when the predicate starts with a path
+        :return: True if the node passes the test
+        """
+        if self.tag != "*" and self.tag != name:
+            return False
+        if self.ancestors is not None and (path is None or tag_path(path)[:-1] != self.ancestors):
+            return False
+        if self.subject is None:
+            return True
+
+        if self.subject == "text()":
+            subject = text_of(value)
+        elif isinstance(value, dict):
+            subject = value.get(self.subject)
+        else:
+            subject = None
+
+        match self.op:
+            case "exists":
+                return subject is not None
+            case "=":
+                return subject is not None and str(subject) == self.value
+            case "!=":
+                return subject is None or str(subject) != self.value
+            case "contains":
+                return subject is not None and self.value in str(subject)
+        return False
+
+
+def text_of(value):
+    """
+    The text of a node of a loaded document
+    """
+    if isinstance(value, dict):
+        value = value.get(TEXT_NODE)
+    if isinstance(value, list):
+        # The runs of text of an element with mixed content
+        return " ".join(str(run) for run in value if not isinstance(run, (dict, list)))
+    if value is None or isinstance(value, dict):
+        return ""
+    return str(value)
+
+
+def tag_path(path):
+    """
+    The names along a path from walk_nodes, without the list positions
+    """
+    return tuple(key for key in path if not isinstance(key, int))
+
+
+def walk_nodes(value, path=(), name=None):
+    """
+    Walks a loaded document depth first in the same shape as the tree. Attributes are not nodes and the
+    elements of a list are named after the list
+    :param value: the document or a part of it
+    :param path: the path of the value, as a tuple of keys and list positions
+    :param name: the name of the value
+    :return: yields a (path, name, value) tuple for every node that is not itself a list
+    """
+    if isinstance(value, dict):
+        for key, child in value.items():
+            if not key.startswith("@"):
+                yield from _walk_node(path + (key,), key, child)
+    elif isinstance(value, list):
+        for index, element in enumerate(value):
+            yield from _walk_node(path + (index,), name, element)
+
+
+def filter_paths(document, predicate, cancelled=None):
+    """
+    Finds the nodes of a loaded document that pass the predicate
+    :param document: the loaded document
+    :param predicate: a Predicate
+    :param cancelled: a function that returns True when the search should stop
+    :return: a tuple of the paths of the matching nodes and the paths of the matches and all their ancestors,
+    or None if the search was cancelled
+    """
+    matches = set()
+    visible = set()
+    for visited, (path, name, value) in enumerate(walk_nodes(document)):
+        if cancelled is not None and visited % _CANCEL_CHECK_INTERVAL == 0 and cancelled():
+            return None
+        if predicate.matches(name, value, path):
+            matches.add(path)
+            for length in range(len(path), 0, -1):
+                if path[:length] in visible:
+                    break
+                visible.add(path[:length])
+    return matches, visible
+
+
+def tabulate(value):
+    """
+    Converts a list of records into rows and columns. Columns are discovered in the order they first appear,
+    nested values are kept as JSON
+    :param value: a list of dictionaries, or a single dictionary
+    :return: a tuple of the column names and a list of rows
+    """
+    records = value if isinstance(value, list) else [value]
+    columns = {}
+    for record in records:
+        columns.update(dict.fromkeys(record.keys() if isinstance(record, dict) else ["#text"]))
+
+    rows = []
+    for record in records:
+        record = record if isinstance(record, dict) else {"#text": record}
+        rows.append([_cell(record.get(column)) for column in columns])
+    return list(columns), rows
+
+
+def write_csv(value, stream):
+    columns, rows = tabulate(value)
+    writer = csv.writer(stream)
+    writer.writerow(columns)
+    writer.writerows(rows)
+
+
+def _walk_node(path, name, value):
+    if not isinstance(value, list):
+        yield path, name, value
+    yield from walk_nodes(value, path, name)
+
+
+def _cell(value):
+    if value is None:
+        return ""
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
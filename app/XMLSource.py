@@ -0,0 +1,233 @@
+"""
+Opens the files the viewer reads, decompressing .gz, .xz and .bz2 files on the fly. Gzip files can also be read
+from any position: while a gzip file is read, a copy of the decompressor is kept every CHECKPOINT_INTERVAL bytes
+so that a later seek starts decompressing from the nearest copy rather than from the start of the file
+"""
+import bz2
+import io
+import lzma
+import os
+import threading
+import zlib
+
+# Uncompressed bytes between two gzip checkpoints. Each checkpoint holds the 32KB window of the decompressor
+CHECKPOINT_INTERVAL = 16 * 1024 * 1024
+# Compressed bytes fed to the decompressor at a time
+_READ_SIZE = 64 * 1024
+# Decompressed bytes produced at a time, this bounds memory for very compressible input
+_OUTPUT_SIZE = 1024 * 1024
+
+COMPRESSIONS = (".GZ", ".XZ", ".BZ2")
+_GZIP_MAGIC = b"\x1f\x8b"
+
+# Gzip files whose checkpoints are kept after they are closed. Each checkpoint holds a copy of the decompressor and
+# up to _READ_SIZE bytes of input, a file of several GB keeps tens of MB
+_CACHED_CHECKPOINT_FILES = 4
+
+# Checkpoints of the gzip files read most recently, by path, size and modification time. Least recently used first
+_checkpoints = {}
+_checkpoints_lock = threading.Lock()
+
+
+def compression(file):
+    """
+    :return: the compression extension of the file in upper case, or None if it is not compressed
+    """
+    _, ext = os.path.splitext(file)
+    return ext.upper() if ext.upper() in COMPRESSIONS else None
+
+
+def file_type(file):
+    """
+    The extension that decides how a file is loaded, ignoring any compression extension
+    :return: the extension in upper case, for example .XML for both data.xml and data.xml.gz
+    """
+    name = file[:-len(compression(file))] if compression(file) else file
+    return os.path.splitext(name)[1].upper()
+
+
+class Source:
+    """
+    An input file, decompressed while it is read. It can be passed anywhere a binary file is expected
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.size = os.path.getsize(file)
+        self.raw = open(file, "rb")
+        match compression(file):
+            case ".GZ":
+                self.stream = io.BufferedReader(GzipReader(self.raw, _checkpoints_for(file)), _OUTPUT_SIZE)
+            case ".XZ":
+                self.stream = lzma.open(self.raw)
+            case ".BZ2":
+                self.stream = bz2.open(self.raw)
+            case _:
+                self.stream = self.raw
+
+    def read(self, size=-1):
+        return self.stream.read(size)
+
+    def readinto(self, buffer):
+        return self.stream.readinto(buffer)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self.stream.seek(offset, whence)
+
+    def tell(self):
+        return self.stream.tell()
+
+    def progress(self):
+        """
+        :return: the fraction of the file on disk that has been read
+        """
+        return self.raw.tell() / (self.size or 1)
+
+    def close(self):
+        if self.stream is not self.raw:
+            self.stream.close()
+        self.raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+        return False
+
+
+def open_source(file):
+    return Source(file)
+
+
+class _Checkpoint:
+    __slots__ = ("position", "compressed_position", "pending", "decompressor")
+
+    def __init__(self, position, compressed_position, pending, decompressor):
+        self.position = position
+        self.compressed_position = compressed_position
+        self.pending = pending
+        self.decompressor = decompressor
+
+
+class GzipReader(io.RawIOBase):
+    """
+    Decompresses a gzip file, including files of several gzip members. Seeking backwards, or far forwards,
+    resumes from the nearest checkpoint before the target
+    """
+
+    def __init__(self, raw, checkpoints, interval=None):
+        super().__init__()
+        self._raw = raw
+        self._checkpoints = checkpoints
+        self._interval = interval or CHECKPOINT_INTERVAL
+        self._restore(self._checkpoints[0] if self._checkpoints else None)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position - len(self._buffer)
+
+    def readinto(self, buffer):
+        while not self._buffer and not self._eof:
+            self._decompress()
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        del self._buffer[:size]
+        return size
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        match whence:
+            case io.SEEK_CUR:
+                offset += self.tell()
+            case io.SEEK_END:
+                while not self._eof:
+                    self._buffer.clear()
+                    self._decompress()
+                offset += self._position
+        offset = max(offset, 0)
+        if offset < self.tell() or offset - self.tell() > self._interval:
+            self._restore(self._nearest(offset))
+        while self.tell() < offset:
+            if not self._buffer:
+                if self._eof:
+                    break
+                self._decompress()
+                continue
+            del self._buffer[:min(offset - self.tell(), len(self._buffer))]
+        return self.tell()
+
+    def _nearest(self, offset):
+        nearest = None
+        for checkpoint in self._checkpoints:
+            if checkpoint.position > offset:
+                break
+            nearest = checkpoint
+        return nearest
+
+    def _restore(self, checkpoint):
+        self._buffer = bytearray()
+        self._eof = False
+        if checkpoint is None:
+            self._raw.seek(0)
+            self._position = 0
+            self._pending = b""
+            self._decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+            self._member_start = True
+            self._add_checkpoint()
+        else:
+            self._raw.seek(checkpoint.compressed_position)
+            self._position = checkpoint.position
+            self._pending = checkpoint.pending
+            self._decompressor = checkpoint.decompressor.copy()
+            self._member_start = False
+
+    def _add_checkpoint(self):
+        last = self._checkpoints[-1].position if self._checkpoints else -self._interval
+        # A checkpoint between two members would skip the check for the start of the next member
+        if self._position >= last + self._interval and not (self._member_start and self._position):
+            with _checkpoints_lock:
+                if not self._checkpoints or self._checkpoints[-1].position < self._position:
+                    self._checkpoints.append(_Checkpoint(self._position, self._raw.tell(), self._pending,
+                                                         self._decompressor.copy()))
+
+    def _decompress(self):
+        if len(self._pending) < 2:
+            self._pending += self._raw.read(_READ_SIZE)
+        # Anything after the last member that is not another member, such as zero padding, is ignored
+        if not self._pending or self._member_start and not self._pending.startswith(_GZIP_MAGIC):
+            self._eof = True
+            return
+        self._member_start = False
+        data = self._decompressor.decompress(self._pending, _OUTPUT_SIZE)
+        self._pending = self._decompressor.unconsumed_tail
+        if self._decompressor.eof:
+            # The next gzip member, if there is one, starts with the unused data
+            self._pending = self._decompressor.unused_data
+            self._decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+            self._member_start = True
+        self._buffer += data
+        self._position += len(data)
+        self._add_checkpoint()
+
+
+def _checkpoints_for(file):
+    path = os.path.abspath(file)
+    stat = os.stat(file)
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    with _checkpoints_lock:
+        checkpoints = _checkpoints.pop(key, None)
+        if checkpoints is None:
+            # The checkpoints of an earlier version of the file are of no use once it has been rewritten
+            for stale in [cached for cached in _checkpoints if cached[0] == path]:
+                del _checkpoints[stale]
+            checkpoints = []
+        # Most recently used last. A reader that is still open keeps its checkpoints after they are dropped here
+        _checkpoints[key] = checkpoints
+        while len(_checkpoints) > _CACHED_CHECKPOINT_FILES:
+            del _checkpoints[next(iter(_checkpoints))]
+        return checkpoints
@@ -0,0 +1,269 @@
+"""
+Finds the rows of a file and the byte range of every element in one pass, so that any part of the file can be
+shown without reading the whole of it, however long its lines are
+"""
+import mmap
+import re
+import threading
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+
+from app import XMLSource
+
+# The names the loader gives comments and processing instructions, kept here so the source pane does not import it
+COMMENT_NODE = "#comment"
+INSTRUCTION_NODE = "#pi"
+# A row ends at a new line or after this many bytes, single line files are shown as rows of this length
+ROW_LENGTH = 1024
+# The offset of every this many rows is kept, other rows are found by reading forward from the nearest one
+ROWS_PER_BLOCK = 256
+# Blocks of rows kept in memory for painting
+CACHED_BLOCKS = 8
+# Bytes read at a time by the scan
+_SCAN_SIZE = 1024 * 1024
+# Bits of a packed element range that hold its length
+_LENGTH_BITS = 40
+_LENGTH_MASK = (1 << _LENGTH_BITS) - 1
+
+# Comments, processing instructions, CDATA, declarations and start and end tags. Attribute values may hold >
+_TOKEN = re.compile(rb"<(?:(!--.*?--)|(\?.*?\?)|(!\[CDATA\[.*?\]\])|![^>]*|(/?)([^\s/>!?]+)"
+                    rb"(?:[^>\"']|\"[^\"]*\"|'[^']*')*?(/?))>", re.DOTALL)
+
+
+class SourceMap:
+    """
+    The rows of a file and the byte range of its elements. The map is filled by scan, which can run on another
+    thread while rows that were already found are read.
+    Element ranges are kept in the shape of the loaded document: a dictionary of names, a list where a name
+    repeats, and (start, end, children) for each element with children. Elements without children, which are most
+    of them, are a single int that packs their start and length
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.compressed = XMLSource.compression(file) is not None
+        # Element ranges are only found for XML, HTML is repaired by its parser and JSON has no elements
+        self.elements = {} if XMLSource.file_type(file) == ".XML" else None
+        self.size = 0
+        self.rows = 1
+        self.complete = False
+        self._blocks = array("Q", [0])
+        self._row_start = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._source = None
+        self._mmap = None
+
+    def scan(self, cancelled=None, progress=None):
+        """
+        Reads the file once, finding its rows and elements
+        :param cancelled: a function that returns True when the scan should stop
+        :param progress: a function that is called with the fraction of the file read so far
+        :return: this map, or None if cancelled
+        """
+        stack = []
+        names = {}
+        pending = b""
+        with XMLSource.open_source(self.file) as source:
+            while chunk := source.read(_SCAN_SIZE):
+                offset = self.size
+                self._find_rows(chunk, offset)
+                if self.elements is not None:
+                    pending = self._find_elements(pending + chunk, offset - len(pending), stack, names)
+                self.size = offset + len(chunk)
+                if cancelled is not None and cancelled():
+                    return None
+                if progress is not None:
+                    progress(source.progress())
+        if pending:
+            self._find_elements(pending, self.size - len(pending), stack, names, final=True)
+        self.complete = True
+        return self
+
+    def element_range(self, path):
+        """
+        The bytes of the element at a path of the loaded document, or of its nearest ancestor that was found.
+        A path to a repeated name gives the first of the elements
+        :param path: the keys and list positions from the top of the document
+        :return: a (start, end) tuple, or None
+        """
+        node = self.elements
+        found = None
+        for key in path or ():
+            if isinstance(node, dict) and isinstance(key, str) and key in node:
+                node = node[key]
+            elif isinstance(node, list) and isinstance(key, int) and key < len(node):
+                node = node[key]
+            else:
+                break
+            element = node[0] if isinstance(node, list) else node
+            if isinstance(element, tuple):
+                found = element[:2]
+            elif isinstance(element, int):
+                found = _unpack(element)
+            if not isinstance(node, list):
+                node = node[2] if isinstance(node, tuple) else None
+        return found
+
+    def row_of(self, offset):
+        """
+        :return: the row that holds the byte at the offset
+        """
+        block = max(bisect_right(self._blocks, offset) - 1, 0)
+        row = block * ROWS_PER_BLOCK
+        for start, data in self._block_rows(block):
+            if offset < start + len(data):
+                return row
+            row += 1
+        return max(row - 1, 0)
+
+    def read_rows(self, first, count):
+        """
+        :return: a list of (offset, bytes) for up to count rows from the first row
+        """
+        rows = []
+        block, skip = divmod(first, ROWS_PER_BLOCK)
+        while len(rows) < count and block < len(self._blocks):
+            block_rows = self._block_rows(block)
+            rows.extend(block_rows[skip:skip + count - len(rows)])
+            if len(block_rows) < ROWS_PER_BLOCK:
+                break
+            block += 1
+            skip = 0
+        return rows
+
+    def close(self):
+        with self._lock:
+            if self._mmap is not None:
+                self._mmap.close()
+                self._mmap = None
+            if self._source is not None:
+                self._source.close()
+                self._source = None
+            self._cache.clear()
+
+    def _find_rows(self, chunk, offset):
+        start = self._row_start - offset
+        while True:
+            end = start + ROW_LENGTH
+            newline = chunk.find(b"\n", max(start, 0), min(end, len(chunk)))
+            if newline >= 0:
+                start = newline + 1
+            elif end <= len(chunk):
+                start = end
+            else:
+                break
+            if self.rows % ROWS_PER_BLOCK == 0:
+                self._blocks.append(offset + start)
+            self.rows += 1
+        self._row_start = offset + start
+
+    def _find_elements(self, data, offset, stack, names, final=False):
+        """
+        Adds the elements of the data to the map
+        :param final: whether this is the end of the file, otherwise the last token may be incomplete
+        :return: the data from the first token that may be incomplete, it is scanned again with the next chunk
+        """
+        # A token that starts after the last < may go on in the next chunk
+        last = len(data) if final else data.rfind(b"<")
+        done = 0
+        for match in _TOKEN.finditer(data):
+            start, end = match.span()
+            if start >= last:
+                break
+            comment, instruction, cdata, closing, name, empty = match.groups()
+            if name is None and ((comment is None and data.startswith(b"<!--", start)) or
+                                 (cdata is None and data.startswith(b"<![CDATA[", start))):
+                # A comment or CDATA section that goes on past the end of the data
+                break
+            done = end
+            if name is None:
+                if stack and (comment is not None or instruction is not None):
+                    _add_child(stack[-1], COMMENT_NODE if comment is not None else INSTRUCTION_NODE,
+                               _pack(offset + start, offset + end))
+                continue
+            if closing:
+                if stack:
+                    name, element_start, children, _ = stack.pop()
+                    self._close(stack, name, (element_start, offset + end, children) if children
+                                else _pack(element_start, offset + end))
+                continue
+            text = names.get(name)
+            if text is None:
+                text = names[name] = name.decode("utf-8", errors="replace")
+            if empty:
+                self._close(stack, text, _pack(offset + start, offset + end))
+            else:
+                stack.append([text, offset + start, None, None])
+        resume = data.find(b"<", done)
+        return b"" if resume < 0 or final else data[resume:]
+
+    def _close(self, stack, name, node):
+        if stack:
+            _add_child(stack[-1], name, node)
+        else:
+            self.elements.setdefault(name, node)
+
+    def _block_rows(self, block):
+        with self._lock:
+            rows = self._cache.get(block)
+            if rows is not None:
+                self._cache.move_to_end(block)
+                return rows
+        start = self._blocks[block]
+        # The last block of an unfinished scan is still growing
+        end = self._blocks[block + 1] if block + 1 < len(self._blocks) else self.size
+        data = self._read(start, end - start)
+        rows = []
+        position = 0
+        while position < len(data) and len(rows) < ROWS_PER_BLOCK:
+            newline = data.find(b"\n", position, position + ROW_LENGTH)
+            row_end = newline + 1 if newline >= 0 else min(position + ROW_LENGTH, len(data))
+            rows.append((start + position, data[position:row_end]))
+            position = row_end
+        if self.complete or block + 1 < len(self._blocks):
+            with self._lock:
+                self._cache[block] = rows
+                if len(self._cache) > CACHED_BLOCKS:
+                    self._cache.popitem(last=False)
+        return rows
+
+    def _read(self, offset, size):
+        with self._lock:
+            if self.compressed:
+                if self._source is None:
+                    self._source = XMLSource.open_source(self.file)
+                self._source.seek(offset)
+                return self._source.read(size)
+            if self._mmap is None:
+                with open(self.file, "rb") as f:
+                    if not self.size:
+                        return b""
+                    self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            return self._mmap[offset:offset + size]
+
+
+def _pack(start, end):
+    return start << _LENGTH_BITS | (end - start)
+
+
+def _unpack(node):
+    start = node >> _LENGTH_BITS
+    return start, start + (node & _LENGTH_MASK)
+
+
+def _add_child(parent, name, node):
+    # parent is an open element: its name, start, children and the names that repeat
+    children = parent[2]
+    if children is None:
+        children = parent[2] = {}
+    if name not in children:
+        children[name] = node
+    elif parent[3] is not None and name in parent[3]:
+        children[name].append(node)
+    else:
+        children[name] = [children[name], node]
+        if parent[3] is None:
+            parent[3] = set()
+        parent[3].add(name)
@@ -0,0 +1,167 @@
+import json
+import re
+from dataclasses import dataclass, field
+
+from lxml import etree
+
+from app import XMLQuery, XMLSource
+from app.XMLLoader import NameTable
+
+# How many distinct sample values are kept for each path
+MAX_SAMPLES = 3
+# Sample values are cut down to this many characters
+MAX_SAMPLE_LENGTH = 80
+# How many elements are read between checks for cancellation and progress reports
+_CHECK_INTERVAL = 10000
+
+_TYPES = (
+    ("integer", re.compile(r"^[+-]?\d+$")),
+    ("decimal", re.compile(r"^[+-]?(\d+\.\d*|\.\d+)([eE][+-]?\d+)?$")),
+    ("boolean", re.compile(r"^(true|false)$", re.IGNORECASE)),
+    ("date", re.compile(r"^\d{4}-\d{2}-\d{2}([T ]\d{2}:\d{2}(:\d{2}(\.\d+)?)?(Z|[+-]\d{2}:?\d{2})?)?$")),
+)
+
+
+@dataclass
+class PathSummary:
+    """
+    What is known about every node at one path of the document
+    path: the names from the root to the node, separated by /
+    count: how many nodes there are at the path
+    min_per_parent, max_per_parent: the fewest and most of these nodes under a single parent
+    attributes: the number of nodes each attribute was seen on
+    types: the number of text values of each type
+    samples: the first few distinct text values
+    """
+    path: str
+    count: int = 0
+    min_per_parent: int = 0
+    max_per_parent: int = 0
+    attributes: dict = field(default_factory=dict)
+    types: dict = field(default_factory=dict)
+    samples: list = field(default_factory=list)
+    # The number of parents that had at least one of these nodes
+    _parents: int = 0
+
+    def add(self, attributes, text):
+        self.count += 1
+        for name in attributes:
+            self.attributes[name] = self.attributes.get(name, 0) + 1
+        if text is None:
+            return
+        text = text.strip()
+        if not text:
+            return
+        kind = value_type(text)
+        self.types[kind] = self.types.get(kind, 0) + 1
+        if len(self.samples) < MAX_SAMPLES:
+            sample = text[:MAX_SAMPLE_LENGTH]
+            if sample not in self.samples:
+                self.samples.append(sample)
+
+    def add_cardinality(self, per_parent):
+        if self._parents == 0:
+            self.min_per_parent = self.max_per_parent = per_parent
+        else:
+            self.min_per_parent = min(self.min_per_parent, per_parent)
+            self.max_per_parent = max(self.max_per_parent, per_parent)
+        self._parents += 1
+
+
+def value_type(text):
+    for name, pattern in _TYPES:
+        if pattern.match(text):
+            return name
+    return "text"
+
+
+def summarize(file, cancelled=None, progress=None):
+    """
+    Works out the structure of a document in one streaming pass, without building the tree.
+    JSON files cannot be streamed and are loaded in full
+    :param file: the file to summarize
+    :param cancelled: a function that returns True when the summary should stop
+    :param progress: a function that is called with the fraction of the file read so far
+    :return: a list of PathSummary in document order, or None if cancelled
+    """
+    ext = XMLSource.file_type(file)
+    if ext == ".JSON":
+        with XMLSource.open_source(file) as source:
+            return _summarize_document(json.load(source), cancelled)
+    return _summarize_xml(file, html=ext.startswith(".HTM"), cancelled=cancelled, progress=progress)
+
+
+def _summarize_xml(file, html=False, cancelled=None, progress=None):
+    names = NameTable()
+    summaries = {}
+    parents = {}
+    # For every open element: its path and a count of its children by path
+    stack = []
+
+    with XMLSource.open_source(file) as source:
+        events = etree.iterparse(source, events=("start", "end"), html=html, huge_tree=True, remove_comments=True)
+        for visited, (event, element) in enumerate(events):
+            if not isinstance(element.tag, str):
+                continue
+            if event == "start":
+                path = f"{stack[-1][0] if stack else ''}/{names.element_name(element)}"
+                if stack:
+                    children = stack[-1][1]
+                    children[path] = children.get(path, 0) + 1
+                    parents[path] = stack[-1][0]
+                stack.append((path, {}))
+                if path not in summaries:
+                    summaries[path] = PathSummary(path)
+                continue
+
+            path, children = stack.pop()
+            summaries[path].add([names.attribute_name(element, key)[1:] for key in element.attrib], element.text)
+            for child_path, per_parent in children.items():
+                summaries[child_path].add_cardinality(per_parent)
+            # Free what has been read so far, only the open elements are kept
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+
+            if visited % _CHECK_INTERVAL == 0:
+                if cancelled is not None and cancelled():
+                    return None
+                if progress is not None:
+                    progress(source.progress())
+
+    return _finish(summaries, parents)
+
+
+def _summarize_document(document, cancelled=None):
+    summaries = {}
+    parents = {}
+    children_by_parent = {}
+    for visited, (path, name, value) in enumerate(XMLQuery.walk_nodes(document)):
+        if cancelled is not None and visited % _CHECK_INTERVAL == 0 and cancelled():
+            return None
+        tag_path = "/" + "/".join(str(key) for key in path if not isinstance(key, int))
+        parent_path = path[:-2] if isinstance(path[-1], int) else path[:-1]
+        if tag_path not in summaries:
+            summaries[tag_path] = PathSummary(tag_path)
+            parents[tag_path] = tag_path.rsplit("/", 1)[0]
+        attributes = [key[1:] for key in value if key.startswith("@")] if isinstance(value, dict) else []
+        text = XMLQuery.text_of(value)
+        summaries[tag_path].add(attributes, text)
+        per_parent = children_by_parent.setdefault(tag_path, {})
+        per_parent[parent_path] = per_parent.get(parent_path, 0) + 1
+
+    for tag_path, per_parent in children_by_parent.items():
+        for count in per_parent.values():
+            summaries[tag_path].add_cardinality(count)
+    return _finish(summaries, parents)
+
+
+def _finish(summaries, parents):
+    # A path that is missing under some of its parents can occur zero times
+    for path, summary in summaries.items():
+        parent = summaries.get(parents.get(path))
+        if parent is None:
+            summary.min_per_parent = summary.max_per_parent = summary.count
+        elif summary._parents < parent.count:
+            summary.min_per_parent = 0
+    return list(summaries.values())
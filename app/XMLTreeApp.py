@@ -1,40 +1,107 @@
 import os.path
-import os.path
 import sys
+import time
 
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QTimer
 from PyQt5.QtGui import QIcon, QFont
 from PyQt5.QtWidgets import QApplication, QMainWindow
 
 import app
-from app import AppSettings
+from app import AppSettings, Instrumentation, SingleInstance, XMLSource
 from app.AppSettings import SettingsKeys
-from app.Menu import XMLTreeViewContextMenu, MenuHandler
+from app.Menu import MenuHandler
 from app.XMLDataViews import XMLTreeView, PropertyPanel
 
+# When set, the application quits as soon as the window is shown and prints the time it took to stdout
+STARTUP_PROBE_ENV = "XML_TREE_STARTUP_PROBE"
+
 
 class XMLTreeApp(QMainWindow):
     def __init__(self):
         super().__init__()
         self.XML_tree = XMLTreeView()
-        self.property_panel = PropertyPanel(self)
-        self.context_menu = XMLTreeViewContextMenu()
+        # Docks are built the first time they are needed
+        self._property_panel = None
+        self._performance_panel = None
+        self._structure_panel = None
+        self._source_panel = None
+        self._validation_panel = None
         self.menu_handler = MenuHandler(self, self.XML_tree)
         self.init_ui()
 
+    @property
+    def property_panel(self):
+        if self._property_panel is None:
+            self._property_panel = PropertyPanel(self)
+            self._property_panel.item_doubleclicked.connect(self.table_item_clicked)
+            self.addDockWidget(Qt.BottomDockWidgetArea, self._property_panel)
+            self._property_panel.show()
+        return self._property_panel
+
+    @property
+    def performance_panel(self):
+        if self._performance_panel is None:
+            from app.PerformancePanel import PerformancePanel
+
+            self._performance_panel = PerformancePanel(self)
+            self.addDockWidget(Qt.RightDockWidgetArea, self._performance_panel)
+            self._performance_panel.hide()
+        return self._performance_panel
+
+    @property
+    def structure_panel(self):
+        if self._structure_panel is None:
+            from app.StructurePanel import StructurePanel
+
+            self._structure_panel = StructurePanel(self)
+            self._structure_panel.show_path_event.connect(self.show_path_event)
+            self._structure_panel.tabulate_path_event.connect(self.tabulate_path_event)
+            self._structure_panel.visibilityChanged.connect(self.structure_visibility_changed)
+            self.addDockWidget(Qt.LeftDockWidgetArea, self._structure_panel)
+            self._structure_panel.hide()
+        return self._structure_panel
+
+    @property
+    def source_panel(self):
+        if self._source_panel is None:
+            from app.SourcePanel import SourcePanel
+
+            self._source_panel = SourcePanel(self)
+            self._source_panel.visibilityChanged.connect(self.source_visibility_changed)
+            self.addDockWidget(Qt.RightDockWidgetArea, self._source_panel)
+            self._source_panel.hide()
+        return self._source_panel
+
+    @property
+    def validation_panel(self):
+        if self._validation_panel is None:
+            from app.ValidationPanel import ValidationPanel
+
+            self._validation_panel = ValidationPanel(self)
+            self._validation_panel.show_node_event.connect(self.show_node_event)
+            self._validation_panel.visibilityChanged.connect(self.validation_visibility_changed)
+            self.addDockWidget(Qt.BottomDockWidgetArea, self._validation_panel)
+            self._validation_panel.hide()
+        return self._validation_panel
+
     def init_ui(self):
         self.menu_handler.load_file_event.connect(self.load_file_event)
+        self.menu_handler.load_files_event.connect(self.load_files_event)
         self.menu_handler.tabulate_event.connect(self.tabulate_event)
+        self.menu_handler.performance_event.connect(self.performance_event)
+        self.menu_handler.structure_event.connect(self.structure_event)
+        self.menu_handler.source_event.connect(self.source_event)
+        self.menu_handler.validation_event.connect(self.validation_event)
+        self.menu_handler.tabulate_path_event.connect(self.tabulate_path_event)
         self.setMenuBar(self.menu_handler.menubar)
         AppSettings.settings.settings_change_event.connect(self.settings_change_event)
 
-        self.property_panel.item_doubleclicked.connect(self.table_item_clicked)
-
         self.XML_tree.path_changed_event.connect(self.path_changed_event)
         self.XML_tree.xml_load_event.connect(self.timed_message_event)
+        self.XML_tree.file_changed_event.connect(self.file_changed_event)
+        self.XML_tree.node_selected_event.connect(self.node_selected_event)
         self.XML_tree.setContextMenuPolicy(Qt.CustomContextMenu)
         self.XML_tree.customContextMenuRequested.connect(self.context_menu_requested)
-        self.addDockWidget(Qt.BottomDockWidgetArea, self.property_panel)
         self.setCentralWidget(self.XML_tree)
 
         self.setMinimumSize(640, 480)
@@ -42,6 +109,32 @@ class XMLTreeApp(QMainWindow):
         self.setWindowIcon(QIcon.fromTheme("text-x-generic-template"))
 
         self.show()
+        # Fires once the event loop has processed the first paint of the window
+        QTimer.singleShot(0, self.startup_complete_event)
+
+    def startup_complete_event(self):
+        startup = Instrumentation.record("startup", app.STARTED_NS, time.perf_counter_ns() - app.STARTED_NS)
+        app.logger.info(f"Window shown {startup.seconds:.3f} seconds after startup")
+        if os.environ.get(STARTUP_PROBE_ENV):
+            print(startup.seconds, flush=True)
+            QApplication.quit()
+
+    def closeEvent(self, event):
+        self.XML_tree.save_state()
+        if self._validation_panel is not None:
+            self._validation_panel.close_validation()
+        super().closeEvent(event)
+
+    def files_received_event(self, files):
+        # Files given on the command line, or handed over by a later launch
+        if len(files) == 1:
+            self.load_file_event(files[0])
+        elif files:
+            self.load_files_event(files)
+        if self.isMinimized():
+            self.showNormal()
+        self.raise_()
+        self.activateWindow()
 
     def path_changed_event(self, path):
         self.statusBar().showMessage(path)
@@ -59,6 +152,12 @@ class XMLTreeApp(QMainWindow):
         self.timed_message_event("Attempting to load file. Please wait")
         self.setWindowTitle(f"{app.__APP_NAME__} - {os.path.basename(_file)}")
 
+    def load_files_event(self, files):
+        self.XML_tree.set_files(files)
+        self.timed_message_event("Opening the collection. Please wait")
+        name = os.path.basename(files[0].rstrip(os.sep)) if len(files) == 1 else f"{len(files)} files"
+        self.setWindowTitle(f"{app.__APP_NAME__} - {name}")
+
     def tabulate_event(self, parent_index, data):
         self.property_panel.tabulate(parent_index, data)
 
@@ -71,10 +170,71 @@ class XMLTreeApp(QMainWindow):
         else:
             self.XML_search.show()
 
+    def performance_event(self):
+        self.performance_panel.setVisible(not self.performance_panel.isVisible())
+
+    def structure_event(self):
+        self.structure_panel.setVisible(not self.structure_panel.isVisible())
+
+    def structure_visibility_changed(self, visible):
+        if visible:
+            self.structure_panel.summarize(self.XML_tree.treemodel.data_file)
+
+    def source_event(self):
+        self.source_panel.setVisible(not self.source_panel.isVisible())
+
+    def source_visibility_changed(self, visible):
+        if visible:
+            self.source_panel.set_file(self.XML_tree.treemodel.data_file)
+            current = self.XML_tree.get_item(self.XML_tree.currentIndex())
+            if current is not None:
+                self.source_panel.show_path(current.path())
+
+    def validation_event(self):
+        self.validation_panel.setVisible(not self.validation_panel.isVisible())
+
+    def validation_visibility_changed(self, visible):
+        if visible:
+            self.validation_panel.set_file(self.XML_tree.treemodel.data_file)
+
+    def show_node_event(self, path):
+        if not self.XML_tree.select_path(path):
+            self.timed_message_event("The node is not in the tree, it may be hidden or filtered out")
+
+    def file_changed_event(self, _file):
+        # Rows tabulated from the previous document would keep it in memory
+        if self._property_panel is not None:
+            self._property_panel.clear()
+        # The structure and source are only read while their panels are open
+        if self._structure_panel is not None and self._structure_panel.isVisible():
+            self._structure_panel.summarize(_file)
+        if self._source_panel is not None:
+            if self._source_panel.isVisible():
+                self._source_panel.set_file(_file)
+            else:
+                self._source_panel.close_file()
+        if self._validation_panel is not None and self._validation_panel.isVisible():
+            self._validation_panel.set_file(_file)
+
+    def node_selected_event(self, path):
+        if self._source_panel is not None and self._source_panel.isVisible():
+            self._source_panel.show_path(path)
+
+    def show_path_event(self, path):
+        self.XML_tree.set_filter(path)
+
+    def tabulate_path_event(self, path):
+        if self.XML_tree.treemodel.data_file:
+            self.property_panel.tabulate_path(self.XML_tree.treemodel.data_file, path)
+
     def settings_change_event(self, setting, value):
         match setting:
-            case SettingsKeys.toggle_attributes | SettingsKeys.syntax_highlighting:
+            case SettingsKeys.toggle_attributes | SettingsKeys.namespace_uris | SettingsKeys.syntax_highlighting:
                 self.XML_tree.reload()
+            case SettingsKeys.html_profile:
+                file = self.XML_tree.treemodel.data_file
+                if file and XMLSource.file_type(file).startswith(".HTM"):
+                    self.XML_tree.reload()
             case SettingsKeys.font:
                 _font = QFont()
                 if _font.fromString(value):
@@ -83,15 +243,36 @@ class XMLTreeApp(QMainWindow):
 
     def context_menu_requested(self, point):
         index = self.XML_tree.indexAt(point)
-        item = self.XML_tree.treemodel.itemFromIndex(index)
+        item = self.XML_tree.get_item(index)
         if item is not None:
-            self.menu_handler.request_context_menu(self.XML_tree.mapToGlobal(point), item.can_tabulate())
+            self.menu_handler.request_context_menu(self.XML_tree.mapToGlobal(point), item.can_tabulate(),
+                                                   bool(item.large_values))
 
 
 def main():
-    app = QApplication(sys.argv)
-    _ = XMLTreeApp()
-    sys.exit(app.exec_())
+    files = SingleInstance.files_from_arguments(sys.argv[1:])
+    if SingleInstance.enabled(sys.argv) and SingleInstance.forward(files):
+        sys.exit(0)
+    sys.exit(start(files))
+
+
+def start(files):
+    """
+    Starts the application
+    :param files: the files to open
+    :return: the exit code
+    """
+    AppSettings.apply_logging_settings()
+    application = QApplication(sys.argv)
+    window = XMLTreeApp()
+    if SingleInstance.enabled(sys.argv):
+        server = SingleInstance.InstanceServer(window)
+        server.files_received_event.connect(window.files_received_event)
+        server.listen()
+        application.aboutToQuit.connect(server.close)
+    if files:
+        window.files_received_event(files)
+    return application.exec_()
 
 
 if __name__ == '__main__':
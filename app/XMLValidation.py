@@ -0,0 +1,363 @@
+"""
+Validates documents against an XSD, DTD or RelaxNG schema. Validation runs in a worker process that keeps the
+schemas it has compiled, so the UI process never holds a second copy of the document and a schema is only compiled
+again when its file changes. Nothing in here imports Qt
+"""
+import itertools
+import multiprocessing
+import os
+import queue
+import re
+from bisect import bisect_right
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from lxml import etree
+
+from app import Instrumentation, XMLSource
+from app.XMLLoader import NameTable
+
+# Errors reported for one document, a document that fails everywhere would otherwise report millions
+MAX_ERRORS = 10000
+# Errors sent from the worker process at a time
+_BATCH_SIZE = 200
+# Compiled schemas kept by the worker process
+_CACHED_SCHEMAS = 16
+# How many elements are read between checks for cancellation
+_CHECK_INTERVAL = 4096
+# A step of the XPath libxml2 gives for an error, for example item[3], p:item[3] or *[3]
+_STEP = re.compile(r"^(?P<name>[^\[]+)(?:\[(?P<position>\d+)\])?$")
+
+SCHEMA_TYPES = {".XSD": "XSD", ".DTD": "DTD", ".RNG": "RelaxNG"}
+
+
+class ValidationError(Exception):
+    pass
+
+
+# A problem found in the document. The path is the keys of the node in the loaded document, or None when the
+# problem could not be placed on a node
+Issue = namedtuple("Issue", ["line", "column", "level", "message", "path"])
+
+
+def schema_type(schema_file):
+    """
+    :param schema_file: the schema, or None to use the DTD declared by the document
+    :return: XSD, DTD or RelaxNG
+    """
+    if schema_file is None:
+        return "DTD"
+    kind = SCHEMA_TYPES.get(os.path.splitext(schema_file)[1].upper())
+    if kind is None:
+        raise ValidationError(f"{os.path.basename(schema_file)} is not an XSD, DTD or RelaxNG (.rng) schema")
+    return kind
+
+
+def validate(file, schema_file=None, report=None, cancelled=None, max_errors=MAX_ERRORS):
+    """
+    Validates a document in this process
+    :param file: the document, which may be compressed
+    :param schema_file: the schema, or None to use the DTD declared by the document
+    :param report: a function that is called with lists of Issue as they are placed
+    :param cancelled: a function that returns True when the validation should stop
+    :param max_errors: the most issues to report
+    :return: the number of issues found, which may be more than were reported, or None if cancelled
+    """
+    if XMLSource.file_type(file) != ".XML":
+        raise ValidationError("Only XML documents can be validated")
+    kind = schema_type(schema_file)
+    validator = _compiled_schema(schema_file) if schema_file is not None else None
+    if cancelled is not None and cancelled():
+        return None
+
+    if kind == "XSD":
+        # Most documents are valid. An XSD can be checked while the document is streamed, without building a tree
+        with Instrumentation.span("validate_stream", file=file):
+            valid = _stream_valid(file, validator, cancelled)
+        if valid is None:
+            return None
+        if valid:
+            return 0
+
+    # The document is parsed into an lxml tree, which only lives in this process and only while it is validated.
+    # The tree gives the line and node of each problem
+    parser = etree.XMLParser(huge_tree=True, resolve_entities=False, no_network=True,
+                             load_dtd=schema_file is None)
+    with Instrumentation.span("validate_parse", file=file), XMLSource.open_source(file) as source:
+        tree = etree.parse(source, parser)
+    if validator is None:
+        if tree.docinfo.internalDTD is None:
+            raise ValidationError("The document does not declare a DTD, choose a schema to validate against")
+        validator = tree.docinfo.internalDTD
+    if cancelled is not None and cancelled():
+        return None
+
+    with Instrumentation.span("validate", schema=kind):
+        validator.validate(tree)
+    errors = list(validator.error_log)
+    placer = _NodePlacer(tree)
+    batch = []
+    for error in errors[:max_errors]:
+        batch.append(Issue(error.line, error.column, error.level_name, error.message, placer.place(error)))
+        if len(batch) >= _BATCH_SIZE:
+            if cancelled is not None and cancelled():
+                return None
+            if report is not None:
+                report(batch)
+            batch = []
+    if batch and report is not None:
+        report(batch)
+    return len(errors)
+
+
+def _stream_valid(file, validator, cancelled):
+    """
+    :return: whether the document is valid against the XSD, or None if cancelled
+    """
+    with XMLSource.open_source(file) as source:
+        events = etree.iterparse(source, events=("end",), schema=validator, huge_tree=True, resolve_entities=False,
+                                 no_network=True)
+        try:
+            for visited, (_, element) in enumerate(events):
+                element.clear()
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+                if visited % _CHECK_INTERVAL == 0 and cancelled is not None and cancelled():
+                    return None
+        except etree.XMLSyntaxError:
+            # Either invalid or malformed, the tree pass tells which and where
+            return False
+    return True
+
+
+def _compiled_schema(schema_file):
+    """
+    The compiled schema, from the cache while its file has not changed
+    """
+    key = (os.path.abspath(schema_file), os.stat(schema_file).st_mtime_ns)
+    validator = _schemas.pop(key, None)
+    if validator is None:
+        with Instrumentation.span("compile_schema", schema=schema_file):
+            try:
+                match schema_type(schema_file):
+                    case "XSD":
+                        validator = etree.XMLSchema(etree.parse(schema_file))
+                    case "RelaxNG":
+                        validator = etree.RelaxNG(etree.parse(schema_file))
+                    case "DTD":
+                        validator = etree.DTD(schema_file)
+            except (etree.XMLSyntaxError, etree.XMLSchemaParseError, etree.RelaxNGParseError,
+                    etree.DTDParseError) as e:
+                raise ValidationError(f"Unable to read the schema {os.path.basename(schema_file)}: {str(e)}")
+    # Most recently used last
+    _schemas[key] = validator
+    while len(_schemas) > _CACHED_SCHEMAS:
+        del _schemas[next(iter(_schemas))]
+    return validator
+
+
+_schemas = {}
+
+
+class _NodePlacer:
+    """
+    Finds the node of the loaded document that an error is about. libxml2 gives the XPath of the element for
+    most errors, otherwise the last element that starts on the line of the error is used
+    """
+
+    def __init__(self, tree):
+        self.tree = tree
+        self.names = NameTable()
+        self.namespaces = None
+        self._lines = None
+        self._elements = None
+        # The position of each child among the children of the same name, by parent
+        self._positions = {}
+        # The element children of a parent, all of them and by tag
+        self._children = {}
+
+    def place(self, error):
+        element = self._find(error.path) if error.path else None
+        if element is None and error.line > 0:
+            element = self._at_line(error.line)
+        return self._path(element) if element is not None else None
+
+    def _find(self, path):
+        """
+        Follows the steps of the path. Evaluating it as XPath takes time in proportion to the number of siblings,
+        for every error
+        """
+        steps = path.strip("/").split("/")
+        element = self.tree.getroot()
+        if not steps or not self._matches(element, steps[0]):
+            return None
+        for step in steps[1:]:
+            match = _STEP.match(step)
+            if match is None:
+                return None
+            children, by_tag = self._children_of(element)
+            position = int(match.group("position") or 1) - 1
+            name = match.group("name")
+            if name == "*":
+                candidates = children
+            else:
+                tag = self._tag(element, name)
+                candidates = by_tag.get(tag, []) if tag is not None else []
+            if position >= len(candidates):
+                return None
+            element = candidates[position]
+        return element
+
+    def _matches(self, element, step):
+        match = _STEP.match(step)
+        return match is not None and match.group("name") in ("*", self._tag(element, match.group("name")),
+                                                             element.tag)
+
+    def _tag(self, element, name):
+        prefix, _, local = name.rpartition(":")
+        if not prefix:
+            return local
+        if self.namespaces is None:
+            # Prefixes are collected once from the whole document, they may be declared below the root
+            self.namespaces = {}
+            for declaring in self.tree.iter(tag=etree.Element):
+                for declared, uri in declaring.nsmap.items():
+                    if declared:
+                        self.namespaces.setdefault(declared, uri)
+        uri = element.nsmap.get(prefix) or self.namespaces.get(prefix)
+        return f"{{{uri}}}{local}" if uri is not None else None
+
+    def _children_of(self, parent):
+        found = self._children.get(parent)
+        if found is None:
+            children = list(parent.iterchildren(tag=etree.Element))
+            by_tag = {}
+            for child in children:
+                by_tag.setdefault(child.tag, []).append(child)
+            found = self._children[parent] = (children, by_tag)
+        return found
+
+    def _at_line(self, line):
+        if self._lines is None:
+            self._elements = [element for element in self.tree.iter(tag=etree.Element)]
+            self._lines = [element.sourceline or 0 for element in self._elements]
+        position = bisect_right(self._lines, line) - 1
+        return self._elements[position] if position >= 0 else None
+
+    def _path(self, element):
+        path = []
+        while element is not None:
+            parent = element.getparent()
+            name = self.names.element_name(element)
+            if parent is not None:
+                positions = self._positions.get(parent)
+                if positions is None:
+                    positions = self._positions[parent] = self._number(parent)
+                position, repeated = positions[element]
+                # Repeated names are a list in the loaded document
+                if repeated:
+                    path.append(position)
+            path.append(name)
+            element = parent
+        return tuple(reversed(path))
+
+    def _number(self, parent):
+        counts = {}
+        positions = {}
+        for child in parent.iterchildren(tag=etree.Element):
+            name = self.names.element_name(child)
+            positions[child] = (counts.get(name, 0), name)
+            counts[name] = counts.get(name, 0) + 1
+        return {child: (position, counts[name] > 1) for child, (position, name) in positions.items()}
+
+
+# The worker process, its queue of issues and the number of the last validation that was cancelled
+_executor = None
+_issues = None
+_cancel = None
+_jobs = itertools.count()
+
+
+def start(file, schema_file=None):
+    """
+    Starts validating a document in the worker process
+    :param file: the document
+    :param schema_file: the schema, or None to use the DTD declared by the document
+    :return: a Validation to read the issues from
+    """
+    global _executor, _issues, _cancel
+    if _executor is None:
+        context = multiprocessing.get_context()
+        _issues = context.Queue()
+        _cancel = context.Value("q", -1)
+        _executor = ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=_init_worker,
+                                        initargs=(_issues, _cancel))
+    # Issues of a cancelled validation may still be in the queue, they are told apart by the job
+    job = next(_jobs)
+    return Validation(job, _executor.submit(_validate_job, job, file, schema_file))
+
+
+def shutdown():
+    """
+    Stops the worker process if it was started
+    :return:
+    """
+    global _executor, _issues, _cancel
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+        _issues = None
+        _cancel = None
+
+
+class Validation:
+    """
+    A validation running in the worker process
+    """
+
+    def __init__(self, job, future):
+        self.job = job
+        self.future = future
+
+    def wait(self, report=None, cancelled=None):
+        """
+        Waits for the validation, passing on the issues as the worker process sends them
+        :param report: a function that is called with lists of Issue
+        :param cancelled: a function that returns True when the validation should stop
+        :return: the number of issues found, see validate
+        """
+        issues = _issues
+        while True:
+            if cancelled is not None and cancelled():
+                _cancel.value = self.job
+                return None
+            try:
+                job, batch = issues.get(timeout=0.1)
+            except queue.Empty:
+                # The worker process failed before it could say that it was done
+                if self.future.done() and self.future.exception() is not None:
+                    return self.future.result()
+                continue
+            if job != self.job:
+                # Left over from a validation that was cancelled
+                continue
+            if batch is None:
+                # Raises the error of the validation, if there was one
+                return self.future.result()
+            if report is not None:
+                report([Issue(*issue) for issue in batch])
+
+
+def _init_worker(issues, cancel):
+    global _issues, _cancel
+    _issues = issues
+    _cancel = cancel
+
+
+def _validate_job(job, file, schema_file):
+    try:
+        return validate(file, schema_file, lambda batch: _issues.put((job, [tuple(issue) for issue in batch])),
+                        lambda: _cancel.value == job)
+    finally:
+        # Tells the reader that every issue has been sent
+        _issues.put((job, None))
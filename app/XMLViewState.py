@@ -0,0 +1,84 @@
+"""
+The expanded nodes, selection and scroll position of a tree, kept by path so that they can be restored after the
+model is rebuilt or the file is opened again
+"""
+
+# Expanded nodes kept when a state is saved, a state is stored with the settings and should stay small
+MAX_SAVED_NODES = 10000
+# Selected rows kept in a state
+MAX_SELECTED = 1000
+
+
+class ViewState:
+    """
+    Expanded nodes are kept as a trie of paths: each node is a dictionary from the key of a child to the trie of
+    that child. A key is the name of a node, or the position of an element among the elements with the same name
+    """
+
+    def __init__(self, expanded=None, selected=None, current=None, top=None):
+        self.expanded = expanded if expanded is not None else {}
+        self.selected = selected if selected is not None else []
+        # The path of the current item and of the item at the top of the view
+        self.current = current
+        self.top = top
+
+    def add_expanded(self, path):
+        node = self.expanded
+        for key in path:
+            node = node.setdefault(key, {})
+
+    def expanded_count(self):
+        count = 0
+        nodes = [self.expanded]
+        while nodes:
+            node = nodes.pop()
+            count += len(node)
+            nodes.extend(node.values())
+        return count
+
+    def is_empty(self):
+        return not self.expanded and not self.selected and self.current is None
+
+    def to_json(self, max_nodes=MAX_SAVED_NODES):
+        """
+        :param max_nodes: the most expanded nodes to keep, nodes nearer the top are kept first
+        :return: the state as lists and values that can be written as JSON. Keys of the trie may be numbers, so
+        it is written as nested [key, children] pairs rather than as objects
+        """
+        return {
+            "expanded": _encode(self.expanded, [max_nodes]),
+            "selected": [list(path) for path in self.selected],
+            "current": list(self.current) if self.current is not None else None,
+            "top": list(self.top) if self.top is not None else None,
+        }
+
+    @staticmethod
+    def from_json(value):
+        """
+        :param value: a value written by to_json
+        :return: the state, or None if the value is not a state
+        """
+        try:
+            return ViewState(_decode(value["expanded"]),
+                             [tuple(path) for path in value["selected"]],
+                             tuple(value["current"]) if value["current"] is not None else None,
+                             tuple(value["top"]) if value["top"] is not None else None)
+        except (KeyError, TypeError, ValueError):
+            return None
+
+
+def _encode(node, remaining):
+    pairs = []
+    for key, children in node.items():
+        if remaining[0] <= 0:
+            break
+        remaining[0] -= 1
+        pairs.append([key, _encode(children, remaining)])
+    return pairs
+
+
+def _decode(pairs):
+    node = {}
+    for key, children in pairs:
+        node[key] = _decode(children)
+    return node
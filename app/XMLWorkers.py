@@ -0,0 +1,46 @@
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+import app
+
+
+class WorkerSignals(QObject):
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(str)
+    progress = pyqtSignal(object)
+
+
+class Worker(QRunnable):
+    """
+    Runs a function on the global thread pool so that the UI stays responsive. The function is called with the
+    worker as its only argument so that it can check is_cancelled and report progress. The result is delivered
+    through signals.finished on the UI thread, unless the worker was cancelled
+    """
+
+    def __init__(self, func):
+        super().__init__()
+        self.func = func
+        self.signals = WorkerSignals()
+        self.cancelled = False
+
+    def run(self):
+        try:
+            result = self.func(self)
+        except Exception as e:
+            app.logger.exception("Background task failed")
+            self.signals.failed.emit(str(e))
+            return
+        if not self.cancelled:
+            self.signals.finished.emit(result)
+
+    def is_cancelled(self):
+        return self.cancelled
+
+    def cancel(self):
+        self.cancelled = True
+
+    def report(self, progress):
+        self.signals.progress.emit(progress)
+
+    def start(self):
+        QThreadPool.globalInstance().start(self)
+        return self
@@ -1,33 +1,111 @@
-
+import atexit
+import itertools
 import logging
 import os
+import queue
 import sys
-
-from PyQt5.QtGui import QIcon
+import time
+from logging.handlers import QueueHandler, QueueListener
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
 
+# The earliest point of startup that can be measured from inside the application
+STARTED_NS = time.perf_counter_ns()
+
+# Below DEBUG, used for the sampled messages in the model and delegate hot paths
+TRACE = 5
+logging.addLevelName(TRACE, "TRACE")
+
+# Environment variables take priority over the saved settings
+LOG_LEVEL_ENV = "XML_TREE_LOG_LEVEL"
+TRACE_SAMPLE_ENV = "XML_TREE_TRACE_SAMPLE"
+DEFAULT_LOG_LEVEL = "INFO"
+
+_trace_sample = 0
+_trace_counter = itertools.count()
+
 
 def _get_logger(app_name):
     formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - '
                                   '%(module)s:[%(funcName)s]:%(lineno)s - %(message)s')
     ch = logging.StreamHandler()
-    ch.setLevel(logging.DEBUG)
     ch.setFormatter(formatter)
+    # Records are written to the stream on a background thread so callers never block on I/O
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, ch, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
     log = logging.getLogger(app_name)
-    log.addHandler(ch)
-    log.setLevel(logging.DEBUG)
+    log.addHandler(QueueHandler(log_queue))
+    # The level in the environment is applied by configure_logging when the package is imported
+    log.setLevel(DEFAULT_LOG_LEVEL)
     return log
 
 
+def _checked_level(level):
+    """
+    A misspelled level in the environment or the settings should not stop the application from starting
+    :param level: a level name such as "DEBUG" or "TRACE", or a level number
+    :return: the level as logging accepts it, DEFAULT_LOG_LEVEL if the level is unknown
+    """
+    if isinstance(level, int):
+        return level
+    name = str(level).strip().upper()
+    if name.isdigit():
+        return int(name)
+    if isinstance(logging.getLevelName(name), int):
+        return name
+    logger.warning(f"Unknown log level {level!r}, using {DEFAULT_LOG_LEVEL}")
+    return DEFAULT_LOG_LEVEL
+
+
+def configure_logging(level=None, trace_sample=None):
+    """
+    Sets the log level and the trace sampling rate. Values set in the environment win over the arguments
+    :param level: a level name such as "DEBUG" or "TRACE", or a level number
+    :param trace_sample: log one in every trace_sample trace messages, 0 turns tracing off
+    :return:
+    """
+    global _trace_sample
+    level = os.environ.get(LOG_LEVEL_ENV, level)
+    if level is not None:
+        logger.setLevel(_checked_level(level))
+
+    trace_sample = os.environ.get(TRACE_SAMPLE_ENV, trace_sample)
+    if trace_sample is not None:
+        try:
+            _trace_sample = max(int(trace_sample), 0)
+        except ValueError:
+            logger.warning(f"Unknown trace sample {trace_sample!r}, tracing is off")
+            _trace_sample = 0
+        # The trace logger propagates to the application handlers regardless of the application log level
+        trace_logger.setLevel(TRACE if _trace_sample else logging.CRITICAL + 1)
+
+
+def trace(message, *args):
+    """
+    Logs one in every N messages at TRACE level, where N is the trace sample rate. Formatting is lazy, pass the
+    values as arguments rather than formatting the message at the call site
+    :param message: the %-style message
+    :param args: the message arguments
+    :return:
+    """
+    if _trace_sample and next(_trace_counter) % _trace_sample == 0:
+        trace_logger.log(TRACE, message, *args, stacklevel=2)
+
+
 __VERSION__ = "0.1.0"
 __NAME__ = "XML Tree"
 __APP_NAME__ = str.format(f"{__NAME__}:{__VERSION__}")
 
 logger = _get_logger(__APP_NAME__)
+trace_logger = logger.getChild("trace")
+configure_logging(trace_sample=0)
 
 
 def theme_icon_with_fallback(icon_name):
+    # Imported here so that the headless tools can use the package without Qt
+    from PyQt5.QtGui import QIcon
     icon = QIcon.fromTheme(icon_name)
     if icon.isNull():
         logger.debug(f"Falling back to resources for icon {icon_name}")
@@ -0,0 +1,22 @@
+"""
+Starts the application, or hands the files to the instance that is already running
+
+    python -m app catalog.xml
+    python -m app --new-instance catalog.xml
+"""
+import sys
+
+from app import SingleInstance
+
+
+def main():
+    files = SingleInstance.files_from_arguments(sys.argv[1:])
+    if SingleInstance.enabled(sys.argv) and SingleInstance.forward(files):
+        return 0
+    # Only a new instance pays for importing the application
+    from app import XMLTreeApp
+    return XMLTreeApp.start(files)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
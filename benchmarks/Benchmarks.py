@@ -0,0 +1,297 @@
+"""
+Benchmarks for the hot paths of the viewer. Runs headless on Qt's offscreen platform and writes the results as JSON
+so that they can be compared across commits.
+
+    python -m benchmarks.Benchmarks --records 20000 --output results.json
+    python -m benchmarks.Benchmarks --compare results.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt5.QtCore import Qt, QT_VERSION_STR
+from PyQt5.QtGui import QPainter, QPixmap
+from PyQt5.QtWidgets import QApplication
+
+import app
+from app import SingleInstance, XMLLoader
+from app.XMLDataViews import XMLViewModel, XMLTableViewModel, XMLTreeView
+from benchmarks.DocumentGenerators import DocumentShape, generate
+
+_VIEWPORT = (1024, 768)
+# Time from interpreter start to the first paint of the main window
+STARTUP_TARGET_SECONDS = 1.0
+# Documents whose type is not their extension
+_EXTENSIONS = {"page": "html"}
+
+
+class BenchmarkContext:
+    """
+    Holds the generated documents for one run so that every benchmark works on the same inputs
+    """
+
+    def __init__(self, shape, work_dir, repeat):
+        self.shape = shape
+        self.work_dir = work_dir
+        self.repeat = repeat
+        self._files = {}
+
+    def document(self, doc_type):
+        if doc_type not in self._files:
+            file = os.path.join(self.work_dir, f"synthetic-{doc_type}.{_EXTENSIONS.get(doc_type, doc_type)}")
+            self._files[doc_type] = generate(file, self.shape, doc_type)
+        return self._files[doc_type]
+
+    def loaded_model(self, doc_type="xml"):
+        """
+        Loads the document and fetches the wide list of records under the root
+        :return: the model and the index of the list of records
+        """
+        model = XMLViewModel(self.document(doc_type))
+        root = model.index(0, 0)
+        model.fetchMore(root)
+        return model, model.index(0, 0, root)
+
+
+def timed(repeat, func, setup=None):
+    """
+    Runs func repeat times and returns the elapsed seconds of each run. setup is not timed and its
+    return value is passed to func
+    """
+    times = []
+    for _ in range(repeat):
+        argument = setup() if setup else None
+        start = time.perf_counter()
+        func(argument) if setup else func()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def bench_load(ctx, doc_type):
+    file = ctx.document(doc_type)
+    return timed(ctx.repeat, lambda: XMLViewModel(file))
+
+
+def bench_load_page(ctx, html_profile):
+    file = ctx.document("page")
+    return timed(ctx.repeat, lambda: XMLLoader.load(file, html_profile=html_profile))
+
+
+def bench_fetch_more(ctx):
+    return timed(ctx.repeat, lambda loaded: loaded[0].fetchMore(loaded[1]), ctx.loaded_model)
+
+
+def bench_delegate(ctx):
+    model, records = ctx.loaded_model()
+    view = XMLTreeView()
+    view.resize(*_VIEWPORT)
+    view.treemodel = model
+    view.setModel(model)
+    view.expand(records.parent())
+    view.expand(records)
+    view.show()
+    QApplication.processEvents()
+
+    delegate = view.itemDelegate()
+    pixmap = QPixmap(view.viewport().size())
+    indexes = []
+    index = view.indexAt(view.viewport().rect().topLeft())
+    while index.isValid() and view.visualRect(index).top() < view.viewport().height():
+        indexes.append(index)
+        index = view.indexBelow(index)
+
+    def paint_viewport():
+        painter = QPainter(pixmap)
+        for _index in indexes:
+            option = view.viewOptions()
+            option.rect = view.visualRect(_index)
+            option.widget = view
+            delegate.sizeHint(option, _index)
+            delegate.paint(painter, option, _index)
+        painter.end()
+
+    times = timed(ctx.repeat, paint_viewport)
+    view.close()
+    return times
+
+
+def bench_table(ctx):
+    model, records = ctx.loaded_model()
+    datalist = model.itemFromIndex(records).datalist
+
+    def build():
+        table = XMLTableViewModel(datalist)
+        # Decode what a viewport would show
+        for row in range(min(table.rowCount(), 50)):
+            for column in range(table.columnCount()):
+                table.data(table.index(row, column), Qt.UserRole)
+
+    return timed(ctx.repeat, build)
+
+
+def bench_search(ctx):
+    def setup():
+        model, records = ctx.loaded_model()
+        model.fetchMore(records)
+        view = XMLTreeView()
+        view.treemodel = model
+        view.setModel(model)
+        return view
+
+    criteria = SimpleNamespace(text="alpha", options=Qt.MatchContains | Qt.MatchRecursive,
+                               match_count=0, highlight=False)
+    return timed(ctx.repeat, lambda view: view.search(criteria), setup)
+
+
+def bench_startup(ctx):
+    """
+    Starts the application in a fresh interpreter so that imports are measured cold. The application reports
+    the time from its first import to the first paint of the window
+    """
+    env = dict(os.environ, XML_TREE_STARTUP_PROBE="1", XML_TREE_LOG_LEVEL="WARNING")
+    root = os.path.join(os.path.dirname(__file__), "..")
+    times = []
+    for _ in range(ctx.repeat):
+        # A viewer that is already open would be handed the launch, and the probe must not take over its socket
+        probe = subprocess.run([sys.executable, "-m", "app.XMLTreeApp", SingleInstance.NEW_INSTANCE_ARGUMENT],
+                               cwd=root, env=env, check=True, capture_output=True, text=True)
+        times.append(float(probe.stdout.split()[-1]))
+    return times
+
+
+TARGETS = {
+    "startup.time_to_window": STARTUP_TARGET_SECONDS,
+}
+
+BENCHMARKS = {
+    "startup.time_to_window": bench_startup,
+    "load.xml": lambda ctx: bench_load(ctx, "xml"),
+    "load.json": lambda ctx: bench_load(ctx, "json"),
+    "load.html": lambda ctx: bench_load(ctx, "html"),
+    "load.page_full": lambda ctx: bench_load_page(ctx, XMLLoader.HTML_FULL),
+    "load.page_lean": lambda ctx: bench_load_page(ctx, XMLLoader.HTML_LEAN),
+    "load.page_outline": lambda ctx: bench_load_page(ctx, XMLLoader.HTML_OUTLINE),
+    "expand.fetch_more": bench_fetch_more,
+    "scroll.delegate": bench_delegate,
+    "tabulate.table_model": bench_table,
+    "search.find_items": bench_search,
+}
+
+
+def run(shape, repeat=5, selected=None):
+    """
+    Runs the benchmarks
+    :param shape: the DocumentShape of the generated documents
+    :param repeat: how many times each benchmark is run
+    :param selected: the names of the benchmarks to run, all of them by default
+    :return: a dictionary of the results, ready to be serialized
+    """
+    results = []
+    with tempfile.TemporaryDirectory(prefix="xml-tree-bench-") as work_dir:
+        ctx = BenchmarkContext(shape, work_dir, repeat)
+        for name, bench in BENCHMARKS.items():
+            if selected and name not in selected:
+                continue
+            times = bench(ctx)
+            results.append({
+                "name": name,
+                "times": times,
+                "min": min(times),
+                "median": statistics.median(times),
+                "mean": statistics.mean(times),
+                "target": TARGETS.get(name),
+            })
+            print(f"{name:<24} min {min(times):9.4f}s  median {statistics.median(times):9.4f}s", file=sys.stderr)
+
+    return {
+        "commit": _git_commit(),
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "qt": QT_VERSION_STR,
+        "platform": platform.platform(),
+        "shape": shape.as_dict(),
+        "repeat": repeat,
+        "results": results,
+    }
+
+
+def compare(baseline, current, tolerance):
+    """
+    Compares the median of every benchmark in the current run with the baseline
+    :return: the names of the benchmarks that are slower than the baseline by more than the tolerance
+    """
+    previous = {result["name"]: result for result in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        before = previous.get(result["name"])
+        if before is None or before["median"] == 0:
+            continue
+        ratio = result["median"] / before["median"]
+        print(f"{result['name']:<24} {ratio:6.2f}x baseline", file=sys.stderr)
+        if ratio > 1 + tolerance:
+            regressions.append(result["name"])
+    return regressions
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(__file__), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for load, expand, scroll, search and tabulate")
+    defaults = DocumentShape()
+    parser.add_argument("--records", type=int, default=defaults.records)
+    parser.add_argument("--depth", type=int, default=defaults.depth)
+    parser.add_argument("--fanout", type=int, default=defaults.fanout)
+    parser.add_argument("--attributes", type=int, default=defaults.attributes)
+    parser.add_argument("--text-length", type=int, default=defaults.text_length)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", nargs="*", choices=list(BENCHMARKS), help="run only these benchmarks")
+    parser.add_argument("--output", help="write the results to this file instead of stdout")
+    parser.add_argument("--compare", help="a previous results file to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed slowdown against the baseline before failing, 0.2 is 20%%")
+    parser.add_argument("--enforce-targets", action="store_true",
+                        help="fail if a benchmark with a target time is slower than its target")
+    args = parser.parse_args()
+
+    app.configure_logging(level="WARNING")
+    _ = QApplication(sys.argv[:1])
+    shape = DocumentShape(args.records, args.depth, args.fanout, args.attributes, args.text_length, args.seed)
+    results = run(shape, args.repeat, args.only)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), results, args.tolerance)
+    if args.enforce_targets:
+        regressions += [result["name"] for result in results["results"]
+                        if result["target"] is not None and result["median"] > result["target"]]
+    if regressions:
+        print(f"Regressions: {', '.join(regressions)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+import html
+import json
+import random
+from dataclasses import dataclass, asdict
+
+_WORDS = ["alpha", "bravo", "charlie", "delta", "echo", "foxtrot", "golf", "hotel", "india", "juliet", "kilo",
+          "lima", "mike", "november", "oscar", "papa", "quebec", "romeo", "sierra", "tango", "uniform"]
+
+
+@dataclass
+class DocumentShape:
+    """
+    Describes the shape of a synthetic document
+    records: the number of children of the root element
+    depth: how many levels of nesting each record has below it
+    fanout: the number of children at every nested level
+    attributes: the number of attributes on every element
+    text_length: the approximate number of characters in every leaf value
+    seed: seeds the random generator so documents are reproducible
+    """
+    records: int = 1000
+    depth: int = 2
+    fanout: int = 3
+    attributes: int = 1
+    text_length: int = 16
+    seed: int = 42
+
+    def as_dict(self):
+        return asdict(self)
+
+
+def generate(file, shape, doc_type=None):
+    """
+    Writes a synthetic document of the given shape to the file
+    :param file: the file to write. If doc_type is not set, the type is decided by the extension
+    :param shape: a DocumentShape
+    :param doc_type: one of xml, json, html or page, a page is an HTML file that looks like a scraped web page
+    :return: the file that was written
+    """
+    doc_type = (doc_type or file.rsplit(".", 1)[-1]).lower()
+    match doc_type:
+        case "xml":
+            generate_xml(file, shape)
+        case "json":
+            generate_json(file, shape)
+        case "html" | "htm":
+            generate_html(file, shape)
+        case "page":
+            generate_page(file, shape)
+        case _:
+            raise ValueError(f"Unable to generate a document of type {doc_type}")
+    return file
+
+
+def generate_xml(file, shape):
+    rand = random.Random(shape.seed)
+    with open(file, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<records>\n')
+        for index in range(shape.records):
+            _write_xml_element(f, rand, "record", index, shape, shape.depth, 1)
+        f.write("</records>\n")
+    return file
+
+
+def generate_json(file, shape):
+    rand = random.Random(shape.seed)
+    document = {"records": {"record": [_json_element(rand, index, shape, shape.depth)
+                                       for index in range(shape.records)]}}
+    with open(file, "w", encoding="utf-8") as f:
+        json.dump(document, f)
+    return file
+
+
+def generate_html(file, shape):
+    rand = random.Random(shape.seed)
+    with open(file, "w", encoding="utf-8") as f:
+        f.write("<!DOCTYPE html>\n<html><head><title>Synthetic</title>"
+                "<style>div { margin: 0; }</style></head>\n<body>\n")
+        for index in range(shape.records):
+            _write_html_element(f, rand, index, shape, shape.depth, 1)
+        f.write("</body></html>\n")
+    return file
+
+
+def generate_page(file, shape):
+    """
+    Writes an HTML page like the ones saved by scrapers: every record is wrapped in links and spans, followed by
+    an inline script and style, and everything is indented
+    """
+    rand = random.Random(shape.seed)
+    with open(file, "w", encoding="utf-8") as f:
+        f.write("<!DOCTYPE html>\n<html>\n<head>\n  <title>Synthetic page</title>\n"
+                '  <meta charset="utf-8">\n  <!-- analytics -->\n</head>\n<body>\n')
+        for index in range(shape.records):
+            f.write(f'  <section id="s{index}">\n    <a href="#s{index}">\n')
+            _write_html_element(f, rand, index, shape, shape.depth, 3)
+            f.write("    </a>\n    <script>\n")
+            for line in range(20):
+                f.write(f"      window.data{index}_{line} = {json.dumps(_text(rand, 60))};\n")
+            f.write(f"    </script>\n    <style>\n      #s{index} {{ margin: {index % 7}px; }}\n    </style>\n"
+                    "  </section>\n")
+        f.write("</body>\n</html>\n")
+    return file
+
+
+def _text(rand, length):
+    words = []
+    size = 0
+    while size < length:
+        word = rand.choice(_WORDS)
+        words.append(word)
+        size += len(word) + 1
+    return " ".join(words)[:max(length, 1)]
+
+
+def _attributes(rand, shape):
+    return {f"attr{i}": _text(rand, 8) for i in range(shape.attributes)}
+
+
+def _write_xml_element(f, rand, tag, index, shape, depth, indent):
+    padding = "  " * indent
+    attrs = "".join(f' {key}="{html.escape(value)}"' for key, value in _attributes(rand, shape).items())
+    f.write(f'{padding}<{tag} id="{index}"{attrs}>')
+    if depth == 0:
+        f.write(html.escape(_text(rand, shape.text_length)))
+    else:
+        f.write("\n")
+        for child in range(shape.fanout):
+            _write_xml_element(f, rand, f"level{shape.depth - depth + 1}", child, shape, depth - 1, indent + 1)
+        f.write(padding)
+    f.write(f"</{tag}>\n")
+
+
+def _json_element(rand, index, shape, depth):
+    element = {f"@{key}": value for key, value in _attributes(rand, shape).items()}
+    element["@id"] = str(index)
+    if depth == 0:
+        element["#text"] = _text(rand, shape.text_length)
+    else:
+        element[f"level{shape.depth - depth + 1}"] = [_json_element(rand, child, shape, depth - 1)
+                                                      for child in range(shape.fanout)]
+    return element
+
+
+def _write_html_element(f, rand, index, shape, depth, indent):
+    padding = "  " * indent
+    attrs = "".join(f' data-{key}="{html.escape(value)}"' for key, value in _attributes(rand, shape).items())
+    if depth == 0:
+        f.write(f'{padding}<span id="n{index}"{attrs}>{html.escape(_text(rand, shape.text_length))}</span>\n')
+    else:
+        f.write(f'{padding}<div id="n{index}"{attrs}>\n')
+        for child in range(shape.fanout):
+            _write_html_element(f, rand, child, shape, depth - 1, indent + 1)
+        f.write(f"{padding}</div>\n")
@@ -0,0 +1,212 @@
+"""
+A long session in a loop. Generated documents are opened, expanded, tabulated, searched and closed over and over
+while the Python heap and the resident size are recorded after every cycle. Growth that keeps going after the first
+cycles is a leak, and the run fails when the growth per cycle is over the thresholds.
+
+    python -m benchmarks.Soak --cycles 200 --output soak.json
+    python -m benchmarks.Soak --records 20000 --cycles 50 --max-heap-growth 32768
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt5.QtCore import Qt, QEventLoop, QSettings, QTimer, QT_VERSION_STR
+from PyQt5.QtWidgets import QApplication
+
+import app
+from app import Instrumentation
+from app.XMLDataViews import XMLTreeView, XMLTableView
+from benchmarks.Benchmarks import _git_commit
+from benchmarks.DocumentGenerators import DocumentShape, generate
+
+# Cycles run before measuring, caches and the allocator settle during these
+WARMUP_CYCLES = 5
+# Rows of a table that are decoded, as a viewport would show them
+_VISIBLE_ROWS = 50
+
+
+class Session:
+    """
+    A tree and a table, as the main window has them, and the documents they are given
+    """
+
+    def __init__(self, files):
+        self.files = files
+        self.tree = XMLTreeView()
+        self.table = XMLTableView(None)
+        self.criteria = SimpleNamespace(text="alpha", options=Qt.MatchContains | Qt.MatchRecursive,
+                                        match_count=0, highlight=True)
+
+    def cycle(self, number):
+        file = self.files[number % len(self.files)]
+        self.tree.set_file(file)
+        model = self.tree.treemodel
+        root = model.index(0, 0)
+        model.fetchMore(root)
+        self.tree.expand(root)
+        records = model.index(0, 0, root)
+        if model.canFetchMore(records):
+            model.fetchMore(records)
+        self.tree.expand(records)
+        # The first records are opened and closed again, which is where released nodes come from
+        for row in range(min(model.rowCount(records), 10)):
+            record = model.index(row, 0, records)
+            if model.canFetchMore(record):
+                model.fetchMore(record)
+            self.tree.expand(record)
+            self.tree.collapse(record)
+
+        item = model.itemFromIndex(records)
+        if isinstance(item.datalist, list):
+            self.table.set_data(records, item.datalist)
+            table = self.table.model()
+            for row in range(min(table.rowCount(), _VISIBLE_ROWS)):
+                for column in range(table.columnCount()):
+                    table.data(table.index(row, column), Qt.UserRole)
+
+        self.tree.search(self.criteria)
+        self.table.clear_data()
+        self.tree.close_file()
+        QApplication.processEvents()
+
+
+def settle():
+    # Objects deleted later are only gone once an event loop delivers their events, and deleting a sender queues
+    # the deletion of the slots connected to it, so the loop is run a few times
+    for _ in range(3):
+        loop = QEventLoop()
+        QTimer.singleShot(0, loop.quit)
+        loop.exec_()
+    gc.collect()
+    # The recent spans are kept up to Instrumentation.MAX_EVENTS, which would read as growth until it is full
+    Instrumentation.reset()
+
+
+def traced_heap():
+    """
+    :return: the bytes allocated by Python since tracing started, leaving out the samples of this harness
+    """
+    snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, __file__),
+                                                          tracemalloc.Filter(False, tracemalloc.__file__)])
+    return sum(stat.size for stat in snapshot.statistics("filename"))
+
+
+def slope(values):
+    """
+    :return: the least squares slope of the values against their position, the growth per cycle
+    """
+    count = len(values)
+    if count < 2:
+        return 0.0
+    mean_x = (count - 1) / 2
+    mean_y = sum(values) / count
+    numerator = sum((x - mean_x) * (y - mean_y) for x, y in enumerate(values))
+    denominator = sum((x - mean_x) ** 2 for x in range(count))
+    return numerator / denominator
+
+
+def run(shape, cycles, documents=3, warmup=WARMUP_CYCLES):
+    """
+    Runs the soak test
+    :param shape: the DocumentShape of the generated documents
+    :param cycles: the number of measured cycles
+    :param documents: how many different documents are opened in turn
+    :param warmup: the number of cycles run before measuring
+    :return: a dictionary of the results, ready to be serialized
+    """
+    samples = []
+    with tempfile.TemporaryDirectory(prefix="xml-tree-soak-") as work_dir:
+        # The view of every document is saved as the session goes, the settings of the user are left alone
+        QSettings.setPath(QSettings.NativeFormat, QSettings.UserScope, work_dir)
+        QSettings.setPath(QSettings.IniFormat, QSettings.UserScope, work_dir)
+        files = []
+        for number, doc_type in zip(range(documents), ["xml", "json", "xml", "html"] * documents):
+            document_shape = DocumentShape(**dict(shape.as_dict(), seed=shape.seed + number))
+            files.append(generate(os.path.join(work_dir, f"soak-{number}.{doc_type}"), document_shape))
+        session = Session(files)
+
+        for number in range(warmup):
+            session.cycle(number)
+        settle()
+        tracemalloc.start()
+        for number in range(cycles):
+            start = time.perf_counter()
+            session.cycle(warmup + number)
+            settle()
+            heap = traced_heap()
+            samples.append({"cycle": number, "seconds": time.perf_counter() - start, "heap": heap,
+                            "rss": Instrumentation.current_rss()})
+            if number % 10 == 0:
+                print(f"cycle {number:5d}  heap {heap / 1024:10.1f} KiB  rss {samples[-1]['rss'] / 1048576:8.1f} MiB",
+                      file=sys.stderr)
+        tracemalloc.stop()
+        session.tree.close()
+        session.table.close()
+
+    return {
+        "commit": _git_commit(),
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "qt": QT_VERSION_STR,
+        "platform": platform.platform(),
+        "shape": shape.as_dict(),
+        "cycles": cycles,
+        "warmup": warmup,
+        "heap_growth_per_cycle": slope([sample["heap"] for sample in samples]),
+        "rss_growth_per_cycle": slope([sample["rss"] for sample in samples]),
+        "samples": samples,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Repeats open, expand, tabulate, search and close to find leaks")
+    defaults = DocumentShape()
+    parser.add_argument("--records", type=int, default=defaults.records)
+    parser.add_argument("--depth", type=int, default=defaults.depth)
+    parser.add_argument("--fanout", type=int, default=defaults.fanout)
+    parser.add_argument("--attributes", type=int, default=defaults.attributes)
+    parser.add_argument("--text-length", type=int, default=defaults.text_length)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--cycles", type=int, default=100)
+    parser.add_argument("--documents", type=int, default=3, help="the number of documents opened in turn")
+    parser.add_argument("--warmup", type=int, default=WARMUP_CYCLES)
+    parser.add_argument("--max-heap-growth", type=float, default=4096,
+                        help="fail if the Python heap grows by more bytes than this per cycle")
+    parser.add_argument("--max-rss-growth", type=float, default=262144,
+                        help="fail if the resident size grows by more bytes than this per cycle")
+    parser.add_argument("--output", help="write the results to this file instead of stdout")
+    args = parser.parse_args()
+
+    app.configure_logging(level="WARNING")
+    _ = QApplication(sys.argv[:1])
+    shape = DocumentShape(args.records, args.depth, args.fanout, args.attributes, args.text_length, args.seed)
+    results = run(shape, args.cycles, args.documents, args.warmup)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump({key: value for key, value in results.items() if key != "samples"}, sys.stdout, indent=2)
+        print()
+
+    failures = []
+    if results["heap_growth_per_cycle"] > args.max_heap_growth:
+        failures.append(f"the heap grows by {results['heap_growth_per_cycle']:.0f} bytes per cycle")
+    if results["rss_growth_per_cycle"] > args.max_rss_growth:
+        failures.append(f"the resident size grows by {results['rss_growth_per_cycle']:.0f} bytes per cycle")
+    if failures:
+        print(f"Leaking: {', '.join(failures)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()